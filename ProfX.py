@@ -4,19 +4,31 @@
 
 import argparse
 from collections import Counter
+from itertools import chain
 from pickle import TRUE
 from tkinter import N
 import config
 import datastructs
 import datetime
+import exporters
 import getpass
+import journal
+import localstore
 import logging
 import os.path
+import queue
 import telnet_ANSI
+import threading
 #import npex
 import re
 import time
 import utils
+import worksheets
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 VERSION = "1.9.0"
 LOGFORMAT = '%(asctime)s: %(name)-11s:%(levelname)-7s:%(message)s'
@@ -30,7 +42,11 @@ console.setFormatter(logging.Formatter(LOGFORMAT))
 logging.getLogger().addHandler(console)
 
 telnet_ANSI.Connection.recognise_Screen_type = config.LOCALISATION.identify_screen #Overrides default function with that from localisation
-TelePath = telnet_ANSI.Connection(Answerback=config.LOCALISATION.ANSWERBACK)
+TelePath = telnet_ANSI.ThreadBoundConnection(telnet_ANSI.Connection(Answerback=config.LOCALISATION.ANSWERBACK)) # Worker threads can bind their own session
+_LIMSCredentials = None     # (user, pw) of the current login, so further sessions can be opened without asking again
+PIPELINE_QUEUE_PAGES = 4    # Search result pages the search session may run ahead of the downloads
+PIPELINE_QUEUE_SPECIMENS = 32   # Downloaded specimens that may wait for export while the next ones are fetched
+RACK_LOCATION_MAX_AGE = datetime.timedelta(days=1)    # How long a cached SFS location is trusted; samples get moved and discarded
 
 class tp_Error():
     def __init__(self, errStr) -> None:
@@ -49,6 +65,16 @@ class tp_HistoryEntry():
     def fromChunks(self):
         pass
 
+    @property
+    def Key(self) -> tuple: return (self.DateTime, self.Event, self.User)
+
+    def to_dict(self) -> dict:
+        return {"SampleID": str(self.SampleID), "TestSet": self.TestSet, "DateTime": self.DateTime, "Event": self.Event, "User": self.User}
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        return cls(data["SampleID"], data["TestSet"], data["DateTime"], data["Event"], data["User"])
+
     def __repr__(self): 
         return f"tp_HistoryEntry(Sample={str(self.SampleID)}, TestSet={self.TestSet}, DateTime={self.DateTime}, Event={self.Event}, User={self.User})"
     
@@ -56,103 +82,220 @@ class tp_HistoryEntry():
         return f"Sample {str(self.SampleID)}, Set {self.TestSet}, {self.DateTime}: {self.Event} {self.User}"
 
 
-#TODO: port over gr lr eq
+TP_HISTORY_TIMESTAMP = "%d-%b-%y %H:%M"
+TP_HISTORY_TS_LEN = len(TP_HISTORY_TIMESTAMP)
+TP_HISTORY_MULTILINE_EVENTS = ["Free text entered/edited by:", "Results entered/edited by:"]
+AOT_CREATOR_EVENT = "Set requested by:"
+
+""" Parses one page of a set's history screen (TelePath.Lines[6]) into tp_HistoryEntry objects, in screen order.
+    Events that run over several lines (free text, results) are joined with ';'."""
+def parse_history_page(Screen:str, SampleID, SetCode:str) -> list:
+    Entries = []
+    historyLines = Screen.split("\r\n")
+    historyLines =  historyLines[1:]
+    historyLines = [ x for x in historyLines if x ]
+
+    index = 0
+    while index < len(historyLines):
+        line = historyLines[index]
+        dateTime = line[:TP_HISTORY_TS_LEN+1]
+        colIndex = line.find(":", TP_HISTORY_TS_LEN, len(line))
+        if colIndex != -1:
+            dateTime = datetime.datetime.strptime(dateTime, TP_HISTORY_TIMESTAMP)
+            event = line[TP_HISTORY_TS_LEN+1:colIndex+1].strip()
+            user  = line[colIndex+1:].strip()
+
+            if event in TP_HISTORY_MULTILINE_EVENTS:
+                moreLines = 0
+                dateTimeMatch = False
+
+                while (dateTimeMatch == False) and (index+moreLines < len(historyLines)):
+                    moreLines = moreLines + 1
+                    try:
+                        datetime.datetime.strptime(historyLines[index+moreLines][:len(TP_HISTORY_TIMESTAMP)+1], TP_HISTORY_TIMESTAMP)
+                        dateTimeMatch = True
+                    except:
+                        continue
+                    
+                event = event + ";".join(historyLines[index+1:index+moreLines])
+                index = index + moreLines - 1   # Land on the line before the next dated one, which the increment below moves to
+
+            Entries.append( tp_HistoryEntry(SampleID, SetCode, dateTime, event, user) )
+        
+        else:
+            logging.debug(f"Warning: Could not parse history event [{line}].")
+        
+        index = index + 1 
+    return Entries
+
+NOTEPAD_INDEX_REGEX = re.compile(r"(\d+)\)\s+(\S+)\s+(\S+)\s+(\S+\s+\S+)")   # "1) AUTHOR ID HH:MM DD.MM.YY", up to two per line
+
+""" Parses the index screen of a specimen notepad in one pass over the ANSI chunks of lines 8 to 21. A line can list two entries side by side;
+    entries are returned in index order, with empty Text."""
+def parse_notepad_index(ANSIChunks:list) -> list:
+    Entries = []
+    for Chunk in ANSIChunks:
+        if Chunk.line < 8 or Chunk.line > 21 or Chunk.deleteMode != 0: continue
+        for Match in NOTEPAD_INDEX_REGEX.finditer(Chunk.text):
+            Index, Author, ID, Authored = Match.groups()
+            Entries.append(datastructs.SpecimenNotepadEntry(ID, Author, "", Index, Authored))
+    Entries.sort(key=lambda x: int(x.Index))
+    return Entries
+
+""" Merges freshly read history entries (in screen order) with stored ones (in the order merge_history() returned them). Fetched is kept
+    as read, repeats included: the same event can genuinely happen twice in a minute. Only the stored entries Fetched already covers
+    are dropped; the others are older than anything fetched, and go after Fetched if the screen lists newest first, before it otherwise."""
+def merge_history(Known:list, Fetched:list) -> list:
+    Remaining = Counter(x.Key for x in Fetched)
+    Older = []
+    for Entry in Known:
+        if Remaining[Entry.Key] > 0:
+            Remaining[Entry.Key] -= 1
+        else:
+            Older.append(Entry)
+    for Entries in (Fetched, Known):    # A single fetched page may not show which way round the screen lists
+        Times = [x.DateTime for x in Entries if isinstance(x.DateTime, datetime.datetime)]
+        if len(Times) >= 2 and Times[0] != Times[-1]:
+            return Fetched + Older if Times[0] > Times[-1] else Older + Fetched
+    return Older + Fetched
+
+
 class tp_SpecimenID(datastructs.SampleID):
     CHECK_INT = 23
     CHECK_LETTERS = ['B', 'W', 'D', 'F', 'G', 'K', 'Q', 'V', 'Y', 'X', 'A', 'S', 'T', 'N', 'J', 'H', 'R', 'P', 'L', 'C', 'Z', 'M', 'E']
+    CHECK_LETTER_INDEX = {Letter: Index for Index, Letter in enumerate(CHECK_LETTERS)}
+    # [Prefix,][YY.]NNNNNNN[[.]C] - covers every layout the old split-on-dots parser accepted.
+    ID_PATTERN = r"(?:(?P<Prefix>[A-Z]),)?(?:(?P<Year>\d{2})\.)?(?P<LabNumber>\d{7})(?:\.?(?P<CheckChar>[A-Z]))?"
+    ID_REGEX = re.compile(ID_PATTERN)
+    ID_LINE_REGEX = re.compile(r"^[ \t]*" + ID_PATTERN + r"[ \t\r]*$", flags=re.M)
 
     def __init__(self, IDStr:str, useLocalisationValidationFun:bool=False):
-        datastructs.SampleID.__init__(self, IDStr, useLocalisationValidationFun)
         #Prefix, Date Part, Number Part, Check Char
         if IDStr == None:
             raise Exception("tp_SpecimenID.__init__(): Received None where expecting IDstr.")
-        self.Prefix     = "A,"
-        self.Year       = None
-        self.LabNumber  = None
-        self.CheckChar  = None
+        datastructs.SampleID.__init__(self, IDStr, useLocalisationValidationFun)
         self.useLocalisationValidationFun = useLocalisationValidationFun
-        IDStr = IDStr.upper()
-        if IDStr[1]==",":
-            self.Prefix = IDStr[:2]
-            IDStr=IDStr[2:]
-        IDStrSplit = IDStr.split(".")
-
-        try:
-            if len(IDStrSplit)==1:
-                #logging.debug("SampleID(): Only one piece of data found. Assuming it's a 7-digit sample number from current year.")
-                if len(IDStrSplit[0]) == 7:
-                    self.LabNumber = int(IDStrSplit[0])
-                elif len(IDStrSplit[0]) == 8:
-                    self.LabNumber = int(IDStrSplit[0][:7])
-                    self.CheckChar = IDStrSplit[0][7]
-
-                else: raise ValueError("Parsing one-piece IDStr. No 7-digit sample id found - cannot estimate Sample ID unambiguously.")
-        
-            elif len(IDStrSplit)==2:
-                #logging.debug("SampleID(): Two pieces of data found. Checking whether Year+ID or ID+CheckDigit...")
-
-                if len(IDStrSplit[0]) == 2:
-                    logging.debug("SampleID(): First entry is len 2, likely Year")
-                    self.Year = int(IDStrSplit[0])
-                elif len(IDStrSplit[0]) == 7:
-                    logging.debug("SampleID(): First entry is len 7, likely Sample ID")
-                    self.LabNumber = int(IDStrSplit[0])
-                else:
-                    raise ValueError(f"Cannot parse '{IDStrSplit[0]}' as Year or Sample ID.")
-
-                if len(IDStrSplit[1]) == 1:
-                    logging.debug("SampleID(): Last entry is len 1, likely Check Digit")
-                    self.CheckChar = IDStrSplit[1]
-                elif len(IDStrSplit[1]) == 7:
-                    logging.debug("SampleID(): Last entry is len 7, likely Sample ID")
-                    self.LabNumber = int(IDStrSplit[1])
-                elif len(IDStrSplit[1]) == 8:
-                    logging.debug("SampleID(): Last entry is len 8, likely Sample ID and check digit")
-                    chkOrd = ord(IDStrSplit[1][-1])
-                    if chkOrd >= 65 and chkOrd <= 90: #it's an ASCII capital letter between A and Z
-                        self.CheckChar = IDStrSplit[1][-1]
-                        self.LabNumber = int(IDStrSplit[1][:-1])
-                else:
-                    raise ValueError(f"Cannot parse '{IDStrSplit[1]}' as Sample ID or Check Digit")
-
-            elif len(IDStrSplit)==3:
-                #logging.debug("SampleID(): Three pieces of data found. Running all tests.")
-                assert len(IDStrSplit[0]) == 2
-                self.Year = int(IDStrSplit[0])
-
-                assert len(IDStrSplit[1]) == 7
-                self.LabNumber = int(IDStrSplit[1])
-
-                assert len(IDStrSplit[2]) == 1
-                self.CheckChar= IDStrSplit[2]
-
-            if not self.Year:
-                #logging.debug("SampleID(): Year not found, using current.")
-                self.Year = int(datetime.datetime.now().strftime("%y"))
-            if not self.CheckChar:
-                #logging.debug("SampleID(): Check digit not present, estimating.")
-                self.iterate_check_digit()
-
-            if not self.LabNumber:
-                raise ValueError("No ID Number assigned after parsing, sample cannot be identified.")
-
-            #logging.debug(f"SampleID(): ID '{str(self)}' assembled. ID is: {['Not Valid', 'Valid'][self.validate()]}")
+        self._raw = IDStr.strip().upper()
+        IDMatch = tp_SpecimenID.ID_REGEX.fullmatch(self._raw)
+        if not IDMatch:
+            self.Prefix     = "A,"
+            self.Year       = None
+            self.LabNumber  = None
+            self.CheckChar  = None
+            self.Packed     = None
+            logging.debug(f"SampleID(): ID parsing failed for {self._raw}.")
+            return
+        self._assign_from_match(IDMatch)
+
+    def _assign_from_match(self, IDMatch) -> None:
+        Prefix, Year, LabNumber, CheckChar = IDMatch.group("Prefix", "Year", "LabNumber", "CheckChar")
+        self.Prefix     = f"{Prefix}," if Prefix else "A,"
+        self.Year       = int(Year) if Year else int(datetime.datetime.now().strftime("%y"))
+        self.LabNumber  = int(LabNumber)
+        self.CheckChar  = CheckChar
+        self.CheckCharGiven = bool(CheckChar)
+        if not self.CheckChar:
+            self.iterate_check_digit()
+        self.pack()
+
+    """ Packs Year, LabNumber, CheckChar and Prefix into one integer, in that order of significance, so that it doubles as the sort key.
+        CheckChar is stored as its position in CHECK_LETTERS (+1, 0 meaning unknown), the prefix as its position in the alphabet."""
+    def pack(self) -> int:
+        CheckNum  = tp_SpecimenID.CHECK_LETTER_INDEX.get(self.CheckChar, -1) + 1
+        PrefixNum = ord(self.Prefix[0]) - 64
+        self.Packed = (((self.Year * 10_000_000) + self.LabNumber) * 24 + CheckNum) * 27 + PrefixNum
+        return self.Packed
+
+    @classmethod
+    def from_packed(cls, Packed:int):
+        _ID = cls.__new__(cls)
+        datastructs.SampleID.__init__(_ID, "", False)
+        _ID.useLocalisationValidationFun = False
+        Packed, PrefixNum   = divmod(Packed, 27)
+        Packed, CheckNum    = divmod(Packed, 24)
+        _ID.Year, _ID.LabNumber = divmod(Packed, 10_000_000)
+        _ID.Prefix      = f"{chr(PrefixNum + 64)},"
+        _ID.CheckChar   = tp_SpecimenID.CHECK_LETTERS[CheckNum-1] if CheckNum else None
+        _ID._raw        = str(_ID)
+        _ID.pack()
+        return _ID
+
+    """ Parses every specimen ID in a file (or a string/list of lines) with a single regex pass. Lines that are not IDs are skipped,
+        or, if a Rejected list is passed, added to it."""
+    @classmethod
+    def parse_many(cls, Source, Rejected:list=None) -> list:
+        if isinstance(Source, (list, tuple)):
+            Text = "\n".join(Source)
+        elif os.path.isfile(Source):
+            with open(Source, 'r') as DATA_IN:
+                Text = DATA_IN.read()
+        else:
+            Text = Source
+        Text = Text.upper()
+        IDs = []
+        Starts = set()
+        for IDMatch in cls.ID_LINE_REGEX.finditer(Text):
+            Starts.add(IDMatch.start())
+            _ID = cls.__new__(cls)
+            datastructs.SampleID.__init__(_ID, "", False)
+            _ID.useLocalisationValidationFun = False
+            _ID._raw = IDMatch.group(0).strip()
+            _ID._assign_from_match(IDMatch)
+            IDs.append(_ID)
+        if Rejected is not None:
+            lineStart = 0
+            for line in Text.split("\n"):
+                if line.strip() and lineStart not in Starts:
+                    Rejected.append(line.strip())
+                lineStart += len(line) + 1
+            return IDs
+        nLines = len([x for x in Text.splitlines() if x.strip()])
+        if nLines > len(IDs):
+            logging.warning(f"tp_SpecimenID.parse_many(): {nLines - len(IDs)} non-empty line(s) could not be parsed as specimen IDs and were skipped.")
+        return IDs
 
-        except (AssertionError, ValueError):
-            logging.debug(f"SampleID(): ID parsing failed for {IDStr}.")
+    @property
+    def SortKey(self):
+        if self.Packed is None:
+            return (1, self._raw)
+        return (0, self.Packed)
+
+    def __hash__(self) -> int:
+        if self.Override or self.Packed is None:
+            return hash(str(self))
+        return hash(self.Packed)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, datastructs.SampleID):
+            raise TypeError(f"Cannot compare SampleID with {type(other)}")
+        if isinstance(other, tp_SpecimenID) and not (self.Override or other.Override):
+            return self.SortKey == other.SortKey
+        return str(self) == str(other)
+
+    def __lt__(self, other) -> bool:
+        if not isinstance(other, tp_SpecimenID):
+            raise TypeError(f"Cannot compare tp_SpecimenID with {type(other)}")
+        return self.SortKey < other.SortKey
+
+    def __gt__(self, other) -> bool:
+        if not isinstance(other, tp_SpecimenID):
+            raise TypeError(f"Cannot compare tp_SpecimenID with {type(other)}")
+        return self.SortKey > other.SortKey
 
     def __str__(self) -> str:
         if self.Override:
             return self._str
+        if self.LabNumber is None:
+            return self._raw
         return f"{self.Year:02}.{self.LabNumber:07}.{self.CheckChar}" #Without padding of ID Number to 10 positions, the validation will not work correctly
 
     def __repr__(self) -> str:
-        return(f"SampleID(\"A,{self.Year:02}.{self.LabNumber:07}.{self.CheckChar}\")")
+        return(f"SampleID(\"{self.Prefix}{self.Year:02}.{self.LabNumber:07}.{self.CheckChar}\")")
 
     """Function to check sample IDs, replicating TelePath's check digit algorithm  """
     def validate(self) -> bool:
-        assert self.Year
-        assert self.LabNumber
+        assert self.Year is not None
+        assert self.LabNumber is not None
         assert self.CheckChar
 
         if self.useLocalisationValidationFun:
@@ -172,18 +315,70 @@ class tp_SpecimenID(datastructs.SampleID):
         result      = self.CheckChar==checkDig
         return result
 
+    """ Computes the check character for a year and lab number directly: digits of YYNNNNNNN weighted 22..14, summed, then 23 - (sum % 23)."""
+    @staticmethod
+    def calculate_check_char(Year:int, LabNumber:int) -> str:
+        checkSum = 0
+        Digits = f"{Year:02}{LabNumber:07}"
+        for Weight, Digit in zip(range(22,13,-1), Digits):
+            checkSum += Weight * (ord(Digit) - 48)
+        return tp_SpecimenID.CHECK_LETTERS[tp_SpecimenID.CHECK_INT - (checkSum % tp_SpecimenID.CHECK_INT) - 1]
+
+    """ Computes check characters for many IDs at once. Uses numpy when available, otherwise falls back to calculate_check_char() per ID."""
+    @staticmethod
+    def calculate_check_chars(Years:list, LabNumbers:list) -> list:
+        if np is None:
+            return [tp_SpecimenID.calculate_check_char(Year, LabNumber) for Year, LabNumber in zip(Years, LabNumbers)]
+        if len(Years) == 0:
+            return []
+        Numbers = np.asarray(Years, dtype=np.int64) * 10_000_000 + np.asarray(LabNumbers, dtype=np.int64)
+        Digits  = (Numbers[:, None] // (10 ** np.arange(8, -1, -1, dtype=np.int64))) % 10    # One row of 9 digits (YYNNNNNNN) per ID
+        CheckSums = Digits @ np.arange(22, 13, -1, dtype=np.int64)
+        CheckIdx  = tp_SpecimenID.CHECK_INT - (CheckSums % tp_SpecimenID.CHECK_INT) - 1
+        return np.asarray(tp_SpecimenID.CHECK_LETTERS)[CheckIdx].tolist()
+
+    """ Validates a list of tp_SpecimenIDs in one pass; returns a list of bools in the same order. IDs that failed to parse are invalid."""
+    @staticmethod
+    def validate_many(IDs:list) -> list:
+        Parsed = [x for x in IDs if x.LabNumber is not None and not x.useLocalisationValidationFun]
+        Expected = iter(tp_SpecimenID.calculate_check_chars([x.Year for x in Parsed], [x.LabNumber for x in Parsed]))
+        Results = []
+        for x in IDs:
+            if x.LabNumber is None:
+                Results.append(False)
+            elif x.useLocalisationValidationFun:
+                Results.append(x.validate())
+            else:
+                Results.append(x.CheckChar == next(Expected))
+        return Results
+
     def iterate_check_digit(self):
+        if not self.useLocalisationValidationFun:
+            self.CheckChar = tp_SpecimenID.calculate_check_char(self.Year, self.LabNumber)
+            self.pack()
+            return
         for digit in tp_SpecimenID.CHECK_LETTERS:
             self.CheckChar = digit
             if self.validate(): 
                 logging.debug(f"iterate_check_digit(): Check digit {digit} is valid for '{self.Year}.{self.LabNumber}.?'.")
                 break
+        self.pack()
 
 
 class tp_Specimen(datastructs.Specimen):
     def __init__(self, SpecimenID):
-        datastructs.Specimen.__init__(self, SpecimenID)
-        self._ID = tp_SpecimenID(SpecimenID)
+        datastructs.Specimen.__init__(self, str(SpecimenID))
+        if isinstance(SpecimenID, tp_SpecimenID):
+            self._ID = SpecimenID
+        else:
+            self._ID = tp_SpecimenID(SpecimenID)
+
+    def __eq__(self, other):
+        if not isinstance(other, datastructs.Specimen):
+            return NotImplemented
+        return self._ID == other._ID
+
+    def __hash__(self): return hash(self._ID)
 
     def get_chunks(self):
         logging.debug("tp_Specimen.get_chunks(): Returning to main menu.")
@@ -237,16 +432,7 @@ class tp_Specimen(datastructs.Specimen):
                     logging.debug(f"tp_Specimen.fromChunks(): Errors parsing DOB containing dots and applying 100 year check. DOB:[{self.DOB}]")
                     pass
     
-        if self.PatientID:
-            if not tp_Patient.Storage.has_item(self.PatientID):
-                _Patient = tp_Patient(self.PatientID)
-                _Patient.LName = self.LName
-                _Patient.FName = self.FName
-                _Patient.DOB = self.DOB
-                tp_Patient.Storage.append(_Patient)
-            else:
-                _Patient = tp_Patient.Storage[self.PatientID]
-            _Patient.Samples.add(self)
+        self.link_patient()
         
         self.Collected          = tp_Specimen.parse_datetime_with_NotKnown(TelePath.chunk_or_none(DataChunks, line = 3, column = 67)) 
         self.Received           = tp_Specimen.parse_datetime_with_NotKnown(TelePath.chunk_or_none(DataChunks, line = 4, column = 67))
@@ -274,17 +460,27 @@ class tp_Specimen(datastructs.Specimen):
                 index   = int(ANSIChunks[i].text.strip().replace(")", ""))
                 test    = ANSIChunks[i+1].text.strip()
                 status  = ANSIChunks[i+2].text.strip().lstrip(".")
-                if self.Sets:
-                    _tmp = [x for x in range(0, len(self.Sets)) if self.Sets[x].Code == test]
-                    if _tmp:
-                        self.Sets[_tmp[0]].Index  = index
-                        self.Sets[_tmp[0]].Status = status
-                        continue
+                _known = self.Sets.get_by_code(test)
+                if _known:
+                    _known[0].Index  = index
+                    _known[0].Status = status
+                    continue
                 self.Sets.append(tp_TestSet(Sample=self.ID, SetIndex=index, SetCode=test, Status=status))
         else:
             logging.debug(f"Cannot find 'Sets requested' for sample {self.ID}. Check ANSIChunks, please.")
             logging.debug(ANSIChunks)
            
+    def link_patient(self) -> None:
+        if not self.PatientID: return
+        _Patient = tp_Patient.Storage.get(self.PatientID)
+        if _Patient is None:
+            _Patient = tp_Patient(self.PatientID)
+            _Patient.LName = self.LName
+            _Patient.FName = self.FName
+            _Patient.DOB = self.DOB
+            _Patient = tp_Patient.Storage.intern(_Patient)   # Another session may have registered this patient in the meantime
+        _Patient.Samples.add(self)
+
     def validate_ID(self) -> bool: return self._ID.validate()
 
 
@@ -299,30 +495,29 @@ class tp_Patient(datastructs.Patient):
         self.Gender = None
         self.NHSNumber = None
         if not overrideUniqueID:
-            if not tp_Patient.Storage.has_item(self.ID):
-                tp_Patient.Storage[self.ID] = self
-            else:
-                other = tp_Patient.Storage[self.ID]
-                self.cross_complete(other) 
-                tp_Patient.Storage[self.ID] = self #Should overwrite (well, re-link) duplicate object with existing one?
-                del(other)
+            tp_Patient.Storage.intern(self) #Registers this object, unless there is one already: that one stays canonical (see IdentityMap.intern())
 
 
+    """ Adds up to nMaxSamples of this patient's most recent specimens to self.Samples, per set if Set is given. Set may also be a list
+        of set codes: the patient record is then opened only once, and the specimen selection repeated for each set inside it.
+        Specimens are interned, so one found under several sets is only held once. Returns the set of specimens found."""
     def get_n_recent_samples(self, Set=None, nMaxSamples:int=10):
-        def extract_specimens(samples):
+        Found = set()
+        def extract_specimens(samples, nFound:int):
             samples = filter(lambda x: x[0]!='', samples)
             for sample in samples: #Max seven per page
-                _tmpSpecimen = tp_Specimen(sample[2]) #Should auto-append to self.Samples?
+                _tmpSpecimen = tp_Specimen.interned(sample[2]) #Reuses the specimen object if it was loaded before
                 self.Samples.add(_tmpSpecimen)
-                nSpecimens = len(self.Samples)
-                logging.debug(f"get_n_recent_samples(): Patient {self.ID} now contains {nSpecimens} specimens.")
-                if nSpecimens == nMaxSamples+1: #len() is index 0!
-                    return False
-            return True
+                Found.add(_tmpSpecimen)
+                nFound += 1
+                if nFound == nMaxSamples:
+                    return nFound, False
+            return nFound, True
 
         if not self.ID or not self.LName:
             logging.error(f"Either Patient ID ({self.ID}) or First Name ({self.LName}) not sufficient to search for samples. Aborting.")
-            return False
+            return Found
+        Sets = Set if isinstance(Set, (list, tuple, set)) else [Set]
         return_to_main_menu()
         TelePath.send(config.LOCALISATION.PATIENTENQUIRY)
         TelePath.read_data()
@@ -338,46 +533,50 @@ class tp_Patient(datastructs.Patient):
                 self.LName = errMsg
                 TelePath.send(self.FName[:1])
                 TelePath.read_data()
-            TelePath.send("S") #Spec select
-            TelePath.read_data()
-            TelePath.send("U") #Unknown specimen
-            TelePath.read_data()
-            TelePath.send('', readEcho=False) #EARLIEST
-            TelePath.read_data() 
-            TelePath.send('', readEcho=False) #LATEST
-            TelePath.read_data()
-            if not Set:
-                TelePath.send('', readEcho=False) #ALL
-            else:
-                TelePath.send(Set) #Send desired set
-            time.sleep(0.5)
-            TelePath.read_data() #Get specimen table
-            if TelePath.hasErrors:
-                _err = parse_TP_errors()
-                if _err['msg']=="No such set code":
-                    logging.error(f"TelePath reports there is no such set as '{Set}'. Skipping...")
-                    return
-                raise Exception(f"Uncaught Telepath Error: {_err}")
-            _continueLoop = True
-            samples = utils.process_whitespaced_table(TelePath.Lines[14:-2], utils.extract_column_widths(TelePath.Lines[12]))
-            if not extract_specimens(samples):
-                _continueLoop = False
-            while TelePath.DefaultOption == "N" and _continueLoop:
-                TelePath.send('N')
+            for _Set in Sets:
+                TelePath.send("S") #Spec select
                 TelePath.read_data()
+                TelePath.send("U") #Unknown specimen
+                TelePath.read_data()
+                TelePath.send('', readEcho=False) #EARLIEST
+                TelePath.read_data() 
+                TelePath.send('', readEcho=False) #LATEST
+                TelePath.read_data()
+                if not _Set:
+                    TelePath.send('', readEcho=False) #ALL
+                else:
+                    TelePath.send(_Set) #Send desired set
+                time.sleep(0.5)
+                TelePath.read_data() #Get specimen table
+                if TelePath.hasErrors:
+                    _err = parse_TP_errors()
+                    if _err[0]['msg']=="No such set code":
+                        logging.error(f"TelePath reports there is no such set as '{_Set}'. Skipping...")
+                        TelePath.send(config.LOCALISATION.CANCEL_ACTION) # Back out of specimen selection, to the patient record
+                        TelePath.read_data()
+                        continue
+                    raise Exception(f"Uncaught Telepath Error: {_err}")
                 samples = utils.process_whitespaced_table(TelePath.Lines[14:-2], utils.extract_column_widths(TelePath.Lines[12]))
-                if not extract_specimens(samples):
-                    break
+                nFound, _continueLoop = extract_specimens(samples, 0)
+                while TelePath.DefaultOption == "N" and _continueLoop:
+                    TelePath.send('N')
+                    TelePath.read_data()
+                    samples = utils.process_whitespaced_table(TelePath.Lines[14:-2], utils.extract_column_widths(TelePath.Lines[12]))
+                    nFound, _continueLoop = extract_specimens(samples, nFound)
+                logging.debug(f"get_n_recent_samples(): {nFound} specimens found for patient {self.ID}, set {_Set}.")
+                TelePath.send('Q') # Leave the specimen list, back to the patient record
+                TelePath.read_data()
             
         #TODO: else, do search via Name and DOB?
         else:
             logging.error(f"Could not retrieve data for patient {self.ID}: {';'.join(TelePath.Errors)}")
-        TelePath.send('Q')
-        TelePath.read_data()
+            TelePath.send('Q')
+            TelePath.read_data()
         TelePath.send('')
         TelePath.read_data()
 
-        logging.info(f"{len(self.Samples)} samples were found for this patient.")
+        logging.info(f"{len(Found)} samples were found for this patient.")
+        return Found
 
 
 class tp_TestSet(datastructs.TestSet):
@@ -399,9 +598,237 @@ class tp_TestSet(datastructs.TestSet):
     def __str__(self): 
         return f"[{self.Sample}, #{self.Index}: {self.Code} ({self.Status})] - {len(self.Results)} SetResults, {len(self.Comments)} Comments. Authorized {self.AuthedOn} by {self.AuthedBy}."
  
-tp_Patient.Storage = datastructs.SingleTypeStorageContainer(tp_Patient)
+tp_Patient.Storage = datastructs.IdentityMap(tp_Patient)
+tp_Specimen.Storage = datastructs.IdentityMap(tp_Specimen, MaxItems=20000)
+
+""" One write to a test set: NA-and-release it ("NA"), or cancel the request ("CANCEL"). Values are the entries typed into the result
+    screen, one per result line (eg three NAs and a blank for COVABS). Outcome is filled in by run_write_operations()."""
+class WriteOperation():
+    ACTIONS = ("NA", "CANCEL")
+
+    def __init__(self, SpecimenID, SetCode:str, Action:str="NA", Values:list=None):
+        if Action not in WriteOperation.ACTIONS:
+            raise ValueError(f"WriteOperation(): Action must be one of {WriteOperation.ACTIONS}, not '{Action}'.")
+        self.SpecimenID = str(SpecimenID)
+        self.SetCode    = SetCode
+        self.Action     = Action
+        self.Values     = Values if Values else [config.LOCALISATION.NA]
+        self.SetIndex   = None
+        self.Outcome    = None      # Done, Failed, NotFound, Locked, Error or DryRun
+        self.Message    = ""
+
+    def __repr__(self): return f"WriteOperation({self.SpecimenID}, {self.SetCode}, {self.Action}, Outcome={self.Outcome})"
+
+    @property
+    def Key(self) -> str: return f"{self.SpecimenID}:{self.SetCode}:{self.Action}"
+
+    @property
+    def isDone(self) -> bool: return self.Outcome in ("Done", "DryRun")
+
+WRITE_SCREENS = {"NA": config.LOCALISATION.SPECIMENENQUIRY, "CANCEL": config.LOCALISATION.CANCEL_REQUESTS}
+WRITE_LOCKED_MSG = "Patient record owned by another user at present"
 
-def fill_overdue_AOT_stubs(insert_NA_result:bool=False, get_creators:bool=False) -> None:
+""" Opens SpecimenID on the current screen. Returns None once it is open; if TelePath shows an error instead (record locked, no such
+    specimen...), returns the error message and leaves the screen where it can take the next ID."""
+def _open_for_write(SpecimenID:str, Action:str) -> str:
+    TelePath.send(SpecimenID, quiet=True, maxwait_ms=2000)
+    TelePath.read_data()
+    if TelePath.hasErrors:
+        Message = "; ".join(x['msg'] for x in parse_TP_errors())
+        return_to_main_menu()                   # A locked record drops back to the main menu already
+        TelePath.send(WRITE_SCREENS[Action])
+        TelePath.read_data()
+        return Message
+    return None
+
+def _open_failed(Op:WriteOperation, Message:str) -> None:
+    Op.Outcome = "Locked" if WRITE_LOCKED_MSG in Message else "Error"
+    Op.Message = Message
+
+""" Returns {SetCode: [(Index, Status), ...]} for the specimen currently open, from whichever screen the action uses."""
+def _sets_on_screen(SpecimenID:str, Action:str) -> dict:
+    Found = {}
+    if Action == "CANCEL":
+        SampleSets = [x.strip() for x in TelePath.Lines[4:-1] if x]
+        for row in utils.process_whitespaced_table(SampleSets, headerWidths=[3, 10]):
+            Found.setdefault(row[1], []).append((row[0].strip(")"), None))
+        return Found
+    Probe = tp_Specimen(SpecimenID)     # A fresh object, so sets known from earlier screens cannot mask what is on this one
+    Probe.from_chunks(TelePath.ParsedANSI)
+    for Set in Probe.Sets:
+        Found.setdefault(Set.Code, []).append((str(Set.Index), Set.Status))
+    return Found
+
+""" Sends the keys for one operation. The result entry screen is checked once it opens; the values and the release are then typed without
+    waiting for each screen in between, and the screen they lead to is read once. Returns False, having typed nothing into the set, if
+    TelePath refused to open it for entry (set locked, already authorised...)."""
+def _send_write(Op:WriteOperation) -> bool:
+    if Op.Action == "CANCEL":
+        TelePath.send(Op.SetIndex, quiet=True)
+        TelePath.read_data()
+        if TelePath.hasErrors:
+            Op.Message = "; ".join(x['msg'] for x in parse_TP_errors())
+        TelePath.send(config.LOCALISATION.EMPTYSTR, quiet=True)
+        return True
+    TelePath.send(config.LOCALISATION.UPDATE_SET_RESULT+Op.SetIndex, quiet=True)
+    TelePath.read_data()
+    if TelePath.hasErrors:
+        Op.Message = "; ".join(x['msg'] for x in parse_TP_errors())
+        return False
+    for Value in Op.Values:
+        TelePath.send(Value, quiet=True)
+    TelePath.send(config.LOCALISATION.RELEASE, quiet=True)
+    TelePath.read_data()
+    if TelePath.Lines and TelePath.Lines[-1] == "Do you want to retain ranges for":
+        TelePath.send('Y', readEcho=False)
+        TelePath.read_data()
+    if TelePath.ScreenType == "DirectResultEntry":
+        TelePath.send(config.LOCALISATION.EMPTYSTR)
+        TelePath.read_data()
+    if TelePath.hasErrors:
+        Op.Message = "; ".join(x['msg'] for x in parse_TP_errors())
+    return True
+
+""" Runs all operations on one specimen: opens it once, writes every set, then opens it again and checks each set's new state.
+    An NA'd set must have changed status, a cancelled set must be gone; anything else is recorded as Failed."""
+def _write_specimen(SpecimenID:str, Ops:list, dryRun:bool) -> None:
+    Action = Ops[0].Action
+    Message = _open_for_write(SpecimenID, Action)
+    if Message is not None:
+        for Op in Ops: _open_failed(Op, Message)
+        return
+    Before = _sets_on_screen(SpecimenID, Action)
+    Current = Before
+    isOpen = True
+    Pending = []
+    for Op in Ops:
+        if not isOpen:      # Each cancellation returns to the specimen prompt, and the set list is renumbered
+            Message = _open_for_write(SpecimenID, Action)
+            if Message is not None:
+                _open_failed(Op, Message)
+                continue
+            Current = _sets_on_screen(SpecimenID, Action)
+            isOpen = True
+        Entries = Current.get(Op.SetCode)
+        if not Entries:
+            Op.Outcome, Op.Message = "NotFound", f"Set {Op.SetCode} not on specimen."
+            continue
+        Op.SetIndex, OldStatus = Entries[0]
+        if dryRun:
+            Op.Outcome, Op.Message = "DryRun", f"Would {Op.Action} set #{Op.SetIndex} (status {OldStatus})."
+            continue
+        if not _send_write(Op):
+            Op.Outcome = "Error"
+            continue
+        Pending.append((Op, OldStatus))
+        if Action == "CANCEL": isOpen = False
+    if isOpen:
+        TelePath.send(config.LOCALISATION.EMPTYSTR, quiet=True)     # Close record
+    if not Pending: return
+
+    Message = _open_for_write(SpecimenID, Action)
+    if Message is not None:
+        for Op, _ in Pending: Op.Outcome, Op.Message = "Failed", f"Could not reopen specimen to verify: {Message}"
+        return
+    After = _sets_on_screen(SpecimenID, Action)
+    TelePath.send(config.LOCALISATION.EMPTYSTR, quiet=True)
+    for Op, OldStatus in Pending:
+        if Op.Action == "CANCEL":
+            Op.Outcome = "Done" if len(After.get(Op.SetCode, [])) < len(Before.get(Op.SetCode, [])) else "Failed"
+        else:
+            Now = [x for x in After.get(Op.SetCode, []) if x[0] == Op.SetIndex]
+            Op.Outcome = "Done" if Now and Now[0][1] != OldStatus else "Failed"
+            if Now and not Op.Message: Op.Message = f"Status {OldStatus} -> {Now[0][1]}."
+        if Op.Outcome == "Failed" and not Op.Message:
+            Op.Message = "Set unchanged after write."
+
+""" Bulk write engine. Groups Operations by specimen and action, and works through the groups on up to maxSessions TelePath sessions
+    at once (default config.LOCALISATION.MAX_SESSIONS), each opening a specimen once, typing all its writes ahead and then verifying them.
+    With dryRun, specimens are only opened and the target sets located. Outcomes go to a journal, so an interrupted job started again
+    with resume=True skips the operations that already succeeded, and to a report file. Returns the operations, with Outcome set."""
+def run_write_operations(Operations:list, dryRun:bool=False, maxSessions:int=None, JobName:str="bulk_write", resume:bool=False, 
+                         writeReport:bool=True) -> list:
+    Journal = journal.DownloadJournal(JobName, resume=resume) if not dryRun else None
+    if Journal is not None: Journal.start(Inputs=[x.Key for x in Operations])
+    Groups = {}
+    for Op in Operations:
+        if Journal is not None and Journal.is_done(Op.Key):
+            Op.Outcome, Op.Message = Journal.Outcomes.get(Op.Key) or "Done", "Done in an earlier run."
+            continue
+        Groups.setdefault((Op.Action, Op.SpecimenID), []).append(Op)
+    logging.info(f"run_write_operations(): {len(Operations)} operations on {len(Groups)} specimens{' (dry run)' if dryRun else ''}.")
+
+    WorkQueue = queue.Queue()
+    for Action in WriteOperation.ACTIONS:   # One action after the other, so each session changes screens at most once
+        for (GroupAction, SpecimenID), Ops in Groups.items():
+            if GroupAction == Action: WorkQueue.put((SpecimenID, Ops))
+    nDone = [0]
+    Lock = threading.Lock()
+
+    def work() -> None:
+        Screen = None
+        while True:
+            try:
+                SpecimenID, Ops = WorkQueue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if Screen != Ops[0].Action:
+                    return_to_main_menu()
+                    TelePath.send(WRITE_SCREENS[Ops[0].Action], quiet=True)
+                    TelePath.read_data()
+                    Screen = Ops[0].Action
+                _write_specimen(SpecimenID, Ops, dryRun)
+            except Exception as e:
+                logging.error(f"run_write_operations(): Error on specimen {SpecimenID}: {e}")
+                for Op in Ops:
+                    if Op.Outcome is None: Op.Outcome, Op.Message = "Error", str(e)
+                Screen = None
+            for Op in Ops:
+                if Journal is not None:
+                    if Op.isDone: Journal.mark_done(Op.Key, Op.Outcome)
+                    else:         Journal.record_failure(Op.Key, Op.Outcome)
+                logging.debug(f"run_write_operations(): {Op.Key}: {Op.Outcome}. {Op.Message}")
+            with Lock:
+                nDone[0] += 1
+                if nDone[0] % 50 == 0: logging.info(f"run_write_operations(): {nDone[0]}/{len(Groups)} specimens processed.")
+
+    def session_worker(Session) -> None:
+        TelePath.bind(Session)
+        try:
+            work()
+        finally:
+            TelePath.unbind()
+            close_worker_session(Session)
+
+    maxSessions = min(maxSessions or config.LOCALISATION.MAX_SESSIONS, config.LOCALISATION.MAX_SESSIONS, len(Groups))
+    Workers = []
+    for i in range(1, maxSessions):
+        Session = open_worker_session()
+        if Session is None: break
+        Workers.append(threading.Thread(target=session_worker, args=(Session,), name=f"ProfX-Write{i}", daemon=True))
+    for Worker in Workers: Worker.start()
+    try:
+        work()
+    finally:
+        for Worker in Workers: Worker.join()
+        return_to_main_menu()
+
+    Tally = Counter(x.Outcome for x in Operations)
+    logging.info(f"run_write_operations(): Complete. " + ", ".join(f"{k}: {v}" for k, v in Tally.most_common()))
+    if writeReport:
+        with open(f"./{utils.timestamp(fileFormat=True)}_{JobName}_Outcomes.txt", 'w') as Report:
+            Report.write("Specimen\tSet\tAction\tIndex\tOutcome\tMessage\n")
+            for Op in Operations:
+                Report.write(f"{Op.SpecimenID}\t{Op.SetCode}\t{Op.Action}\t{Op.SetIndex or ''}\t{Op.Outcome}\t{Op.Message}\n")
+    if Journal is not None:
+        if all(x.isDone for x in Operations): 
+            Journal.finish()
+        else:
+            Journal.close()     # Kept, so the failed operations can be retried with resume=True
+    return Operations
+
+def fill_overdue_AOT_stubs(insert_NA_result:bool=False, get_creators:bool=False, dryRun:bool=False, maxSessions:int=None, resume:bool=False) -> list:
     logging.debug(f"aot_stub_buster(): Start up. Gathering history: {get_creators}. NAing entries: {insert_NA_result}.")
     AOTSamples = get_overdue_sets("AUTO", "AOT")
     AOTStubs = Counter()
@@ -410,63 +837,60 @@ def fill_overdue_AOT_stubs(insert_NA_result:bool=False, get_creators:bool=False)
         logging.info(f"aot_stub_buster(): There are {len(AOTSamples)} AOTs to process.")
         return
 
-    return_to_main_menu()
-    TelePath.send(config.LOCALISATION.SPECIMENENQUIRY, quiet=True)         # Go into Specimen Inquiry
-    TelePath.read_data()
-    for AOTSample in AOTSamples: #TODO: issue here; loop likes to get same sample X times...
-        TelePath.send(AOTSample.ID, quiet=True, maxwait_ms=2000)  #Open record
-        TelePath.read_data()
-        AOTSample.from_chunks(TelePath.ParsedANSI)
-        TargetIndex = AOTSample.get_set_index("AOT")
-        
-        if TargetIndex == -1:
-            logging.error(f"Cannot locate AOT set for patient {AOTSample.ID}. Please check code and/or retry.")
-            TelePath.send(config.LOCALISATION.EMPTYSTR) #Exit record
-            continue
-        if get_creators == True:
-            #logging.info(f"aot_stub_buster(): Retrieving History for set [AOT] of sample [{AOTSample.ID}]")
+    if get_creators == True:
+        Store = localstore.get_store()
+        onScreen = False
+        for AOTSample in AOTSamples:
+            # Who requested a set never changes, so a creator found on an earlier day is reused without opening the record
+            Requested = [x for x in Store.get_set_history(AOTSample.ID, "AOT") if x["Event"] == AOT_CREATOR_EVENT]
+            if Requested:
+                for Entry in Requested:
+                    AOTStubs[ Entry["User"] ] += 1
+                continue
+            if not onScreen:
+                return_to_main_menu()
+                TelePath.send(config.LOCALISATION.SPECIMENENQUIRY, quiet=True)         # Go into Specimen Inquiry
+                TelePath.read_data()
+                onScreen = True
+            TelePath.send(AOTSample.ID, quiet=True, maxwait_ms=2000)  #Open record
+            TelePath.read_data()
+            AOTSample.from_chunks(TelePath.ParsedANSI)
+            TargetIndex = AOTSample.get_set_index("AOT")
+            if TargetIndex == -1:
+                logging.error(f"Cannot locate AOT set for patient {AOTSample.ID}. Please check code and/or retry.")
+                TelePath.send(config.LOCALISATION.EMPTYSTR) #Exit record
+                continue
             #TODO: Seems like a source of errors when there is no history - check route back in case of error is similar 
             #Or, brute force: go back to main menu and back to SENQ.
             TelePath.send(config.LOCALISATION.SETHISTORY+str(TargetIndex), quiet=True)  #Attempt to open test history, can cause error if none exists
             TelePath.read_data()
             if not TelePath.hasErrors:
-                #locate line with 'Set requested by: '
-                for line in TelePath.Lines[6].split("\r\n"):
-                    if line.find("Set requested by: ") != -1:
-                        user = line[ line.find("Set requested by: ")+len("Set requested by: "): ].strip()
-                        creationDT  = line[0:16].strip()
-                        logging.info(f"aot_stub_buster(): Open set [AOT] of sample [{AOTSample.ID}] was created by [{user}] at {creationDT}.")
-                        AOTStubs[ user ] += 1
+                History = parse_history_page(TelePath.Lines[6], AOTSample.ID, "AOT")
+                for Entry in History:
+                    if Entry.Event == AOT_CREATOR_EVENT:
+                        logging.info(f"aot_stub_buster(): Open set [AOT] of sample [{AOTSample.ID}] was created by [{Entry.User}] at {Entry.DateTime}.")
+                        AOTStubs[ Entry.User ] += 1
+                Known = [tp_HistoryEntry.from_dict(x) for x in Store.get_set_history(AOTSample.ID, "AOT")]
+                Store.put_set_history(AOTSample.ID, "AOT", [x.to_dict() for x in merge_history(Known, History)])
                 TelePath.send(config.LOCALISATION.QUIT)
                 TelePath.read_data()
             else:
                 logging.info(f"aot_stub_buster(): Could not retrieve history for [AOT] of sample [{AOTSample.ID}].")
-        
-        if(insert_NA_result == True):
-            logging.info(f"aot_stub_buster(): Closing Set [AOT] (#{TargetIndex}) for Sample [{AOTSample.ID}]...")
-            TelePath.send(config.LOCALISATION.UPDATE_SET_RESULT+str(TargetIndex), quiet=True)  #Open relevant test record
-            TelePath.read_data()
-            #TODO: Check screen type!
-            TelePath.send(config.LOCALISATION.NA)                              #Fill Record
-            TelePath.read_data()
-            TelePath.send(config.LOCALISATION.RELEASE, quiet=True)                   #Release NA Result
-            #TODO: Check if you get the comment of "Do you want to retain ranges"! Doesn't happen for AOT but...
-            TelePath.read_data()
-            if (TelePath.ScreenType == "DirectResultEntry"):
-                logging.debug("aot_stub_buster(): Using Direct result Entry screen shunt...")
-                TelePath.send(config.LOCALISATION.EMPTYSTR)
-                TelePath.read_data()
-        TelePath.send(config.LOCALISATION.EMPTYSTR, quiet=True)                    #Close record
-        time.sleep(0.3)
-    #for AOTSample
-
-    if get_creators==True:
+            TelePath.send(config.LOCALISATION.EMPTYSTR, quiet=True)                    #Close record
+        #for AOTSample
         with open(f'./AOTCreators_{utils.timestamp(fileFormat=True)}.log', 'w') as AOTData:
             AOTData.write(f"AOT sets, created {utils.timestamp()}\n")
             AOTData.write("User\tNumber of AOT Stubs\n")
             for key, value in AOTStubs.most_common():
                 AOTData.write(f"{key}\t{value}\n")
+
+    Operations = None
+    if insert_NA_result == True:
+        logging.info(f"aot_stub_buster(): Closing Set [AOT] for {len(AOTSamples)} samples...")
+        Operations = [WriteOperation(x, "AOT", "NA") for x in dict.fromkeys(x.ID for x in AOTSamples)]     # Each specimen once
+        Operations = run_write_operations(Operations, dryRun=dryRun, maxSessions=maxSessions, JobName="AOT_stubs", resume=resume)
     logging.debug("aot_stub_buster(): Complete.")
+    return Operations
 
 def get_NPCL_queue_sizes(QueueFilter:list=None, DetailLevel:int=0, writeToFile=True):
     WYTH_AUTH_HEADER_SIZES = [ 4,13,40,45,53]
@@ -528,13 +952,11 @@ def get_NPCL_queue_sizes(QueueFilter:list=None, DetailLevel:int=0, writeToFile=T
         addHeader=False
         if not os.path.exists(outFile):
             addHeader = True
-        DATA_OUT = open(outFile, 'a')
-        if addHeader:
-            DATA_OUT.write("DateTime\tHead Queue\tSubqueue\tN Samples\n")
-        for subQueue in NPCLQueues:          
-            DATA_OUT.write(f"{ts.strftime('%Y-%m-%d %H:%M:%S')}\t{subQueue[1]}\t{subQueue[2]}\t{subQueue[3]}\n")
-        DATA_OUT.flush()
-        DATA_OUT.close()
+        with utils.BackgroundWriter(outFile, 'a') as DATA_OUT:
+            if addHeader:
+                DATA_OUT.write("DateTime\tHead Queue\tSubqueue\tN Samples\n")
+            for subQueue in NPCLQueues:          
+                DATA_OUT.write(f"{ts.strftime('%Y-%m-%d %H:%M:%S')}\t{subQueue[1]}\t{subQueue[2]}\t{subQueue[3]}\n")
     
     if DetailLevel>0:
         AuthQueueTable = utils.generatePrettyTable(NPCLQueues, Headers=["Code", "Queue Name", "Sub-Queue", "Sets to authorise"])
@@ -708,58 +1130,48 @@ def CLI():
     #TODO: do the thing
     pass
 
-def cancel_requests(Samples, FilterSets:list=[], CancelBefore:datetime.datetime=None):
-    return_to_main_menu()
+def cancel_requests(Samples, FilterSets:list=[], CancelBefore:datetime.datetime=None, dryRun:bool=False, maxSessions:int=None, resume:bool=False) -> list:
     logging.info("cancel_requests(): Startup...")
     TestSets = [x.Sets for x in Samples]
     TestSets = [Set for sublist in TestSets for Set in sublist]
     TestSets = [x for x in TestSets if x.Code in FilterSets]
     if CancelBefore:
         TestSets = [x for x in TestSets if x.RequestedOn < CancelBefore]
-    TelePath.send(config.LOCALISATION.CANCEL_REQUESTS) #Move to specimen inquiry 
-    TelePath.read_data()
+    Operations = {}     # The overdue list has one row per set, so a specimen can turn up more than once
     for Set in TestSets:
-        TelePath.send(Set.Sample) #Move to specimen inquiry 
-        TelePath.read_data()
-        if TelePath.hasErrors:
-            errs = parse_TP_errors()
-            if errs[0]['msg'] == "Patient record owned by another user at present":
-                logging.error(f"Cannot access sample {Set.Sample}: Another user is editing this sample.")
-                TelePath.send(config.LOCALISATION.CANCEL_REQUESTS) #errors message kicks you back to main menu?
-                TelePath.read_data()
-                continue
-        SampleSets = [x.strip() for x in TelePath.Lines[4:-1] if x]
-        SampleSets = utils.process_whitespaced_table(SampleSets, headerWidths=[3, 10])
-        SetIndex = [x[0].strip(")") for x in SampleSets if x[1]==Set.Code]
-        try:
-            SetIndex = SetIndex[0]
-        except IndexError:
-            logging.error(f"cancel_requests(): Could not locate Set {Set.Code} for Sample {Set.Sample}.")
-            TelePath.send("")
-            continue    
-        logging.info(f"cancel_requests(): Cancelling request {Set.Code} (#{SetIndex}) for Sample {Set.Sample}")
-        TelePath.send(SetIndex)
-        TelePath.read_data()
-        if TelePath.hasErrors:
-            errs = parse_TP_errors()
-        TelePath.send("")
+        Op = WriteOperation(Set.Sample, Set.Code, "CANCEL")
+        Operations.setdefault(Op.Key, Op)
+    Operations = run_write_operations(list(Operations.values()), dryRun=dryRun, maxSessions=maxSessions, JobName="cancel_requests", 
+                                      resume=resume)
     logging.info("cancel_requests(): Complete.")
+    return Operations
 
 def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetComments:bool=False, GetFurther:bool=False, 
                                     ValidateSamples:bool=True, FillSets:bool=False, FilterSets:list=None, GetHistory:bool=False,
-                                    WriteToFile:bool=False, OutFileName:str=None, showProgress:bool=False):
+                                    WriteToFile:bool=False, OutFileName:str=None, showProgress:bool=False, UseCache:bool=False,
+                                    Exporter:exporters.SpecimenExporter=None, KeepData:bool=True, Journal:journal.DownloadJournal=None,
+                                    Pipelined:bool=False):
     if type(SampleObjs)==tp_Specimen:
         SampleObjs = [SampleObjs]
-
-    if not OutFileName and WriteToFile == True:
-        OutFileName = f"./{utils.timestamp(fileFormat=True)}_SpecimenData.txt"
-    
-    if WriteToFile == True:
-        IO = open(OutFileName, "w")
-        HeaderStr = "Specimen\tNHS Number\tLast Name\tFirst Name\tDOB\tSample Taken\tTest\tTest Name\tSet Comments\tClinical Details\tSpecimen Notepad\n"
-        IO.write(HeaderStr)
-        IO.flush()
-        del HeaderStr
+    SampleObjs = list(SampleObjs) # Also accepts sets, eg. Patient.Samples
+
+    if Journal is not None and Exporter and not Exporter.Resumable:
+        raise ValueError(f"complete_specimen_data_in_obj(): {type(Exporter).__name__} output cannot be journaled; its specimens are not on disk until it closes.")
+
+    Store = None
+    if UseCache:
+        Store = localstore.get_store()
+
+    # Each specimen is handed to the exporter as soon as it is complete, rather than all at the end.
+    # With KeepData=False, its sets and notepad are dropped again once written, so memory use stays flat on long lists.
+    ownsExporter = False
+    if WriteToFile == True and not Exporter:
+        if not OutFileName:
+            OutFileName = f"./{utils.timestamp(fileFormat=True)}_SpecimenData.txt"
+        Exporter = exporters.TSVExporter(filePath=OutFileName, FilterSets=FilterSets)
+        ownsExporter = True
+    if Exporter:
+        Exporter.open()
 
     def extract_set_comments(SetToGet):
         TelePath.send('S', quiet=True)    # enter Set comments
@@ -824,66 +1236,43 @@ def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetCom
         SetToGet.AuthedOn = SetAuthTime
         SetToGet.AuthedBy = SetAuthUser
 
+    """ Reads a set's history into Set.History. With a Store, the history kept there is loaded first; as history is append-only, paging
+        stops at the first page (when the screen lists newest first) that reaches back to the newest stored entry, and the rest is merged."""
     def get_history(Set:tp_TestSet):
-        TP_HISTORY_TIMESTAMP = "%d-%b-%y %H:%M"
-        TP_HISTORY_TS_LEN = len(TP_HISTORY_TIMESTAMP)
-        multiLineEvents = ["Free text entered/edited by:", "Results entered/edited by:"]
-
-        def extract_history_page():
-            historyLines = TelePath.Lines[6].split("\r\n")
-            historyLines =  historyLines[1:]
-            historyLines = [ x for x in historyLines if x ]
-
-            index = 0
-            while index < len(historyLines):
-                line = historyLines[index]
-                dateTime = line[:TP_HISTORY_TS_LEN+1]
-                colIndex = line.find(":", TP_HISTORY_TS_LEN, len(line))
-                if colIndex != -1:
-                    dateTime = datetime.datetime.strptime(dateTime, TP_HISTORY_TIMESTAMP)
-                    event = line[TP_HISTORY_TS_LEN+1:colIndex+1].strip()
-                    user  = line[colIndex+1:].strip()
-
-                    if event in multiLineEvents:
-                        moreLines = 0
-                        dateTimeMatch = False
-
-                        while (dateTimeMatch == False) and (index+moreLines < len(historyLines)):
-                            moreLines = moreLines + 1
-                            try:
-                                datetime.datetime.strptime(historyLines[index+moreLines][:len(TP_HISTORY_TIMESTAMP)+1], TP_HISTORY_TIMESTAMP)
-                                dateTimeMatch = True
-                            except:
-                                continue
-                            
-                        event = event + ";".join(historyLines[index+1:index+moreLines])
-                        index = index + moreLines 
-
-                    Set.History.append( tp_HistoryEntry(Set.Sample, Set.Code, dateTime, event, user) )
-                
-                else:
-                    logging.debug(f"Warning: Could not parse history event [{line}].")
-                
-                index = index + 1 
+        Known = [tp_HistoryEntry.from_dict(x) for x in Store.get_set_history(Set.Sample, Set.Code)] if Store else []
+        newestKnown = max((x.DateTime for x in Known if isinstance(x.DateTime, datetime.datetime)), default=None)
+        Fetched = []
+
+        def reached_known(Page:list) -> bool:
+            Times = [x.DateTime for x in Page if isinstance(x.DateTime, datetime.datetime)]
+            if newestKnown is None or len(Times) < 2 or Times[0] <= Times[-1]: return False   # Oldest first (or can't tell): keep paging
+            return Times[-1] <= newestKnown
 
         assert(TelePath.ScreenType == "SENQ")
         TelePath.send('H' + str(Set.Index))
         TelePath.read_data()
-        extract_history_page()
+        Page = parse_history_page(TelePath.Lines[6], Set.Sample, Set.Code)
+        Fetched.extend(Page)
         
         last_line = TelePath.Lines[6]
-        while TelePath.DefaultOption != 'Q':
+        while TelePath.DefaultOption != 'Q' and not reached_known(Page):
             TelePath.send('+')
             TelePath.read_data()
-            extract_history_page()
             if TelePath.Lines[6] == last_line: #Default option does not change to Q if there's exactly enough entries to fill a page.
                 break
+            Page = parse_history_page(TelePath.Lines[6], Set.Sample, Set.Code)
+            Fetched.extend(Page)
             last_line = TelePath.Lines[6]
         
         TelePath.send(config.LOCALISATION.CANCEL_ACTION)
         TelePath.read_data()
         assert(TelePath.ScreenType == "SENQ")
+        Set.History = merge_history(Known + Set.History, Fetched)
+        if Store:
+            Store.put_set_history(Set.Sample, Set.Code, [x.to_dict() for x in Set.History])
 
+    """ Reads the specimen notepad of Sample into Sample.NotepadEntries. The index is read page by page first; then only the entries not
+        already in the Store (by index and authored time) are opened, each read to its last page."""
     def get_notepad_entries(Sample:tp_Specimen):
         assert(TelePath.ScreenType == "SENQ")
         if(Sample.hasNotepadEntries == True):
@@ -895,26 +1284,43 @@ def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetCom
                 tp_SpecimenNotepadEntries = [datastructs.SpecimenNotepadEntry(ID=Sample.ID, Author="[python]", Text="[Access blocked by other users, please retry later]", Index="0", Authored="00:00 1.1.70")]
             
             else:
-                tp_SpecimenNotepadEntries = [x for x in TelePath.ParsedANSI if x.line >= 8 and x.line <= 21 and x.deleteMode == 0]
-                SNObjects = []
-                for entryLine in tp_SpecimenNotepadEntries:
-                    _entryData = entryLine.text.split(" ")
-                    _entryData = [x for x in _entryData if x != ""]
-                    if len(_entryData) > 5:
-                        #TODO: this never yet happened, ensure it works
-                        logging.debug("There are likely two specimen notepad entries in line '%s'" % entryLine)
-                        SNObjects.append(datastructs.SpecimenNotepadEntry(_entryData[7], _entryData[6], "", _entryData[5].strip(")"), _entryData[8]+" "+_entryData[9])) #THEORETICAL - not tested yet
-                    SNObjects.append(datastructs.SpecimenNotepadEntry(_entryData[2], _entryData[1], "", _entryData[0].strip(")"), _entryData[3]+" "+_entryData[4]))
+                SNObjects = parse_notepad_index(TelePath.ParsedANSI)
+                last_page = TelePath.Lines[8:22]
+                while TelePath.DefaultOption not in ('Q', 'B') and len(SNObjects) > 0:    # More index pages
+                    TelePath.send('+', quiet=True)
+                    TelePath.read_data()
+                    if TelePath.Lines[8:22] == last_page: break
+                    SNObjects.extend(parse_notepad_index(TelePath.ParsedANSI))
+                    last_page = TelePath.Lines[8:22]
+                SNObjects = list({x.Index: x for x in SNObjects}.values())
                 
+                ToFetch = []
                 for SNEntry in SNObjects:
+                    Cached = Store.get_notepad_text(Sample.ID, SNEntry.Index, SNEntry.Authored) if Store else None
+                    if Cached is not None:
+                        SNEntry.Text = Cached
+                    else:
+                        ToFetch.append(SNEntry)
+                if SNObjects:
+                    logging.debug(f"get_notepad_entries(): [{Sample.ID}] has {len(SNObjects)} notepad entries, {len(ToFetch)} to read.")
+
+                for SNEntry in ToFetch:
                     TelePath.send(SNEntry.Index, quiet=True)  # Open the entry 
                     TelePath.read_data()           # Receive data
-                    #TODO: What if more than one page of text?
-                    SNText = list(map(lambda x: x.text, TelePath.ParsedANSI[2:-2]))
+                    SNText = [x.text for x in TelePath.ParsedANSI[2:-2]]
+                    last_page = SNText
+                    while TelePath.DefaultOption not in ('Q', 'B'):  # Entry runs over more than one page
+                        TelePath.send('+', quiet=True)
+                        TelePath.read_data()
+                        PageText = [x.text for x in TelePath.ParsedANSI[2:-2]]
+                        if PageText == last_page: break
+                        SNText.extend(PageText)
+                        last_page = PageText
                     SNEntry.Text = ";".join(SNText)# Copy down the text and put it into the instance
                     TelePath.send("B", quiet=True)            # Go BACK, not default option QUIT 
-                    time.sleep(0.1)
                     TelePath.read_data()           # Receive data
+                if Store and ToFetch:
+                    Store.put_notepad_entries(Sample.ID, ToFetch)
                 
                 Sample.NotepadEntries = SNObjects
                 TelePath.send("Q", quiet=True)                # QUIT specimen notepad
@@ -922,32 +1328,25 @@ def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetCom
                 assert(TelePath.ScreenType == "SENQ")
 
 
-    if len(SampleObjs)==0: 
-        logging.warning("Could not find any Samples to process. Exiting program.")
-        return
-
-    return_to_main_menu()
-    TelePath.send(config.LOCALISATION.SPECIMENENQUIRY) #Move to specimen inquiry 
-    TelePath.read_data()
-    SampleCounter = 0
-    nSamples = len(SampleObjs)
-    ReportInterval = max(min(50, round(nSamples*0.1)), 1)
-    logging.info(f"complete_specimen_data_in_obj(): Beginning retrieval...")
-    for Sample in SampleObjs: 
-        if Sample.ID[:1] == "19":
-            logging.info("complete_specimen_data_in_obj(): Avoiding specimen(s) from 2019, which can induce a crash on access.")    
-            continue
+    """ Opens Sample in SENQ and retrieves its data. If NextSample is given, its ID is typed ahead as soon as Sample has been exited.
+        Returns the sets actually fetched (None if nothing was fetched from TelePath), and whether NextSample was typed ahead."""
+    def download_specimen(Sample:tp_Specimen, typedAhead:bool=False, NextSample:tp_Specimen=None):
+        if Store and Store.restore_specimen(Sample, SetType=tp_TestSet, FilterSets=FilterSets, onlyKnownSets=not FillSets, 
+                                            needNotepad=GetNotepad, needFurther=GetFurther, needComments=GetComments):
+            logging.debug(f"complete_specimen_data_in_obj(): Specimen [{Sample.ID}] restored from local cache.")
+            Sample.link_patient()
+            return None, False
         logging.debug(f"complete_specimen_data_in_obj(): Retrieving specimen [{Sample.ID}]...")
-        if (ValidateSamples and not Sample.validate_ID()):
-            logging.warning("complete_specimen_data_in_obj(): Sample ID '%s' does not appear to be valid. Skipping to next..." % Sample.ID)
-            continue
-        TelePath.send(Sample.ID, quiet=True)
+        if not typedAhead:
+            TelePath.send(Sample.ID, quiet=True)
         TelePath.read_data(max_wait=2000)   # And read screen. This parameter can lead to errors if you're setting it too low - it's automated, so take your (the CPU's) time.
         if (TelePath.hasErrors == True):
             # Usually the error is "No such specimen"; the error shouldn't be 'incorrect format' if we ran validate_ID().
             logging.warning(f"complete_specimen_data_in_obj(): '{';'.join(TelePath.Errors)}'")
+            return None, False
         else:
-            _SetCodes = Sample.SetCodes #...blank list? TODO:check
+            _FetchedSets = []
+            _SetCodes = set(Sample.Sets.Codes) #...blank list? TODO:check
             Sample.from_chunks(TelePath.ParsedANSI)  #Parse sample data, including patient details, sets, and assigning tp_Specimen.Collected DT.
             if FillSets == False:
                 Sample.Sets = [x for x in Sample.Sets if x.Code in _SetCodes]
@@ -959,11 +1358,14 @@ def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetCom
                 #Retrieve NHS Number and Clinical Details, which are not visible on main screen...
                 TelePath.send("F", quiet=True)
                 TelePath.read_data()
-                TelePath.send("1", quiet=True)
-                TelePath.read_data()
-                Sample.NHSNumber = TelePath.chunk_or_none(TelePath.ParsedANSI, line=17, column=37, highlighted=True)
+                Sample.NHSNumber = datastructs.PATIENT_DEMOGRAPHICS.get_NHS_number(Sample.PatientID, Store)
+                if Sample.NHSNumber is None:    # Same patient, same NHS number: only open its page the first time
+                    TelePath.send("1", quiet=True)
+                    TelePath.read_data()
+                    Sample.NHSNumber = TelePath.chunk_or_none(TelePath.ParsedANSI, line=17, column=37, highlighted=True)
+                    datastructs.PATIENT_DEMOGRAPHICS.put_NHS_number(Sample.PatientID, Sample.NHSNumber, Store)
                 
-                TelePath.send("4", quiet=True)
+                TelePath.send("4", quiet=True)  # Clinical details belong to the specimen, so are always fetched
                 TelePath.read_data()   # And read screen.
                 Details = TelePath.Lines[11].strip()
                 if Details:
@@ -985,6 +1387,15 @@ def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetCom
                     if GetHistory == True:
                         get_history(SetToGet)
 
+                    if Store:   # Overview entry unchanged since it was stored: skip opening the set
+                        _cached = Store.get_set_by_fingerprint(SetToGet.Fingerprint, needComments=GetComments)
+                        if _cached:
+                            logging.debug(f"complete_specimen_data_in_obj(): Set {SetToGet.Code} of [{Sample.ID}] unchanged, using stored copy.")
+                            SetToGet.restore_from_dict(_cached)
+                            _FetchedSets.append(SetToGet)
+                            continue
+
+                    _FetchedSets.append(SetToGet)
                     TelePath.send(str(SetToGet.Index), quiet=True)
                     time.sleep(0.3)
                     TelePath.read_data()
@@ -1009,21 +1420,115 @@ def complete_specimen_data_in_obj(SampleObjs=None, GetNotepad:bool=False, GetCom
 
                     else: 
                         logging.error(f"complete_specimen_data_in_obj(): Trying to retrieve Set {SetToGet.Code} for sample {Sample.ID}, encountered unexpected screen type [{TelePath.ScreenType}].")
+                        _FetchedSets.remove(SetToGet)
 
                     TelePath.send('B', quiet=True)        # Back to tp_Specimen overview
                     TelePath.read_data()
                 # for SetToGet in Sets
             # if (GetSets)
             TelePath.send("", quiet=True)                 # Exit specimen
+            if NextSample is not None:
+                # SENQ accepts the next ID while it is still redrawing; send() reads up to the echo of the ID, skipping the redraw
+                TelePath.send(NextSample.ID, quiet=True)
+                return _FetchedSets, True
             TelePath.read_data()              # Receive clean tp_Specimen Enquiry screen
-        # if/else TelePath.hasError()
-        SampleCounter += 1
-        if WriteToFile == True:
-            IO.write()
-        if (SampleCounter % ReportInterval == 0) and (showProgress==True): 
-            Pct = (SampleCounter / nSamples) * 100
-            logging.info(f"complete_specimen_data_in_obj(): {SampleCounter:03} of {nSamples} samples ({Pct:.2f}%) complete")
-    #for Sample in Samples
+            return _FetchedSets, False
+
+    """ Everything that happens once a specimen's screens are done with: caching, export, journal. Runs on a worker thread when Pipelined."""
+    def finish_specimen(Sample:tp_Specimen, FetchedSets:list):
+        if Store and FetchedSets is not None:
+            Store.put_specimen_patient(Sample, commit=False)    # So sample_to_patient() need not come back here for it
+            Store.put_specimen(Sample, hasNotepad=GetNotepad, hasFurther=GetFurther, hasComments=GetComments, Sets=FetchedSets)
+        if Exporter:
+            Exporter.write_specimen(Sample)
+            if Journal is not None:
+                Exporter.flush()    # The journal must never claim a specimen the output file doesn't have yet
+        if Journal is not None:
+            Journal.record_specimen(Sample)
+        if Exporter and not KeepData:
+            Sample.Sets = []
+            Sample.NotepadEntries = []
+
+    def is_skipped(Sample:tp_Specimen) -> bool:
+        return Sample.ID[:1] == "19" or (Journal is not None and Journal.has_specimen(Sample.ID))
+
+    if len(SampleObjs)==0: 
+        logging.warning("Could not find any Samples to process. Exiting program.")
+        return
+
+    if FilterSets:
+        FilterSets = set(FilterSets)
+
+    if ValidateSamples:
+        _isValid = tp_SpecimenID.validate_many([x._ID for x in SampleObjs])
+        _invalid = [x.ID for x, valid in zip(SampleObjs, _isValid) if not valid]
+        if _invalid:
+            logging.warning(f"complete_specimen_data_in_obj(): Skipping {len(_invalid)} sample(s) with invalid IDs: {', '.join(_invalid)}")
+            SampleObjs = [x for x, valid in zip(SampleObjs, _isValid) if valid]
+        del _isValid, _invalid
+
+    return_to_main_menu()
+    TelePath.send(config.LOCALISATION.SPECIMENENQUIRY) #Move to specimen inquiry 
+    TelePath.read_data()
+    SampleCounter = 0
+    nSamples = len(SampleObjs)
+    ReportInterval = max(min(50, round(nSamples*0.1)), 1)
+
+    # Pipelined: finished specimens are handed to a worker thread for caching/export/journal, while this thread already works the
+    # next one, whose ID is typed ahead on exit. No type-ahead with a cache, as a cached next specimen must not be opened at all.
+    PostQueue = None
+    if Pipelined:
+        PostQueue = queue.Queue(maxsize=PIPELINE_QUEUE_SPECIMENS)
+        PostErrors = []
+        def post_process():
+            while (item := PostQueue.get()) is not None:
+                if PostErrors: continue     # Only drain the queue after a failure; the main loop stops at its next specimen
+                try:
+                    finish_specimen(*item)
+                except Exception as e:
+                    logging.error(f"complete_specimen_data_in_obj(): Could not finish specimen [{item[0].ID}]: {e}")
+                    PostErrors.append(e)
+        PostWorker = threading.Thread(target=post_process, name="ProfX-PostProcess", daemon=True)
+        PostWorker.start()
+    typedAhead = False
+
+    logging.info(f"complete_specimen_data_in_obj(): Beginning retrieval...")
+    try:
+        for SampleIndex, Sample in enumerate(SampleObjs): 
+            if PostQueue and PostErrors: break
+            if Sample.ID[:1] == "19":
+                logging.info("complete_specimen_data_in_obj(): Avoiding specimen(s) from 2019, which can induce a crash on access.")    
+                continue
+            if Journal is not None and Journal.has_specimen(Sample.ID):     # Done (and exported) before the job was interrupted
+                if KeepData:
+                    Journal.restore_specimen(Sample, SetType=tp_TestSet)
+                    Sample.link_patient()
+                SampleCounter += 1
+                continue
+            NextSample = None
+            if Pipelined and not Store and SampleIndex+1 < nSamples and not is_skipped(SampleObjs[SampleIndex+1]):
+                NextSample = SampleObjs[SampleIndex+1]
+            FetchedSets, typedAhead = download_specimen(Sample, typedAhead, NextSample)
+            # if/else TelePath.hasError()
+            SampleCounter += 1
+            if PostQueue:
+                PostQueue.put((Sample, FetchedSets))
+            else:
+                finish_specimen(Sample, FetchedSets)
+            if (SampleCounter % ReportInterval == 0) and (showProgress==True): 
+                Pct = (SampleCounter / nSamples) * 100
+                logging.info(f"complete_specimen_data_in_obj(): {SampleCounter:03} of {nSamples} samples ({Pct:.2f}%) complete")
+        #for Sample in Samples
+    finally:
+        if PostQueue:
+            PostQueue.put(None)
+            PostWorker.join()
+    if PostQueue and PostErrors:
+        raise PostErrors[0]
+    if ownsExporter:
+        Exporter.close()
+    elif Exporter:
+        Exporter.flush()
     logging.debug("complete_specimen_data_in_obj(): All downloads complete.")
 
 def connect_to_LIMS(TrainingSystem=False):  
@@ -1044,18 +1549,45 @@ def connect_to_LIMS(TrainingSystem=False):
     else:
         pw = getpass.getpass()
 
-    TelePath.connect(IP=config.LOCALISATION.LIMS_IP, Port=config.LOCALISATION.LIMS_PORT, Answerback=config.LOCALISATION.ANSWERBACK,
+    log_in(TelePath, user, pw)
+    global _LIMSCredentials
+    _LIMSCredentials = (user, pw)
+    logging.info("connect() Connection established. Login successful.")
+
+def log_in(Session, user:str, pw:str) -> None:
+    Session.connect(IP=config.LOCALISATION.LIMS_IP, Port=config.LOCALISATION.LIMS_PORT, Answerback=config.LOCALISATION.ANSWERBACK,
                     IBMUser=config.LOCALISATION.IBM_USER, Userprompt=None, PWPrompt=b"Password :", User=user, PW=pw)      
     
-    while (TelePath.ScreenType != "MainMenu"):
-        TelePath.read_data()
-        if (TelePath.ScreenType == "ChangePassword"):
+    while (Session.ScreenType != "MainMenu"):
+        Session.read_data()
+        if (Session.ScreenType == "ChangePassword"):
             raise Exception("TelePath demands a password change. Please log in using your regular client, change your password, then change the config file for this utility.")
-        logging.debug(f"connect(): Screen type is {TelePath.ScreenType}, first lines are {TelePath.Lines[0:2]}")
+        logging.debug(f"connect(): Screen type is {Session.ScreenType}, first lines are {Session.Lines[0:2]}")
         time.sleep(1) # Wait for ON-CALL? to go away
-    logging.info("connect() Connection established. Login successful.")
 
-def delete_covid_stubs(insert_NA_result:bool=False) -> None:
+""" Opens an additional, logged-in TelePath session with the credentials of the current one, for use by a worker thread
+    (see telnet_ANSI.ThreadBoundConnection). Returns None if config.LOCALISATION.MAX_SESSIONS does not allow another one."""
+def open_worker_session():
+    if _LIMSCredentials is None:
+        raise Exception("open_worker_session(): Not connected. Call connect_to_LIMS() first.")
+    if config.LOCALISATION.MAX_SESSIONS < 2:
+        return None
+    Session = telnet_ANSI.Connection(Answerback=config.LOCALISATION.ANSWERBACK)
+    log_in(Session, *_LIMSCredentials)
+    logging.debug("open_worker_session(): Additional session logged in.")
+    return Session
+
+""" Logs a session from open_worker_session() out again. Must be called from the thread the session is bound to, or with it unbound."""
+def close_worker_session(Session) -> None:
+    if Session is None: return
+    TelePath.bind(Session)
+    try:
+        disconnect()
+    finally:
+        TelePath.unbind()
+        Session.tn.close()
+
+def delete_covid_stubs(insert_NA_result:bool=False, dryRun:bool=False, maxSessions:int=None, resume:bool=False) -> list:
     logging.debug(f"aot_stub_buster(): Start up. NAing entries: {insert_NA_result}.")
     TargetSets = ["COVABS", "ACOV2", "ACOV2S"]
     COVIDSamples = get_overdue_sets("AWAY", SetCode=TargetSets)
@@ -1063,46 +1595,20 @@ def delete_covid_stubs(insert_NA_result:bool=False) -> None:
         logging.info(f"covid_stub_buster(): There are {len(COVIDSamples)} AOTs to process.")
         return
 
-    return_to_main_menu()
-    TelePath.send(config.LOCALISATION.SPECIMENENQUIRY, quiet=True)         # Go into Specimen Inquiry
-    TelePath.read_data()
-
+    Operations = {}     # The overdue list has one row per set, so a specimen can turn up more than once
     for covSample in COVIDSamples:
-        TelePath.send(covSample.ID, quiet=True, maxwait_ms=2000)  #Open specimen record
-        TelePath.read_data()
-        covSample.from_chunks(TelePath.ParsedANSI) # check which sets this specimen has, and at which indices
-        
-        for subSet in TargetSets:
-            TargetIndex = covSample.get_set_index(subSet)
-            if TargetIndex == -1:
-                #The sample does not have an entry for this Set
-                continue
-            
-            logging.info(f"covid_stub_buster(): Closing Set [{subSet}] (#{TargetIndex}) for Sample [{covSample.ID}]...")
-            TelePath.send(config.LOCALISATION.UPDATE_SET_RESULT+str(TargetIndex), quiet=True)  #Open relevant test record
-            TelePath.read_data()
-            #TODO: Check screen type!
-            TelePath.send(config.LOCALISATION.NA)       #Fill Record
-            if subSet == "COVABS":
-                TelePath.send(config.LOCALISATION.NA)   #One more...
-                TelePath.send(config.LOCALISATION.NA)   #Two more.
-                TelePath.send('')
-            TelePath.read_data()
-            TelePath.send(config.LOCALISATION.RELEASE, quiet=True)  #Release results
-            #TODO: Check if you get the comment of "Do you want to retain ranges"! Doesn't happen for AOT but...
-            TelePath.read_data()
-            if TelePath.Lines[-1]=="Do you want to retain ranges for":
-                TelePath.send('Y', readEcho=False)
-                TelePath.read_data()
-
-            if (TelePath.ScreenType == "DirectResultEntry"):
-                logging.debug("covid_stub_buster(): Using Direct result Entry screen shunt...")
-                TelePath.send(config.LOCALISATION.EMPTYSTR)
-                TelePath.read_data()
-        TelePath.send(config.LOCALISATION.EMPTYSTR, quiet=True)                    #Close specimen record once all sets are processed
-        time.sleep(0.1)
-    #for AOTSample
+        for Set in covSample.Sets:
+            if Set.Code not in TargetSets: continue
+            if Set.Code == "COVABS":
+                Values = [config.LOCALISATION.NA]*3 + [config.LOCALISATION.EMPTYSTR]   # Three results, then confirm
+            else:
+                Values = None
+            Op = WriteOperation(covSample.ID, Set.Code, "NA", Values)
+            Operations.setdefault(Op.Key, Op)
+    Operations = list(Operations.values())
+    Operations = run_write_operations(Operations, dryRun=dryRun, maxSessions=maxSessions, JobName="COVID_stubs", resume=resume)
     logging.debug("covid_stub_buster(): Complete.")
+    return Operations
 
 def disconnect():
     return_to_main_menu(ForceReturn=True)
@@ -1308,64 +1814,173 @@ def get_overdue_sets(Section:str=config.LOCALISATION.OVERDUE_AUTOMATION, SetCode
         Samples.append(_Sample)
        
     if SetCode is not None: 
-        Samples = [x for x in Samples if SetCode in x.SetCodes]
+        if isinstance(SetCode, str):
+            Samples = [x for x in Samples if x.has_set(SetCode)]
+        else:
+            Samples = [x for x in Samples if any(x.has_set(y) for y in SetCode)]
         logging.debug("get_overdue_sets(): Located %s overdue samples for section '%s' with Set '%s'." % (len(Samples), Section, SetCode))
     else:
         logging.debug(f"get_overdue_sets(): Located {len(Samples)} overdue samples for section '{Section}'")
     return(Samples)
 
-def get_specimen_rack_location(Samples, printTable=True, writeToFile=True):
-    #TODO: assert that Samples is a List of tp_Specimen or tp_SampleID
-    SampleLocStrs     = [["Sample", "Rack", "Row", "Column", "Stored"]]
-    if writeToFile:
-        LocDataIO = open(f'./SFS_Locations_{utils.timestamp(fileFormat=True)}.txt', 'w')
-        LocDataIO.write("\t".join(SampleLocStrs[0]))
-        LocDataIO.write('\n')
+""" Result of comparing an overdue list with the one saved by the previous run: New and Still hold the specimens (one object per
+    specimen, with all its overdue sets), Resolved the IDs of specimens no longer listed. Since maps every listed ID to when it was first seen."""
+class OverdueDiff():
+    def __init__(self, Section:str, New:list, Still:list, Resolved:list, Since:dict, Snapshot:dict):
+        self.Section    = Section
+        self.New        = New
+        self.Still      = Still
+        self.Resolved   = Resolved
+        self.Since      = Since
+        self.Snapshot   = Snapshot      # Previous run's entries, including any details saved with them
 
-    return_to_main_menu()
-    TelePath.send("SFS") #TODO Localise
-    TelePath.read_data()
-    TelePath.send("3") #TODO Localise
+    def __repr__(self): return f"OverdueDiff({self.Section}: {len(self.New)} new, {len(self.Still)} still overdue, {len(self.Resolved)} resolved)"
+
+    @property
+    def Samples(self) -> list: return self.New + self.Still
+
+    def cached_details(self, SpecimenID):
+        Entry = self.Snapshot.get(str(SpecimenID))
+        return Entry["Details"] if Entry else None
+
+""" Compares Samples (from get_overdue_sets()) with the overdue list of Section saved by the previous run, and, with save, saves the new one.
+    Rows of the same specimen are merged into one object first. Store defaults to localstore.get_store()."""
+def diff_overdue_sets(Section:str, Samples:list, save:bool=True, Store:localstore.LocalStore=None) -> OverdueDiff:
+    if Store is None:
+        Store = localstore.get_store()
+    Merged = {}
+    for Sample in Samples:
+        if Sample.ID in Merged:
+            for Set in Sample.Sets:
+                Merged[Sample.ID].Sets.append(Set)
+        else:
+            Merged[Sample.ID] = Sample
+    Snapshot = Store.get_overdue_snapshot(Section)
+    New         = [x for ID, x in Merged.items() if ID not in Snapshot]
+    Still       = [x for ID, x in Merged.items() if ID in Snapshot]
+    Resolved    = [x for x in Snapshot if x not in Merged]
+    now = datetime.datetime.now()
+    Since = {ID: Snapshot[ID]["FirstSeen"] if ID in Snapshot else now for ID in Merged}
+    if save:
+        Store.save_overdue_snapshot(Section, {ID: x.Sets.Codes for ID, x in Merged.items()})
+    Diff = OverdueDiff(Section, New, Still, Resolved, Since, Snapshot)
+    logging.info(f"diff_overdue_sets(): {Diff}")
+    return Diff
+
+""" Reads the SFS locations of the specimen currently shown, as a list of [Rack, Row, Column, Stored]. The screen ends with an erase
+    instruction, so the rows are rebuilt from the raw ANSI chunks, in one pass."""
+def parse_rack_locations(ANSIChunks:list) -> list:
+    Lines = {}
+    for x in ANSIChunks:
+        if x.line >= 10 and x.deleteMode == 0:
+            Lines.setdefault(x.line, {})[x.column] = x.text
+    return [[Items.get(1), Items.get(43), Items.get(48), Items.get(56)] for _, Items in sorted(Lines.items())]
+
+""" Looks up one specimen on the SFS sample enquiry screen, which must be open. Returns its locations; empty if it is in no rack,
+    None if TelePath showed any other error."""
+def lookup_rack_location(SpecimenID:str) -> list:
+    TelePath.send(SpecimenID, quiet=True)
     TelePath.read_data()
-    for sample in Samples:
-        if isinstance(sample, tp_Specimen):
-            _sample = sample.ID
+    tpErrs = parse_TP_errors()
+    if tpErrs:
+        if tpErrs[0]['msg'] == "Sample number not found in any rack":
+            return []
+        logging.warning(f"lookup_rack_location(): Could not look up [{SpecimenID}]: {'; '.join(x['msg'] for x in tpErrs)}")
+        return None
+    return parse_rack_locations(TelePath.ParsedANSI)
+
+""" Finds where Samples are racked. With useCache, specimens looked up within maxAge are answered from the location index in the
+    LocalStore and only the rest are sent to TelePath, spread over up to maxSessions sessions; what is found refreshes the index.
+    Returns a dict of Sample ID: list of [Rack, Row, Column, Stored], or None for specimens whose lookup failed; those are listed as
+    such in the table, so they cannot be mistaken for specimens in no rack."""
+def get_specimen_rack_location(Samples, printTable=True, writeToFile=True, useCache:bool=False, maxAge:datetime.timedelta=RACK_LOCATION_MAX_AGE,
+                               maxSessions:int=None) -> dict:
+    #TODO: assert that Samples is a List of tp_Specimen or tp_SampleID
+    SampleIDs = list(dict.fromkeys(x.ID if isinstance(x, tp_Specimen) else str(x) for x in Samples))
+    Store = localstore.get_store() if useCache else None
+    Locations = {}
+    ToLookUp = queue.Queue()
+    for _sample in SampleIDs:
+        Cached = Store.get_rack_locations(_sample, maxAge) if Store else None
+        if Cached is not None:
+            Locations[_sample] = Cached
         else:
-            _sample = str(sample)
+            ToLookUp.put(_sample)
+    logging.info(f"get_specimen_rack_location(): {len(Locations)} of {len(SampleIDs)} locations known, looking up {ToLookUp.qsize()}.")
 
-        TelePath.send(_sample)
-        TelePath.read_data()
+    def work() -> None:
+        onScreen = False
+        while True:
+            try:
+                _sample = ToLookUp.get_nowait()
+            except queue.Empty:
+                break
+            if not onScreen:
+                return_to_main_menu()
+                TelePath.send("SFS") #TODO Localise
+                TelePath.read_data()
+                TelePath.send("3") #TODO Localise
+                TelePath.read_data()
+                onScreen = True
+            try:
+                Found = lookup_rack_location(_sample)
+            except Exception:
+                ToLookUp.put(_sample)       # For another session, or the retry below
+                raise
+            Locations[_sample] = Found
+            if Store and Found is not None: Store.put_rack_locations(_sample, Found)
+
+    def session_worker(Session) -> None:
+        TelePath.bind(Session)
+        try:
+            work()
+        except Exception as e:
+            logging.error(f"get_specimen_rack_location(): Worker failed: {e}")
+        finally:
+            TelePath.unbind()
+            close_worker_session(Session)
+
+    Workers = []
+    if ToLookUp.qsize() > 1:
+        for i in range(1, min(maxSessions or config.LOCALISATION.MAX_SESSIONS, config.LOCALISATION.MAX_SESSIONS, ToLookUp.qsize())):
+            Session = open_worker_session()
+            if Session is None: break
+            Workers.append(threading.Thread(target=session_worker, args=(Session,), name=f"ProfX-SFS{i}", daemon=True))
+    for Worker in Workers: Worker.start()
+    try:
+        work()
+    finally:
+        for Worker in Workers: Worker.join()
+    if not ToLookUp.empty():        # Left over by a worker that failed after this session had finished
+        logging.info(f"get_specimen_rack_location(): Retrying {ToLookUp.qsize()} lookup(s) left by a failed worker.")
+        work()
 
-        tpErrs = parse_TP_errors()
-        if tpErrs:
-            if tpErrs[0]['msg'] == "Sample number not found in any rack":
-                SampleLocStrs.append([_sample, "None", "None", "None", "None"])
-                continue
-        
-        #There's an erase instruction at the end, so instead of parsing the final screen we will have to grab the raw ANSI codes...
-        StoredSamplesANSI = [x for x in TelePath.ParsedANSI if x.line >= 10 and x.deleteMode == 0]
-        StoredSampleLines = list(set([x.line for x in StoredSamplesANSI])) #Get unique line number(s)
-
-        for line in StoredSampleLines:
-            lineItems = [x for x in StoredSamplesANSI if x.line == line]
-            StorageLoc = [x for x in lineItems if x.column == 1][0].text
-            StorageRow = [x for x in lineItems if x.column == 43][0].text
-            StorageCol = [x for x in lineItems if x.column == 48][0].text
-            StorageDT  = [x for x in lineItems if x.column == 56][0].text
-            subStr = [_sample, StorageLoc, StorageRow, StorageCol, StorageDT]
-            if writeToFile:
-                LocDataIO.write(f"{_sample}\t{StorageLoc}\t{StorageRow}\t{StorageCol}\t{StorageDT}\n")
-            SampleLocStrs.append(subStr)
+    SampleLocStrs     = [["Sample", "Rack", "Row", "Column", "Stored"]]
+    for _sample in SampleIDs:
+        Found = Locations.get(_sample)
+        if Found is None:
+            Locations[_sample] = None
+            SampleLocStrs.append([_sample, "Lookup failed", "", "", ""])
+        elif not Found:
+            SampleLocStrs.append([_sample, "None", "None", "None", "None"])
+        for Location in Found or []:
+            SampleLocStrs.append([_sample] + [str(x) for x in Location])
 
     if writeToFile:
-        LocDataIO.flush()
-        LocDataIO.close()
+        with utils.BackgroundWriter(f'./SFS_Locations_{utils.timestamp(fileFormat=True)}.txt', 'w') as LocDataIO:
+            for subStr in SampleLocStrs:
+                LocDataIO.write("\t".join(subStr) + "\n")
         
     if printTable:
         if SampleLocStrs:
             utils.generatePrettyTable(SampleLocStrs, printTable=True)
+    return Locations
 
-def get_recent_history(Samples:list=None, nMaxSamples:int=15, FilterSets:list=None):
+def get_recent_history(Samples:list=None, nMaxSamples:int=15, FilterSets:list=None, useCache:bool=False, resume:bool=False, singlePass:bool=True):
+    Journal = journal.DownloadJournal("recent_history", resume=resume)
+    if Journal.isResumed:
+        logging.info(f"get_recent_history(): Resuming interrupted run, {len(Journal.Items)} of {len(Journal.Inputs)} samples already done.")
+        Samples = Journal.Inputs
     if not Samples:
         logging.info("mass_download(): No samples supplied, loading from file")
         with open("./ToRetrieve.txt", 'r') as DATA_IN:
@@ -1373,22 +1988,32 @@ def get_recent_history(Samples:list=None, nMaxSamples:int=15, FilterSets:list=No
     Samples = [tp_Specimen(x.strip()) for x in Samples]
     if not isinstance(Samples, list):
         Samples = [Samples]
+    Journal.start(Inputs=[str(x.ID) for x in Samples])
     for _Sample in Samples:
-        Patient = sample_to_patient(_Sample)
+        if Journal.is_done(_Sample.ID):
+            continue
+        Patient = sample_to_patient(_Sample, useCache=useCache)
         logging.info(f"get_recent_history(): Retrieving recent samples for Patient [{Patient.ID}]")
-        if FilterSets:
+        if FilterSets and not singlePass:
             for _set in FilterSets:
                 Patient.get_n_recent_samples(nMaxSamples=nMaxSamples, Set=_set)
         else:
-            Patient.get_n_recent_samples(nMaxSamples=nMaxSamples)
-        complete_specimen_data_in_obj(Patient.Samples, GetNotepad=True, GetComments=True, GetFurther=False, ValidateSamples=False,  FillSets=True, FilterSets=FilterSets, showProgress=False)
+            Patient.get_n_recent_samples(nMaxSamples=nMaxSamples, Set=FilterSets) # All sets in one visit to the patient record
+        complete_specimen_data_in_obj(Patient.Samples, GetNotepad=True, GetComments=True, GetFurther=False, ValidateSamples=False,  FillSets=True, FilterSets=FilterSets, 
+                                      showProgress=False, UseCache=useCache, Journal=Journal)
         _fileName = Patient.ID
         if FilterSets:
             _fileName = f"_{Patient.ID}_{''.join(FilterSets)}"
 
         datastructs.samples_to_file(Patient.Samples, fileName=_fileName)
+        Journal.mark_done(_Sample.ID)
+    Journal.finish()
 
 def get_recent_samples_of_set_type(Set:str, FirstDate:datetime.datetime=None, LastDate:datetime.datetime=None, nMaxSamples:int=50) -> list:
+    return list(chain.from_iterable(iter_recent_samples_of_set_type(Set, FirstDate, LastDate, nMaxSamples)))
+
+""" Runs the specimen search for Set and yields the specimen IDs one result page at a time, as soon as each page has been read."""
+def iter_recent_samples_of_set_type(Set:str, FirstDate:datetime.datetime=None, LastDate:datetime.datetime=None, nMaxSamples:int=50):
     if FirstDate:
         FirstDate = FirstDate.strftime('%d.%m.%y')
     if LastDate:
@@ -1430,23 +2055,25 @@ def get_recent_samples_of_set_type(Set:str, FirstDate:datetime.datetime=None, La
     if TelePath.hasErrors:
         errors = parse_TP_errors()
         logging.info(f"TelePath returned the following error: {errors[0]['msg']}")
-        return []
+        return
 
     logging.info(f"get_recent_samples_of_set_type(): Loading samples...")
     fixLines = TelePath.Lines[1].split("\r\n")
     fixLines = [x for x in fixLines if x]
     col_widths = utils.extract_column_widths(fixLines[1])
-    samples = []
+    nSamples = 0
     
-    while len(samples) < nMaxSamples:
+    while nSamples < nMaxSamples:
         fixLines = TelePath.Lines[1].split("\r\n")
         fixLines = [x for x in fixLines if x]
         _samples = utils.process_whitespaced_table(fixLines[2:], col_widths)
-        for x in _samples:
-            samples.append("".join(x[1:3]))
-            if len(samples) == nMaxSamples:
-                logging.info(f"get_recent_samples_of_set_type(): Search completed early. Returning {nMaxSamples} samples.")
-                return samples
+        page = ["".join(x[1:3]) for x in _samples][:nMaxSamples-nSamples]
+        nSamples += len(page)
+        if page:
+            yield page
+        if nSamples == nMaxSamples:
+            logging.info(f"get_recent_samples_of_set_type(): Search completed early. Returning {nMaxSamples} samples.")
+            return
         
         if TelePath.DefaultOption == "B": #Last page has been reached and processed
             break
@@ -1454,16 +2081,15 @@ def get_recent_samples_of_set_type(Set:str, FirstDate:datetime.datetime=None, La
         TelePath.send(TelePath.DefaultOption)
         TelePath.read_data()
 
-    logging.info(f"get_recent_samples_of_set_type(): Search complete. {len(samples)} samples have been located.")
-    return samples
+    logging.info(f"get_recent_samples_of_set_type(): Search complete. {nSamples} samples have been located.")
 
-def get_recent_sibling_result(Samples:str, SetFilter:list, Analyte:str):
+def get_recent_sibling_result(Samples:str, SetFilter:list, Analyte:str, useCache:bool=False):
     #TODO: Easier to use Express Enquiry, flick to Earlier sample?
     #TODO: retrieve current sample from Patient, get SampleTaken, do time comparison + distance in days/hours
     #TODO: Sort? samples to get... well, most recent one _should_ always be first but don't trust TelePath.
     recentSiblingSamples = []
     for sample in Samples:
-        Patient = sample_to_patient(sample)
+        Patient = sample_to_patient(sample, useCache=useCache)
         Patient.get_n_recent_samples(Set=SetFilter, nMaxSamples=1, retrieveContents=True) #TODO: this isn't chronological and we know it
         if Patient.Samples:
             tmpSets = [Sample.Sets for Sample in Patient.Samples]
@@ -1482,138 +2108,162 @@ def get_recent_sibling_result(Samples:str, SetFilter:list, Analyte:str):
             IO.write('\n')
     utils.generatePrettyTable(recentSiblingSamples, Headers=siblingSampleHeaders, printTable=True)
 
-def get_recent_worksheets(Assay:str, nSheets:int=3, startDate:datetime.date=None, maxAttempts:int = 14, writeToFile:bool=True) -> list:
-
-    def make_pretty_worksheet(Sheet:str):
-        #TODO: doesn't work for immunosuppressant sheets.
-        doubleLineMode = False
-        RunDate = Sheet[2]
-        RunNo = f"{Sheet[1]:02}"
-        Sheet = Sheet[0].split("\r\n")
-        Sheet = [x.split("\x12\r\r\x0c") for x in Sheet]
-        Sheet = [item for sublist in Sheet for item in sublist]
-        Sheet = [x.strip("\x12") for x in Sheet if x]
-        System = Sheet[0].strip("\r")
-        Sheet = Sheet[1:-1]                         #Having retrieved the system name, we remove the first instance                         #Having retrieved the system name, we remove the first instance
-        assert Sheet [-1] == "End of list"          #This should leave End of list as the final line, which we assert          #This should leave End of list as the final line, which we assert
-        Run = Sheet[0]
-        Sheet = Sheet[1:-1]
-        Sheet = [x for x in Sheet if x != Run]      #Remove recurring page header      #Remove recurring page header
-        Sheet = [x for x in Sheet if x != System]
-        ColHeaders = [Sheet[0]]                     #Retrieve column headers                     #Retrieve column headers
-        Sheet = Sheet[1:]
-        if Sheet[0].split(" ")[0] == "Cup":
-            doubleLineMode = True                   #Each entry is spread across two lines                   #Each entry is spread across two lines
-            ColHeaders.append(Sheet[0])
-            Sheet = Sheet[1:]
-        for line in ColHeaders:
-            Sheet = [x for x in Sheet if x != line]
-        
-        if doubleLineMode:
-            #TODO: skip QC lines, which do NOT get sample types on a 2nd line
-            # find first line which does not start with digits, and subtract one.
-
-
-            Sheet = [" ".join(x) for x in zip(Sheet[0::2], Sheet[1::2])]
-            
-            #We could merge the headers into one line - 
-            #ColWidths = utils.extract_column_widths(ColHeaders[-1])
-            #ColHeaders = utils.process_whitespaced_table(ColHeaders, ColWidths)
-            #maxLen = max([len(x) for x in ColHeaders])
-            #for line in ColHeaders:
-            #    while len(line) < maxLen:
-            #        line.append("")
-            #ColHeaders = [" ".join(x).strip() for x in zip(*ColHeaders)]
-
-            #The merge above will have extended columns with headerless data from the 2nd line.
-            #We could extend ColWidths... with predictable data, I suppose?
-            #But let's not do that right now.
-        
-        if not doubleLineMode:
-            ColHeaders    = "Run date Run " + ColHeaders
-        else:
-            ColHeaders[0] = "             " + ColHeaders[0]
-            ColHeaders[1] = "Run date Run " + ColHeaders[1]
-        
-        Sheet = [f"{RunDate} {RunNo:3} {x}" for x in Sheet]
-        Sheet = [f"{item}\n" for sublist in [ColHeaders, Sheet] for item in sublist] 
-        return Sheet  
+""" Returns the [Assay] worksheets of one run date from Store, as get_worksheets_for_date() would, or None if Store cannot answer.
+    Days known to have had no runs give an empty list."""
+def get_cached_worksheets_for_date(Assay:str, RunDate:datetime.date, Store:localstore.LocalStore) -> list:
+    nRuns = Store.get_run_count(Assay, RunDate)
+    if nRuns is None: return None
+    Cached = [Store.get_worksheet(Assay, RunDate, x) for x in range(1, nRuns+1)]
+    if any(x is None for x in Cached): return None
+    logging.debug(f"get_cached_worksheets_for_date(): Using {nRuns} cached [{Assay}] worksheet(s) from {RunDate.strftime('%d.%m.%y')}.")
+    return [(x, i, RunDate.strftime("%d.%m.%y")) for i, x in enumerate(Cached, start=1)]
+
+""" Retrieves every [Assay] worksheet of one run date from the WRPRT screen, which must be open, as (AUX text, run number, date string)
+    tuples in run order. With a Store, what is learnt is kept there, permanently so for days that are over.
+    Returns None if TelePath does not know the assay."""
+def get_worksheets_for_date(Assay:str, RunDate:datetime.date, Store:localstore.LocalStore=None) -> list:
+    _tmpDate = RunDate.strftime("%d.%m.%y")
+    #Send Assay
+    TelePath.send(Assay)
+    TelePath.read_data()
+    if TelePath.hasErrors:
+        err = parse_TP_errors()
+        logging.error(f"get_worksheets_for_date(): TelePath sent the following error message: [{err[0]['msg']}]. Exiting function.") 
+        #Should be "Worksheet code unknown to the system", i.e. "this assay does not get worksheets"
+        return None
+    #Send rundate
+    TelePath.send(_tmpDate)
+    TelePath.read_data()
+    if TelePath.hasErrors:
+        err = parse_TP_errors()
+        if err[0]['msg'] == f"No runs started on {_tmpDate}":
+            logging.info(f"get_worksheets_for_date(): There were no {Assay} runs started on {_tmpDate}.")
+            if Store: Store.put_run_count(Assay, RunDate, 0)
+        return []
 
+    #Run(s) exist on this date
     Sheets = []
-    nAttempts = 0
-    if startDate is None:
-        startDate = datetime.date.today()
-    currentDate = startDate
-    logging.info(f"get_recent_worksheets(): Preparing to retrieve up to [{nSheets}] [{Assay}] worksheets, over [{maxAttempts}] days, starting from [{startDate.strftime('%d.%m.%y')}]...")
-
-    return_to_main_menu()
-    TelePath.send("WRPRT") #TODO: l10n
-    TelePath.read_data()
-    
-    while ((len(Sheets)<nSheets) and (nAttempts < maxAttempts)):
-        #Send Assay
-        TelePath.send(Assay)
+    nRuns = 1
+    allRunsSeen = False
+    while True:
+        TelePath.send(str(nRuns))
         TelePath.read_data()
         if TelePath.hasErrors:
             err = parse_TP_errors()
-            logging.error(f"get_recent_worksheets(): TelePath sent the following error message: [{err[0]['msg']}]. Exiting function.") 
-            #Should be "Worksheet code unknown to the system", i.e. "this assay does not get worksheets"
-            return
-    
-        #Send rundate
-        _tmpDate = currentDate - datetime.timedelta(days = float(nAttempts))
-        _tmpDate = _tmpDate.strftime("%d.%m.%y")
-        #logging.debug(f"get_recent_worksheets(): Attempting to retrieve [{Assay}] worksheet from [{_tmpDate}]...")
+            if err[0]['msg'] == "Unknown run number":
+                allRunsSeen = True
+                break #quit inner while loop (only way to break out is to reach this error!)
+            if err[0]['msg'] == "Someone else is generating or cancelling this plate":
+                logging.info(f"Run could not be accessed, but does exist. Skipping...")
+                break
+            else:
+                raise Exception(f"get_worksheets_for_date(): Unexpected error: [{err[0]['msg']}]")
+
+        logging.info(f"get_worksheets_for_date(): Located Run [{nRuns}] from {_tmpDate}.")
+        TelePath.send("", readEcho=False) #Minimum cups (auto-assigned)
+        TelePath.read_data()
+        TelePath.send("", readEcho=False) #Maximum cups (auto-assigned)
+        TelePath.read_data()
+        TelePath.send("-") #output to AUX data ('printer')
+        time.sleep(0.1)
+        TelePath.read_data()
+        AUXText = TelePath.AUXData[0].strip("\r\x0c")
+        Sheets.append( (AUXText, nRuns, _tmpDate) )
+        if Store: Store.put_worksheet(Assay, RunDate, nRuns, AUXText)
+
+        #Prep for next iteration:
+        nRuns = nRuns + 1
+        TelePath.send(Assay) #Tool resets after a run has been printed
+        TelePath.read_data()
         TelePath.send(_tmpDate)
         TelePath.read_data()
-        if TelePath.hasErrors:
-            err = parse_TP_errors()
-            if err[0]['msg'] == f"No runs started on {_tmpDate}":
-                logging.info(f"get_recent_worksheets(): There were no {Assay} runs started on {_tmpDate}.")
-                nAttempts = nAttempts + 1
-                continue #Back to main while loop
-        
-        else: 
-            #Run(s) exist on this date
-            nRuns = 1
-            while True:
-                TelePath.send(str(nRuns))
-                TelePath.read_data()
-                if TelePath.hasErrors:
-                    err = parse_TP_errors()
-                    if err[0]['msg'] == "Unknown run number":
-                        break #quit inner while loop (only way to break out is to reach this error!)
+                        
+    TelePath.send("^") #Once you hit Unknown run number, quit interface, which resets back to first line (assay)
+    TelePath.read_data()
+    if Store and allRunsSeen:   # A run that was locked leaves the count unknown
+        Store.put_run_count(Assay, RunDate, nRuns-1)
+    return Sheets
 
-                    if err[0]['msg'] == "Someone else is generating or cancelling this plate":
-                        logging.info(f"Run could not be accessed, but does exist. Skipping...")
-                        break
-                    else:
-                        raise Exception(f"get_recent_worksheets(): Unexpected error: [{err['msg']}]")
+def get_recent_worksheets(Assay:str, nSheets:int=3, startDate:datetime.date=None, maxAttempts:int = 14, writeToFile:bool=True, useCache:bool=True,
+                          maxSessions:int=None) -> list:
 
-                logging.info(f"get_recent_worksheets(): Located Run [{nRuns}] from {_tmpDate}.")
-                TelePath.send("", readEcho=False) #Minimum cups (auto-assigned)
-                TelePath.read_data()
-                TelePath.send("", readEcho=False) #Maximum cups (auto-assigned)
-                TelePath.read_data()
-                TelePath.send("-") #output to AUX data ('printer')
-                time.sleep(0.1)
-                TelePath.read_data()
-                Sheets.append( (TelePath.AUXData[0].strip("\r\x0c"), nRuns, _tmpDate) )
+    if startDate is None:
+        startDate = datetime.date.today()
+    logging.info(f"get_recent_worksheets(): Preparing to retrieve up to [{nSheets}] [{Assay}] worksheets, over [{maxAttempts}] days, starting from [{startDate.strftime('%d.%m.%y')}]...")
+    Store = localstore.get_store() if useCache else None
+    Dates = [startDate - datetime.timedelta(days=x) for x in range(maxAttempts)]
+    ByDate = {}                 # Date: list of sheets, for each date probed so far
+    Pending = queue.Queue()
+    for RunDate in Dates:
+        Pending.put(RunDate)
+    Lock = threading.Lock()
+    UnknownAssay = threading.Event()
+
+    def enough() -> bool:       # Stop taking new dates once the most recent ones already hold nSheets sheets
+        nFound = 0
+        for RunDate in Dates:
+            if RunDate not in ByDate: return False
+            nFound += len(ByDate[RunDate])
+            if nFound >= nSheets: return True
+        return True
+
+    def work() -> None:
+        onScreen = False
+        while not UnknownAssay.is_set():
+            with Lock:
+                if enough(): return
+            try:
+                RunDate = Pending.get_nowait()
+            except queue.Empty:
+                return
+            DateSheets = get_cached_worksheets_for_date(Assay, RunDate, Store) if Store else None
+            if DateSheets is None:
+                if not onScreen:
+                    return_to_main_menu()
+                    TelePath.send("WRPRT") #TODO: l10n
+                    TelePath.read_data()
+                    onScreen = True
+                DateSheets = get_worksheets_for_date(Assay, RunDate, Store)
+            if DateSheets is None:
+                UnknownAssay.set()
+                return
+            with Lock:
+                ByDate[RunDate] = DateSheets
 
-                #Prep for next iteration:
-                nRuns = nRuns + 1
-                TelePath.send(Assay) #Tool resets after a run has been printed
-                TelePath.read_data()
-                TelePath.send(_tmpDate)
-                TelePath.read_data()
-                                
-            TelePath.send("^") #Once you hit Unknown run number, quit interface, which resets back to first line (assay)
-            TelePath.read_data()
-        
-        nAttempts = nAttempts + 1 # A date has been tried, and the loop continues  
-    #len(Sheets) exceeds nSheets or nAttempts exceeds nMaxAttempts
+    def session_worker(Session) -> None:
+        TelePath.bind(Session)
+        try:
+            work()
+        except Exception as e:
+            logging.error(f"get_recent_worksheets(): Worker failed: {e}")
+        finally:
+            TelePath.unbind()
+            close_worker_session(Session)
+
+    Workers = []
+    for i in range(1, min(maxSessions or config.LOCALISATION.MAX_SESSIONS, config.LOCALISATION.MAX_SESSIONS, maxAttempts)):
+        Session = open_worker_session()
+        if Session is None: break
+        Workers.append(threading.Thread(target=session_worker, args=(Session,), name=f"ProfX-Worksheets{i}", daemon=True))
+    for Worker in Workers: Worker.start()
+    try:
+        work()
+    finally:
+        for Worker in Workers: Worker.join()
+    if UnknownAssay.is_set():
+        return
 
-    Sheets = [make_pretty_worksheet(x) for x in Sheets]
+    Sheets = []
+    for RunDate in Dates:       # Most recent first, and whole days only, as before
+        if len(Sheets) >= nSheets or RunDate not in ByDate: break
+        Sheets.extend(ByDate[RunDate])
+
+    Sheets = [worksheets.parse_worksheet(x[0], Assay, datetime.datetime.strptime(x[2], "%d.%m.%y").date(), x[1]) for x in Sheets]
+    if useCache:
+        Archive = worksheets.get_archive()
+        nArchived = sum(Archive.add(x) for x in Sheets)
+        if nArchived: logging.info(f"get_recent_worksheets(): {nArchived} worksheet(s) added to {Archive.FilePath}.")
+    Sheets = [x.to_lines() for x in Sheets]
     
     if writeToFile:
         with open(f"{utils.timestamp(True)}_{Assay}Worksheets.txt", 'w') as IO:
@@ -1622,28 +2272,88 @@ def get_recent_worksheets(Assay:str, nSheets:int=3, startDate:datetime.date=None
                 IO.write("\r\n")                    
     return (Sheets)
 
-def mass_download_samples(Samples:list=None, FilterSets:list=None, getNotepad:bool=False, getComments:bool=False, getFurther:bool=False, fileName:str=None):
+def mass_download_samples(Samples:list=None, FilterSets:list=None, getNotepad:bool=False, getComments:bool=False, getFurther:bool=False, fileName:str=None, useCache:bool=False,
+                          outFormat:str="tsv", compress:bool=False, resume:bool=False, pipelined:bool=False):
+    Journal = None
+    if exporters.is_resumable(outFormat, compress):
+        Journal = journal.DownloadJournal(f"mass_download_{fileName}" if fileName else "mass_download", resume=resume)
+    elif resume:
+        raise ValueError(f"mass_download(): {'Compressed downloads' if compress else f'Downloads to {outFormat}'} cannot be resumed.")
+    if Journal is not None and Journal.isResumed:
+        logging.info(f"mass_download(): Resuming interrupted download, {len(Journal)} of {len(Journal.Inputs)} samples already done.")
+        Samples = Journal.Inputs
     if not Samples:
         logging.info("mass_download(): No samples supplied, loading from file")
-        with open("./ToRetrieve.txt", 'r') as DATA_IN:
-            Samples = DATA_IN.readlines()
-        Samples = [tp_Specimen(x.strip()) for x in Samples]
+        Samples, _, _ = validate_specimen_list("./ToRetrieve.txt") #Drops invalid and duplicate IDs up front, keeps file order
+        Samples = [tp_Specimen(x) for x in Samples]
     logging.info(f"mass_download(): Begin download of {len(Samples)} samples.")
     if isinstance(Samples[0], str):
         Samples = [tp_Specimen(x.strip()) for x in Samples]
-    complete_specimen_data_in_obj(Samples, FilterSets=FilterSets, FillSets=True, GetNotepad=getNotepad, GetComments=getComments, GetFurther=getFurther, showProgress=True)
-    datastructs.samples_to_file(Samples, fileName=fileName)
-    logging.info("mass_download(): Complete.")
-
-def mass_download_recent_samples(Set:str=None, nDays:int=30, maxSamples:int=200, getNotepad:bool=False, getComments:bool=False, getFurther:bool=False, fileName:str=None, autoFilter:bool=True):
+    Exporter = exporters.get_exporter(outFormat, filePath=Journal.Output if Journal is not None else None, fileName=fileName, compress=compress, 
+                                      append=Journal is not None and Journal.isResumed)
+    if Journal is not None:
+        Journal.start(Inputs=[str(x.ID) for x in Samples], Output=Exporter.FilePath)
+    with Exporter:
+        complete_specimen_data_in_obj(Samples, FilterSets=FilterSets, FillSets=True, GetNotepad=getNotepad, GetComments=getComments, GetFurther=getFurther, 
+                                      showProgress=True, UseCache=useCache, Exporter=Exporter, KeepData=False, Journal=Journal, Pipelined=pipelined)
+    if Journal is not None:
+        Journal.finish()
+    logging.info(f"mass_download(): Complete. Data written to {Exporter.FilePath}.")
+
+def mass_download_recent_samples(Set:str=None, nDays:int=30, maxSamples:int=200, getNotepad:bool=False, getComments:bool=False, getFurther:bool=False, fileName:str=None, autoFilter:bool=True, useCache:bool=False,
+                                 outFormat:str="tsv", compress:bool=False):
     if not fileName: fileName = Set
     if autoFilter == True:
         FilterSets = [Set]
     else:
         FilterSets = None
-    RecentSamples = get_recent_samples_of_set_type(Set, FirstDate=datetime.datetime.now()-datetime.timedelta(days=nDays), nMaxSamples=maxSamples) 
-    if RecentSamples:
-        mass_download_samples(Samples=RecentSamples, FilterSets=FilterSets, getComments=getComments, getNotepad=getNotepad, getFurther=getFurther, fileName=fileName)
+    FirstDate = datetime.datetime.now()-datetime.timedelta(days=nDays)
+    SearchSession = open_worker_session()
+    if SearchSession is None:   # Only one session: the search has to finish before its results can be opened
+        RecentSamples = get_recent_samples_of_set_type(Set, FirstDate=FirstDate, nMaxSamples=maxSamples) 
+        if RecentSamples:
+            mass_download_samples(Samples=RecentSamples, FilterSets=FilterSets, getComments=getComments, getNotepad=getNotepad, getFurther=getFurther, fileName=fileName, useCache=useCache,
+                                  outFormat=outFormat, compress=compress)
+        return
+
+    # Two sessions: one pages through the search, feeding a bounded queue, while this one downloads each page as it arrives
+    logging.info(f"mass_download_recent_samples(): Searching and downloading [{Set}] samples in parallel.")
+    PageQueue = queue.Queue(maxsize=PIPELINE_QUEUE_PAGES)
+    Stop = threading.Event()    # Set when the downloads end, so a searcher waiting on a full queue gives up instead of blocking forever
+    def offer(item) -> bool:
+        while not Stop.is_set():
+            try:
+                PageQueue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def search_pages():
+        TelePath.bind(SearchSession)
+        try:
+            for page in iter_recent_samples_of_set_type(Set, FirstDate=FirstDate, nMaxSamples=maxSamples):
+                if not offer(page): break
+        except Exception as e:
+            logging.error(f"mass_download_recent_samples(): Search failed: {e}")
+        finally:
+            TelePath.unbind()
+            offer(None)
+    Searcher = threading.Thread(target=search_pages, name="ProfX-Search", daemon=True)
+    Searcher.start()
+    nDownloaded = 0
+    try:
+        with exporters.get_exporter(outFormat, fileName=fileName, compress=compress) as Exporter:
+            while (page := PageQueue.get()) is not None:
+                Samples = [tp_Specimen(x) for x in page]
+                complete_specimen_data_in_obj(Samples, FilterSets=FilterSets, FillSets=True, GetNotepad=getNotepad, GetComments=getComments, 
+                                              GetFurther=getFurther, showProgress=True, UseCache=useCache, Exporter=Exporter, KeepData=False)
+                nDownloaded += len(Samples)
+                logging.info(f"mass_download_recent_samples(): {nDownloaded} samples downloaded.")
+    finally:
+        Stop.set()
+        Searcher.join()
+        close_worker_session(SearchSession)
+    logging.info(f"mass_download_recent_samples(): Complete. Data written to {Exporter.FilePath}.")
 
 # def get_NPEX_status(Set:str="FIT"):
 #     logging.info(f"NPEX_Buster(): Retrieving outstanding [{Set}] samples...")
@@ -1678,32 +2388,116 @@ def return_to_main_menu(ForceReturn:bool=False, MaxTries:int=10):
     if TryCounter > MaxTries:
         raise Exception(f"Could not reach main menu in {MaxTries} attempts. Check recognise_Screen_type() logic works correctly and that ESCAPE is allowed input.")
 
-def sample_to_patient(Sample:str) -> tp_Patient:
+""" Returns the patient Sample belongs to, opening the specimen in SENQ if need be. With useCache, the patient recorded for it by an
+    earlier download is used instead, if that is recent enough (see LocalStore.get_specimen_patient())."""
+def sample_to_patient(Sample:str, useCache:bool=False) -> tp_Patient:
     if isinstance(Sample, tp_Specimen):
         _tmpSample = Sample
     else:
-        _tmpSample = tp_Specimen(Sample)
+        _tmpSample = tp_Specimen.interned(Sample)
     if not _tmpSample.validate_ID():
         logging.info(f"sample_to_patient(): {Sample} is not a valid specimen ID. Abort.")
         return
-    complete_specimen_data_in_obj(_tmpSample, GetFurther=False, FillSets=True) #Gets patient data via SENQ
+    if not _tmpSample.PatientID and useCache:
+        Known = localstore.get_store().get_specimen_patient(_tmpSample.ID)  # Recorded whenever the specimen was last downloaded
+        if Known:
+            _tmpSample.PatientID    = Known["PatientID"]
+            _tmpSample.LName        = Known["LName"]
+            _tmpSample.FName        = Known["FName"]
+            _tmpSample.DOB          = Known["DOB"]
+            _tmpSample.link_patient()
+    if not _tmpSample.PatientID or tp_Patient.Storage.get(_tmpSample.PatientID) is None:
+        complete_specimen_data_in_obj(_tmpSample, GetFurther=False, FillSets=True, UseCache=useCache) #Gets patient data via SENQ
     return tp_Patient.Storage[_tmpSample.PatientID] # Return patient obj
 
-def get_outstanding_sendaways(getDetailledData:bool=False) -> None:
+""" Splits a list of specimen ID strings into valid, invalid and duplicate IDs without touching TelePath, parsing them with
+    tp_SpecimenID.parse_many() and checking them with validate_many(); with autoCorrect, IDs lacking a check character get the computed one."""
+def validate_specimen_IDs(IDStrs:list, autoCorrect:bool=True) -> tuple:
+    Valid       = []
+    Duplicates  = []
+    Rejected    = []
+    IDs = tp_SpecimenID.parse_many([x.strip() for x in IDStrs], Rejected=Rejected)
+    Invalid = [(x, "Unrecognised format") for x in Rejected]
+    if not autoCorrect:
+        Invalid.extend((x._raw, "Missing check character") for x in IDs if not x.CheckCharGiven)
+        IDs = [x for x in IDs if x.CheckCharGiven]
+    SeenIDs = set()
+    for _ID, isValid in zip(IDs, tp_SpecimenID.validate_many(IDs)):
+        if not isValid:
+            Invalid.append((_ID._raw, f"Check character should be {tp_SpecimenID.calculate_check_char(_ID.Year, _ID.LabNumber)}"))
+            continue
+        if _ID.Packed in SeenIDs:
+            Duplicates.append(_ID._raw)
+            continue
+        SeenIDs.add(_ID.Packed)
+        Valid.append(_ID)
+    return (Valid, Invalid, Duplicates)
+
+""" Loads a ToRetrieve.txt-style file and validates all IDs offline. Returns (Valid, Invalid, Duplicates).
+    A report is written if any ID was invalid or duplicated, or always with writeReport=True; never with writeReport=False."""
+def validate_specimen_list(filePath:str="./ToRetrieve.txt", autoCorrect:bool=True, writeReport:bool=None) -> tuple:
+    with open(filePath, 'r') as DATA_IN:
+        IDStrs = DATA_IN.readlines()
+    Valid, Invalid, Duplicates = validate_specimen_IDs(IDStrs, autoCorrect=autoCorrect)
+    logging.info(f"validate_specimen_list(): {filePath}: {len(Valid)} valid, {len(Invalid)} invalid and {len(Duplicates)} duplicate ID(s).")
+    if writeReport is None:
+        writeReport = bool(Invalid or Duplicates)
+    if writeReport:
+        with open(f"./{utils.timestamp(fileFormat=True)}_IDValidation.txt", 'w') as REPORT:
+            REPORT.write(f"Specimen ID validation for {filePath}, {utils.timestamp()}\n")
+            REPORT.write(f"Valid: {len(Valid)}\tInvalid: {len(Invalid)}\tDuplicates: {len(Duplicates)}\n\n")
+            REPORT.write("Input\tOutcome\n")
+            for IDStr, Reason in Invalid:
+                REPORT.write(f"{IDStr}\tInvalid: {Reason}\n")
+            for IDStr in Duplicates:
+                REPORT.write(f"{IDStr}\tDuplicate\n")
+    return (Valid, Invalid, Duplicates)
+
+""" With incremental, the overdue list is compared with the previous run's (see diff_overdue_sets()): details are only downloaded for
+    specimens that are new to the list, or whose details were never saved, and reused from the previous run for the rest. The report then
+    gains a column saying since when each specimen has been overdue, and the resolved specimens are written to a separate file."""
+def get_outstanding_sendaways(getDetailledData:bool=False, resume:bool=False, incremental:bool=False) -> None:
     OverdueSAWAYs = get_overdue_sets("AWAY", FilterSets=["ACOV2", "COVABS", "ACOV2S"])    # Retrieve AWAY results from OVRW
     OverdueSAWAYs = [x for x in OverdueSAWAYs if str(x.ID) != "19.0831826.N"] #19.0831826.N - Sample stuck in Background Authoriser since 2019, RIP.
     logging.info(f"sendaways_scan(): There are a total of {len(OverdueSAWAYs)} overdue samples from section 'AWAY', which are not COVABS/ACOV2/ACOV2S or sample 19.0831826.N.")
+    Diff = None
+    if incremental:
+        Diff = diff_overdue_sets("AWAY", OverdueSAWAYs)
+        OverdueSAWAYs = Diff.Samples
+        if Diff.Resolved:
+            with open(f"./{utils.timestamp(fileFormat=True)}_SawayResolved.txt", 'w') as ResolvedIO:
+                ResolvedIO.write("Specimen\tTests\tOverdue Since\n")
+                for ID in Diff.Resolved:
+                    ResolvedIO.write(f"{ID}\t{','.join(Diff.Snapshot[ID]['SetCodes'])}\t{Diff.Snapshot[ID]['FirstSeen'].strftime('%d/%m/%Y')}\n")
     if getDetailledData:
-        SAWAY_DB = datastructs.load_sendaways_table()
+        datastructs.REFERENCE_DATA.sendaways() # Fail early if the table is missing, before anything is downloaded
+        ToDownload = OverdueSAWAYs
+        if Diff:
+            ToDownload = []
+            for SAWAY_Sample in OverdueSAWAYs:
+                Details = Diff.cached_details(SAWAY_Sample.ID)
+                if Details is None:
+                    ToDownload.append(SAWAY_Sample)
+                    continue
+                Codes = SAWAY_Sample.Sets.Codes    # Only the sets overdue now; any others in the saved details have been dealt with
+                SAWAY_Sample.restore_from_dict(dict(Details, Sets=[x for x in Details["Sets"] if x["Code"] in Codes]), SetType=tp_TestSet)
+            logging.info(f"sendaways_scan(): Reusing details of {len(OverdueSAWAYs)-len(ToDownload)} samples, downloading {len(ToDownload)}.")
         # For each sample, retrieve details: Patient FNAME LNAME DOB    
-        complete_specimen_data_in_obj(OverdueSAWAYs, GetNotepad=True, GetComments=True, GetFurther=True, 
-                                                ValidateSamples=False, FillSets=False, showProgress=True)
+        Journal = journal.DownloadJournal("sendaways", resume=resume) # The overdue list itself is quick to get again; only details are journaled
+        Journal.start(Inputs=[str(x.ID) for x in ToDownload])
+        complete_specimen_data_in_obj(ToDownload, GetNotepad=True, GetComments=True, GetFurther=True, 
+                                                ValidateSamples=False, FillSets=False, showProgress=True, Journal=Journal)
+        if Diff:
+            Store = localstore.get_store()
+            for SAWAY_Sample in ToDownload:
+                Store.put_overdue_details("AWAY", SAWAY_Sample)
         outFile = f"./{utils.timestamp(fileFormat=True)}_SawayData.txt"
         SAWAY_Counters = range(0, len(OverdueSAWAYs))
         logging.info("sendaways_scan(): Beginning to write overdue sendaways to file...")
-        with open(outFile, 'w') as SAWAYS_OUT:
+        with utils.BackgroundWriter(outFile, 'w') as SAWAYS_OUT:
             HeaderStr = "Specimen\tNHS Number\tLast Name\tFirst Name\tDOB\tSample Taken\tTest\tTest Name\tReferral Lab\tContact Lab At\t"
-            HeaderStr = HeaderStr + "Hours Overdue\tCurrent Action\tAction Log\tRecord Status\tSet Comments\tClinical Details\tSpecimen Notepad\n"
+            HeaderStr = HeaderStr + "Hours Overdue\tCurrent Action\tAction Log\tRecord Status\tSet Comments\tClinical Details\tSpecimen Notepad"
+            HeaderStr = HeaderStr + ("\tOn List Since\n" if Diff else "\n")
             SAWAYS_OUT.write(HeaderStr)
             del HeaderStr
             for SAWAY_Sample in OverdueSAWAYs:
@@ -1717,9 +2511,7 @@ def get_outstanding_sendaways(getDetailledData:bool=False) -> None:
                     outStr = outStr+f"\t{SAWAY_Sample.Collected.strftime('%d/%m/%Y')}\t{OverdueSet.Code}\t"
 
                     #Retrieve Referral lab info
-                    ReferralLab_Match = [x for x in SAWAY_DB if x.SetCode == OverdueSet.Code]
-                    if(len(ReferralLab_Match)==1):
-                        ReferralLab_Match = ReferralLab_Match[0]
+                    ReferralLab_Match = datastructs.REFERENCE_DATA.get_referral_lab(OverdueSet.Code)
                     #Test Name  Referral Lab Contact
                     LabStr = "[Not Found]\t[Not Found]\t[Not Found]\t"
                     if ReferralLab_Match:
@@ -1756,9 +2548,13 @@ def get_outstanding_sendaways(getDetailledData:bool=False) -> None:
                     if SAWAY_Sample.hasNotepadEntries == True:
                         NPadStr = "|".join([str(x) for x in SAWAY_Sample.NotepadEntries])
                     outStr = outStr + NPadStr
+
+                    if Diff:
+                        outStr = outStr + ("\tNew" if str(SAWAY_Sample.ID) not in Diff.Snapshot else f"\t{Diff.Since[SAWAY_Sample.ID].strftime('%d/%m/%Y')}")
                 
                     outStr = outStr + "\n"
                     SAWAYS_OUT.write(outStr)
+        Journal.finish()
         logging.info(f"sendaways_scan(): Complete. Downloaded and exported data for {len(SAWAY_Counters)} overdue sendaway samples to file.")
 
 def locate_Patient_Records():
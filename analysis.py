@@ -0,0 +1,210 @@
+#GPL-3.0-or-later
+
+import datastructs
+import datetime
+import logging
+import os
+import utils
+
+import numpy as np
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+analysisLogger = logging.getLogger(__name__)
+
+DEFAULT_DELTA_WINDOW = datetime.timedelta(days=7)
+
+"""A delta check for one analyte: consecutive results of a patient that are at most Window apart may not change by more than
+   MaxAbsChange (in the analyte's units) or MaxPctChange (percent of the earlier result). Either limit may be None."""
+class DeltaRule():
+    def __init__(self, Analyte:str, MaxAbsChange:float=None, MaxPctChange:float=None, Window:datetime.timedelta=DEFAULT_DELTA_WINDOW):
+        self.Analyte        = Analyte
+        self.MaxAbsChange   = MaxAbsChange
+        self.MaxPctChange   = MaxPctChange
+        self.Window         = Window
+
+    def __repr__(self):
+        return f"DeltaRule(Analyte={self.Analyte}, MaxAbsChange={self.MaxAbsChange}, MaxPctChange={self.MaxPctChange}, Window={self.Window})"
+
+
+""" Loads delta check rules from a tab-separated file with the columns Analyte, AbsChange, PctChange, WindowDays (blank for 'no limit'/default)"""
+def load_delta_rules(filePath="./DeltaRules.txt") -> list:
+    Rules = []
+    if not os.path.isfile(filePath):
+        logging.error(f"load_delta_rules(): Missing {filePath} file in installation directory. No delta checks will be applied.")
+        return []
+    with open(filePath, 'r') as RuleFile:
+        for line in RuleFile:
+            tmp = [x.strip() for x in line.split("\t")]
+            if tmp[0]=="Analyte" or len(tmp) < 3: continue
+            AbsChange   = utils.value_or_none(tmp[1])
+            PctChange   = utils.value_or_none(tmp[2])
+            WindowDays  = utils.value_or_none(tmp[3]) if len(tmp) > 3 else None
+            Rules.append(DeltaRule(tmp[0], float(AbsChange) if AbsChange else None, float(PctChange) if PctChange else None,
+                                   datetime.timedelta(days=float(WindowDays)) if WindowDays else DEFAULT_DELTA_WINDOW))
+    return Rules
+
+
+""" Numeric results as parallel NumPy arrays (one entry per result), the input for flag_results()."""
+class ResultTable():
+    def __init__(self, PatientIDs, SampleIDs, Analytes, Units, Values, Taken):
+        self.PatientIDs = np.asarray(PatientIDs, dtype=object)
+        self.SampleIDs  = np.asarray(SampleIDs, dtype=object)
+        self.Analytes   = np.asarray(Analytes, dtype=object)
+        self.Units      = np.asarray(Units, dtype=object)
+        self.Values     = np.asarray(Values, dtype=np.float64)
+        self.Taken      = np.asarray(Taken, dtype="datetime64[s]")
+
+    def __len__(self): return len(self.Values)
+
+    def __repr__(self): return f"ResultTable({len(self)} results, {len(np.unique(self.Analytes))} analytes)"
+
+    """ Builds the table from downloaded Specimens. Free-text results are skipped; results without a sample time use the collection time."""
+    @classmethod
+    def from_specimens(cls, Specimens):
+        Columns = ([], [], [], [], [], [])
+        for Specimen in Specimens:
+            for Set in Specimen.Sets:
+                for Result in Set.Results:
+                    if not isinstance(Result.Value, float): continue
+                    Taken = Result.SampleTaken if isinstance(Result.SampleTaken, datetime.datetime) else Specimen.Collected
+                    if not isinstance(Taken, datetime.datetime): continue
+                    for column, value in zip(Columns, (str(Specimen.PatientID), str(Specimen.ID), Result.Analyte, Result.Units, Result.Value, Taken)):
+                        column.append(value)
+        return cls(*Columns)
+
+    """ Builds the table from a directory written by exporters.ParquetExporter, without creating any Specimen objects. Requires pyarrow."""
+    @classmethod
+    def from_parquet(cls, dirPath:str):
+        if pq is None:
+            raise ImportError("ResultTable.from_parquet() requires pyarrow. Install it with 'pip install pyarrow'.")
+        Results     = pq.read_table(os.path.join(dirPath, "results.parquet"), columns=["sample_id", "analyte", "units", "value", "sample_taken"])
+        Specimens   = pq.read_table(os.path.join(dirPath, "specimens.parquet"), columns=["sample_id", "patient_id", "collected"])
+        Results     = Results.join(Specimens, "sample_id").to_pydict()
+        Taken       = [x if x is not None else y for x, y in zip(Results["sample_taken"], Results["collected"])]
+        Keep        = [v is not None and t is not None for v, t in zip(Results["value"], Taken)]
+        def pick(column): return [x for x, k in zip(column, Keep) if k]
+        return cls(pick(Results["patient_id"]), pick(Results["sample_id"]), pick(Results["analyte"]), pick(Results["units"]),
+                   pick(Results["value"]), pick(Taken))
+
+
+""" Result of flag_results(): the input results sorted by patient, analyte and time, plus per-result flags and delta values."""
+class FlagReport():
+    HEADERS = ["Patient", "SampleID", "Analyte", "Taken", "Value", "Units", "Lower", "Upper", "RangeFlag", "PreviousValue", "PreviousTaken",
+               "Delta", "DeltaPct", "DeltaFlag"]
+
+    def __init__(self, Table:ResultTable, Lower, Upper, Low, High, PrevValues, PrevTaken, Delta, DeltaPct, DeltaFlag):
+        self.Table      = Table
+        self.Lower      = Lower
+        self.Upper      = Upper
+        self.Low        = Low
+        self.High       = High
+        self.PrevValues = PrevValues
+        self.PrevTaken  = PrevTaken
+        self.Delta      = Delta
+        self.DeltaPct   = DeltaPct
+        self.DeltaFlag  = DeltaFlag
+
+    @property
+    def Flagged(self): return self.Low | self.High | self.DeltaFlag
+
+    def __repr__(self):
+        return f"FlagReport({len(self.Table)} results, {int(self.Low.sum())} low, {int(self.High.sum())} high, {int(self.DeltaFlag.sum())} delta)"
+
+    """ Number of low/high/delta flags per analyte"""
+    def summary(self) -> dict:
+        Summary = {}
+        for Analyte in np.unique(self.Table.Analytes):
+            mask = self.Table.Analytes == Analyte
+            Summary[Analyte] = {"Results": int(mask.sum()), "Low": int(self.Low[mask].sum()), "High": int(self.High[mask].sum()),
+                                "Delta": int(self.DeltaFlag[mask].sum())}
+        return Summary
+
+    """ Yields one list of str (in HEADERS order) per result, or only per flagged result"""
+    def rows(self, onlyFlagged:bool=True):
+        T = self.Table
+        def fmt(x): return "" if np.isnan(x) or np.isinf(x) else f"{x:g}"
+        for i in (np.flatnonzero(self.Flagged) if onlyFlagged else range(len(T))):
+            RangeFlag = "L" if self.Low[i] else ("H" if self.High[i] else "")
+            PrevTaken = "" if np.isnat(self.PrevTaken[i]) else str(self.PrevTaken[i])
+            yield [str(T.PatientIDs[i]), str(T.SampleIDs[i]), str(T.Analytes[i]), str(T.Taken[i]), fmt(T.Values[i]), str(T.Units[i]),
+                   fmt(self.Lower[i]), fmt(self.Upper[i]), RangeFlag, fmt(self.PrevValues[i]), PrevTaken, fmt(self.Delta[i]),
+                   fmt(self.DeltaPct[i]), "D" if self.DeltaFlag[i] else ""]
+
+    def to_file(self, fileName:str=None, onlyFlagged:bool=True) -> str:
+        outFile = f"./{utils.timestamp(fileFormat=True)}_{fileName if fileName else 'FlaggedResults'}.txt"
+        with open(outFile, 'w') as OUT:
+            OUT.write("\t".join(FlagReport.HEADERS) + "\n")
+            OUT.writelines(["\t".join(row) + "\n" for row in self.rows(onlyFlagged)])
+        logging.info(f"FlagReport.to_file(): Report written to {outFile}.")
+        return outFile
+
+
+""" Applies reference ranges and delta rules to every result in Table at once. RefRanges defaults to the Limits.txt table
+    (datastructs.REFERENCE_DATA); DeltaRules defaults to none. Results are grouped by patient and analyte by sorting once,
+    so each result's predecessor is simply the previous row of the same group."""
+def flag_results(Table:ResultTable, RefRanges:list=None, DeltaRules:list=None) -> FlagReport:
+    if RefRanges is None:
+        RefRanges = datastructs.REFERENCE_DATA.reference_ranges()
+    nResults = len(Table)
+
+    # Integer codes for patients and analytes, then one lexsort (last key is primary)
+    AnalyteNames, AnalyteCodes  = np.unique(Table.Analytes.astype(str), return_inverse=True)
+    _, PatientCodes             = np.unique(Table.PatientIDs.astype(str), return_inverse=True)
+    Order = np.lexsort((Table.Taken, AnalyteCodes, PatientCodes))
+    Table = ResultTable(Table.PatientIDs[Order], Table.SampleIDs[Order], Table.Analytes[Order], Table.Units[Order], Table.Values[Order], Table.Taken[Order])
+    AnalyteCodes, PatientCodes = AnalyteCodes[Order], PatientCodes[Order]
+
+    # Per-analyte limits as lookup arrays, indexed by analyte code
+    AnalyteIndex = {x: i for i, x in enumerate(AnalyteNames)}
+    LowerByCode = np.full(len(AnalyteNames), np.nan)
+    UpperByCode = np.full(len(AnalyteNames), np.nan)
+    for RefRange in RefRanges:
+        i = AnalyteIndex.get(RefRange.Analyte)
+        if i is None: continue
+        if RefRange.LowerLimit is not None: LowerByCode[i] = RefRange.LowerLimit
+        if RefRange.UpperLimit is not None: UpperByCode[i] = RefRange.UpperLimit
+    AbsByCode       = np.full(len(AnalyteNames), np.inf)
+    PctByCode       = np.full(len(AnalyteNames), np.inf)
+    WindowByCode    = np.zeros(len(AnalyteNames), dtype="timedelta64[s]")
+    for Rule in (DeltaRules or []):
+        i = AnalyteIndex.get(Rule.Analyte)
+        if i is None: continue
+        if Rule.MaxAbsChange is not None: AbsByCode[i] = Rule.MaxAbsChange
+        if Rule.MaxPctChange is not None: PctByCode[i] = Rule.MaxPctChange
+        WindowByCode[i] = np.timedelta64(int(Rule.Window.total_seconds()), "s")
+
+    Lower, Upper = LowerByCode[AnalyteCodes], UpperByCode[AnalyteCodes]
+    Low  = Table.Values < Lower         # Comparisons with NaN are False, so analytes without a range are never flagged
+    High = Table.Values > Upper
+
+    # Delta: compare each result with the previous row, where that row belongs to the same patient and analyte
+    PrevValues  = np.full(nResults, np.nan)
+    PrevTaken   = np.full(nResults, np.datetime64("NaT"), dtype="datetime64[s]")
+    if nResults > 1:
+        SameGroup = np.zeros(nResults, dtype=bool)
+        SameGroup[1:] = (PatientCodes[1:] == PatientCodes[:-1]) & (AnalyteCodes[1:] == AnalyteCodes[:-1])
+        PrevValues[1:]  = np.where(SameGroup[1:], Table.Values[:-1], np.nan)
+        PrevTaken[1:]   = np.where(SameGroup[1:], Table.Taken[:-1], np.datetime64("NaT"))
+    Delta = Table.Values - PrevValues
+    with np.errstate(divide="ignore", invalid="ignore"):
+        DeltaPct = np.abs(Delta) / np.abs(PrevValues) * 100
+    InWindow = (Table.Taken - PrevTaken) <= WindowByCode[AnalyteCodes]      # NaT compares False
+    DeltaFlag = InWindow & ((np.abs(Delta) > AbsByCode[AnalyteCodes]) | (DeltaPct > PctByCode[AnalyteCodes]))
+
+    Report = FlagReport(Table, Lower, Upper, Low, High, PrevValues, PrevTaken, Delta, DeltaPct, DeltaFlag)
+    analysisLogger.info(f"flag_results(): {Report}")
+    return Report
+
+""" Convenience wrapper: flags downloaded Specimens (or a ParquetExporter directory) and writes the flagged results to file."""
+def flag_report(Source, fileName:str=None, DeltaRulePath:str="./DeltaRules.txt", onlyFlagged:bool=True) -> FlagReport:
+    if isinstance(Source, str):
+        Table = ResultTable.from_parquet(Source)
+    else:
+        Table = ResultTable.from_specimens(Source)
+    Report = flag_results(Table, DeltaRules=load_delta_rules(DeltaRulePath))
+    Report.to_file(fileName, onlyFlagged)
+    return Report
@@ -1,13 +1,16 @@
 #GPL-3.0-or-later
 
-from collections import Counter
+from collections import Counter, OrderedDict
 import config
 import datetime
+import exporters
 from itertools import chain
 import logging
 import utils
 import os.path
+import threading
 import time
+import weakref
 
 #import matplotlib.pyplot as plt
 #import matplotlib as mpl
@@ -36,25 +39,91 @@ class ReferenceRange():
         return f"Reference range for {self.Analyte}: {self.LowerLimit} - {self.UpperLimit} {self.Unit}"
 
 
-class SingleTypeStorageContainer():
-    def __init__(self, targetType):
-        self.Objects = {}
-        self.TargetType = type(targetType)
+""" Identity map keeping one canonical object per ID: the first object registered for an ID stays canonical, later ones are merged into it.
+    The MaxItems most recently used objects are held strongly (LRU); older ones are only held weakly, so they stay available while anything
+    else still uses them and are freed otherwise. Safe to share between worker sessions."""
+class IdentityMap():
+    def __init__(self, targetType, MaxItems:int=2000):
+        self.TargetType = targetType if isinstance(targetType, type) else type(targetType)
+        self.MaxItems   = MaxItems
+        self._Recent    = OrderedDict()
+        self._Known     = weakref.WeakValueDictionary()
+        self._Lock      = threading.RLock()
+        self.Hits       = 0
+        self.Misses     = 0
+        self.Evictions  = 0
 
-    def __getitem__(self, key):
-        return self.Objects[key]
+    def __len__(self): return len(self._Known)
 
-    def __setitem__(self, key, item):
-        self.Objects[key] = item
+    def __repr__(self): return f"IdentityMap({self.TargetType.__name__}, {len(self._Recent)} held, {len(self._Known)} known, {self.Hits} hits, {self.Misses} misses)"
 
-    def has_item(self, itemID):
+    def _key(self, itemID) -> str:
         if isinstance(itemID, self.TargetType):
-            itemID = str(itemID)
-        if itemID in self.Objects.keys() : return True
-        return False
+            return str(itemID.ID)
+        return str(itemID)
+
+    def _touch(self, key, item) -> None:
+        self._Recent[key] = item
+        self._Recent.move_to_end(key)
+        while len(self._Recent) > self.MaxItems:
+            self._Recent.popitem(last=False)
+            self.Evictions += 1
+
+    def get(self, itemID, default=None):
+        key = self._key(itemID)
+        with self._Lock:
+            item = self._Known.get(key)
+            if item is None:
+                self.Misses += 1
+                return default
+            self.Hits += 1
+            self._touch(key, item)
+        return item
 
-    def append(self, Patient):
-        self.Objects[str(Patient.ID)]=Patient
+    def __getitem__(self, key):
+        item = self.get(key)
+        if item is None:
+            raise KeyError(key)
+        return item
+
+    def __setitem__(self, key, item):
+        key = self._key(key)
+        with self._Lock:
+            self._Known[key] = item
+            self._touch(key, item)
+
+    def has_item(self, itemID) -> bool:
+        return self._key(itemID) in self._Known
+
+    def append(self, item):
+        self[item.ID] = item
+
+    """ Returns the canonical object for item's ID. If one exists already, item's data is merged into it (see cross_complete()); otherwise item becomes canonical."""
+    def intern(self, item):
+        with self._Lock:
+            canonical = self.get(item.ID)
+            if canonical is None:
+                self.append(item)
+                return item
+        if canonical is not item:       # Merged outside the lock, as merging may look up other objects in their own maps
+            canonical.cross_complete(item)
+        return canonical
+
+    def remove(self, itemID) -> None:
+        key = self._key(itemID)
+        with self._Lock:
+            self._Recent.pop(key, None)
+            self._Known.pop(key, None)
+
+    def clear(self) -> None:
+        with self._Lock:
+            self._Recent.clear()
+            self._Known = weakref.WeakValueDictionary()
+
+    def stats(self) -> dict:
+        nLookups = self.Hits + self.Misses
+        return {"Held": len(self._Recent), "Known": len(self._Known), "Hits": self.Hits, "Misses": self.Misses, "Evictions": self.Evictions,
+                "HitRate": (self.Hits / nLookups) if nLookups else 0.0}
 
 
 """Contains a Specimen Notepad entry, including author, etc"""
@@ -70,6 +139,13 @@ class SpecimenNotepadEntry():
     
     def __str__(self): return f"[{self.SampleID} #{self.Index}] {self.Author} {self.Authored}: \"{self.Text}\""
 
+    def to_dict(self) -> dict:
+        return {"SampleID": str(self.SampleID), "Author": self.Author, "Text": self.Text, "Index": self.Index, "Authored": self.Authored}
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        return cls(ID=data["SampleID"], Author=data["Author"], Text=data["Text"], Index=data["Index"], Authored=data["Authored"])
+
 
 """ Contains data regarding test result(s) - analyte, flags"""
 class SetResult():
@@ -111,6 +187,18 @@ class SetResult():
             RepOnStr = self.ReportedOn.strftime("%d.%m.%Y %H:%M")
         return f"SetResult(Analyte={self.Analyte}, Value={self.Value}, Units={self.Units}, Flags={self.Flags}, ReportedOn={RepOnStr})"
 
+    def to_dict(self) -> dict:
+        return {"Analyte": self.Analyte, "Value": self.Value, "Units": self.Units, "Flags": self.Flags, 
+                "AuthDateTime": self.AuthDateTime, "ReportedOn": self.ReportedOn, "SampleTaken": self.SampleTaken}
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        _Result = cls(Analyte=data["Analyte"], Value=data["Value"], Units=data["Units"], Flags=data["Flags"])
+        _Result.AuthDateTime = data["AuthDateTime"]
+        _Result.ReportedOn   = data["ReportedOn"]
+        _Result.SampleTaken  = data["SampleTaken"]
+        return _Result
+
 
 """Contains a (set of) test(s), any result(s), and any comment(s) for that test"""
 class TestSet():
@@ -165,6 +253,10 @@ class TestSet():
     @property
     def is_overdue(self): return self.Overdue.total_seconds() > 0
 
+    """ What the specimen overview shows of this set. While it stays the same, nothing has been done to the set."""
+    @property
+    def Fingerprint(self) -> tuple: return (str(self.Sample), self.Code, self.Index, self.Status)
+
     def addSetResult(self, resItem:SetResult):
         #Add SetResult to list after checking it's not already present, or a similar result for this analyte?
         raise NotImplementedError
@@ -175,6 +267,32 @@ class TestSet():
     def __str__(self): 
         return f"[{self.Sample}, #{self.Index}: {self.Code} ({self.Status})] - {len(self.Results)} SetResults, {len(self.Comments)} Comments. Authorized {self.AuthedOn} by {self.AuthedBy}."
     
+    def to_dict(self) -> dict:
+        return {"Sample": str(self.Sample), "Index": self.Index, "Code": self.Code, "Status": self.Status, "AuthedOn": self.AuthedOn, 
+                "AuthedBy": self.AuthedBy, "RequestedOn": self.RequestedOn, "Overdue": self.Overdue, "Comments": list(self.Comments), 
+                "Results": [x.to_dict() for x in self.Results]}
+
+    """ Copies downloaded data (results, comments, authorisation) from a to_dict() record. Index and Status are only filled in if unknown, 
+        as the caller usually has fresher values from the specimen overview."""
+    def restore_from_dict(self, data:dict) -> None:
+        self.Results    = [SetResult.from_dict(x) for x in data["Results"]]
+        self.Comments   = list(data["Comments"])
+        self.AuthedOn   = data["AuthedOn"]
+        self.AuthedBy   = data["AuthedBy"]
+        if self.Index is None: 
+            self.Index  = data["Index"]
+        if self.Status is None: 
+            self.Status = data["Status"]
+        if self.RequestedOn is None: 
+            self.RequestedOn = data["RequestedOn"]
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        _Set = cls(Sample=data["Sample"], SetIndex=data["Index"], SetCode=data["Code"], Status=data["Status"])
+        _Set.Overdue = data["Overdue"]
+        _Set.restore_from_dict(data)
+        return _Set
+
     def prepare_file_format(self):
         pass
     
@@ -201,6 +319,9 @@ class SampleID():
     def __repr__(self) -> str:
         return f"SampleID(\"{self._str}\", Override={self.Override})"
 
+    def __hash__(self) -> int:
+        return hash(str(self))
+
     def __gt__(self, other) -> bool:
         if not isinstance(other, SampleID):
             raise TypeError(f"Cannot compare SampleID with {type(other)}")
@@ -235,6 +356,77 @@ class SampleID():
         return True
 
 
+"""List of TestSets that keeps a Set Code -> [TestSet] index in step with its contents, for O(1) lookups by code"""
+class TestSetList(list):
+    def __init__(self, Sets=None):
+        list.__init__(self)
+        self._CodeIndex = {}
+        if Sets:
+            self.extend(Sets)
+
+    def _index_set(self, _set):
+        self._CodeIndex.setdefault(_set.Code, []).append(_set)
+
+    def _unindex_set(self, _set):
+        _sets = self._CodeIndex.get(_set.Code)
+        if not _sets: return
+        for i in range(0, len(_sets)):
+            if _sets[i] is _set:
+                del _sets[i]
+                break
+        if not _sets:
+            del self._CodeIndex[_set.Code]
+
+    def reindex(self):
+        self._CodeIndex = {}
+        for _set in self:
+            self._index_set(_set)
+
+    def append(self, _set):
+        list.append(self, _set)
+        self._index_set(_set)
+
+    def extend(self, Sets):
+        for _set in Sets:
+            self.append(_set)
+
+    def insert(self, index, _set):
+        list.insert(self, index, _set)
+        self._index_set(_set)
+
+    def remove(self, _set):
+        list.remove(self, _set)
+        self._unindex_set(_set)
+
+    def pop(self, index=-1):
+        _set = list.pop(self, index)
+        self._unindex_set(_set)
+        return _set
+
+    def clear(self):
+        list.clear(self)
+        self._CodeIndex = {}
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self.reindex()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.reindex()
+
+    def __iadd__(self, Sets):
+        self.extend(Sets)
+        return self
+
+    def has_code(self, code) -> bool: return code in self._CodeIndex
+
+    def get_by_code(self, code) -> list: return self._CodeIndex.get(code, [])
+
+    @property
+    def Codes(self) -> list: return list(self._CodeIndex.keys())
+
+
 """Contains data describing a patient sample, including demographics of the patient, and Specimen Notepad"""
 class Specimen():
     def __init__(self, SpecimenID:str, Override:bool=False):
@@ -246,7 +438,7 @@ class Specimen():
         self.ClinDetails        = None
         self.Collected          = None 
         self.Received           = None
-        self.Sets               = []
+        self._Sets              = TestSetList()
         self.NotepadEntries     = []
         self.hasNotepadEntries  = False
         self.Location           = "None"
@@ -272,9 +464,59 @@ class Specimen():
         #datastructLogger.debug(f"Specimen.__lt__(): Checking IDs between self ({self.ID}) and other ({other.ID})")
         return (self.ID < other.ID)
     
+    SPECIMEN_FIELDS = ["PatientID", "LName", "FName", "DOB", "ClinDetails", "Collected", "Received", "hasNotepadEntries", "Location", 
+                       "Requestor", "ReportComment", "Comment", "Category", "Type", "NHSNumber"]
+
+    def to_dict(self, includeSets:bool=True) -> dict:
+        data = {x: getattr(self, x) for x in Specimen.SPECIMEN_FIELDS}
+        data["ID"] = self.ID
+        data["NotepadEntries"] = [x.to_dict() for x in self.NotepadEntries]
+        if includeSets:
+            data["Sets"] = [x.to_dict() for x in self.Sets]
+        return data
+
+    """ Fills this Specimen from a to_dict() record. Sets already present are completed from the record, missing ones are created using SetType."""
+    def restore_from_dict(self, data:dict, SetType=None) -> None:
+        if SetType is None: 
+            SetType = TestSet
+        for field in Specimen.SPECIMEN_FIELDS:
+            setattr(self, field, data.get(field))
+        self.NotepadEntries = [SpecimenNotepadEntry.from_dict(x) for x in data.get("NotepadEntries", [])]
+        for setData in data.get("Sets", []):
+            _known = self.Sets.get_by_code(setData["Code"])
+            if _known:
+                _known[0].restore_from_dict(setData)
+            else:
+                self.Sets.append(SetType.from_dict(setData))
+
+    @property
+    def Sets(self): return self._Sets
+
+    @Sets.setter
+    def Sets(self, value): self._Sets = TestSetList(value)
+
     @property
     def SetCodes(self): return [x.Code for x in self.Sets]
 
+    """ Returns the canonical instance for SpecimenID from Storage, creating (and registering) one if there is none."""
+    @classmethod
+    def interned(cls, SpecimenID):
+        return cls.Storage.intern(cls(SpecimenID))
+
+    """ Copies anything this Specimen is missing from other (same ID): demographics, notepad entries, and sets it does not have yet."""
+    def cross_complete(self, other) -> None:
+        if self.ID != other.ID:
+            datastructLogger.error(f"cross_complete(): Specimen objects {self} and {other} have different IDs. Aborting.")
+            return
+        for field in Specimen.SPECIMEN_FIELDS:
+            if getattr(self, field) in (None, "None") and getattr(other, field) not in (None, "None"):
+                setattr(self, field, getattr(other, field))
+        if not self.NotepadEntries and other.NotepadEntries:
+            self.NotepadEntries = other.NotepadEntries
+        for otherSet in other.Sets:
+            if not self.Sets.has_code(otherSet.Code):
+                self.Sets.append(otherSet)
+
     @property
     def ID(self): return str(self._ID)
 
@@ -315,24 +557,23 @@ class Specimen():
        
     """ Gets the set's index in the LIMP (NOT the index in sample.Sets!) """
     def get_set_index(self, code):
-        if code not in self.SetCodes: return -1
-        if len(self.Sets) == 0: raise IndexError("No tests are registered with this Specimen")
-        Indices = [x.Index for x in self.Sets if x.Code==code]
-        if len(Indices)==1 : return Indices[0]
-        return Indices
+        Sets = self.Sets.get_by_code(code)
+        if not Sets: return -1
+        if len(Sets)==1 : return Sets[0].Index
+        return [x.Index for x in Sets]
 
     def get_set(self, code):
-        if code not in self.SetCodes: return -1
-        if len(self.Sets) == 0: raise IndexError("No tests are registered with this Specimen")
-        return [x for x in self.Sets if x.Code==code][0]
+        Sets = self.Sets.get_by_code(code)
+        if not Sets: return -1
+        return Sets[0]
     
     def get_set_status(self, code):
-        if code not in self.SetCodes: return -1
-        if len(self.Sets) == 0: raise IndexError("No tests are registered with this Specimen")
-        #results = list(map(lambda y: y[2], filter(lambda x: x[1]==code, self.Tests)))
-        Statuses = [x.Status for x in self.Sets if x.Code==code]
-        if len(Statuses)==1 : return Statuses[0]
-        return Statuses
+        Sets = self.Sets.get_by_code(code)
+        if not Sets: return -1
+        if len(Sets)==1 : return Sets[0].Status
+        return [x.Status for x in Sets]
+
+    def has_set(self, code) -> bool: return self.Sets.has_code(code)
     
 
 """Contains data pertaining to a patient. PII-heavy, DO NOT EXPORT"""
@@ -346,13 +587,7 @@ class Patient():
         self.Sex = None
         self.Gender = None
         self.NHSNumber = None
-        if not Patient.Storage.has_item(self.ID):
-            Patient.Storage[self.ID] = self
-        else:
-            other = Patient.Storage[self.ID]
-            self.cross_complete(other) 
-            Patient.Storage[self.ID] = self #Should overwrite (well, re-link) duplicate object with existing one?
-            del(other)
+        Patient.Storage.intern(self) #Registers this object, unless there is one already: that one stays canonical (see IdentityMap.intern())
 
     def __eq__(self, other):
         if self.ID != other.ID: return False
@@ -367,78 +602,38 @@ class Patient():
         try:
             assert self.ID == other.ID
             if self.DOB and other.DOB:
-                if type(self.DOB) == "datetime" and type(other.DOB) == "datetime": 
-                    assert self.DOB == other.DOB
+                if isinstance(self.DOB, datetime.date) and isinstance(other.DOB, datetime.date): 
+                    _selfDOB  = self.DOB.date()  if isinstance(self.DOB, datetime.datetime)  else self.DOB
+                    _otherDOB = other.DOB.date() if isinstance(other.DOB, datetime.datetime) else other.DOB
+                    assert _selfDOB == _otherDOB
         
         except AssertionError:
             datastructLogger.error(f"cross_complete(): Patient Objects {self} and {other} have ID or DOB mismatch. Aborting.")
             return
 
-        if not self.FName and other.FName:
-            self.FName = other.FName
-        if not self.LName and other.LName:            
-            self.LName = other.LName        
-        if not self.NHSNumber and other.NHSNumber: 
-            self.NHSNumber = other.NHSNumber
+        for field in ["FName", "LName", "DOB", "Sex", "Gender", "NHSNumber"]:
+            if not getattr(self, field) and getattr(other, field):
+                setattr(self, field, getattr(other, field))
 
+        # Specimens hash by ID, so a specimen present in both is only kept once; fill in what our copy lacks from theirs
+        ownSamples = {x: x for x in self.Samples}
         for otherSample in other.Samples:
-            if otherSample in self.Samples: continue
-            self.Samples.add(otherSample)
+            ownSample = ownSamples.get(otherSample)
+            if ownSample is None:
+                self.Samples.add(otherSample)
+            elif ownSample is not otherSample and hasattr(ownSample, "cross_complete"):
+                ownSample.cross_complete(otherSample)
                             
-    def create_plot(self, FilterAnalytes:list=None, firstDate:datetime.datetime=None, lastDate:datetime.datetime=None, nMinPoints:int=1):
-        raise NotImplementedError("create_plot(): Not implemented yet.")
-        #TODO: Allow date limination? firstDate, lastDate, simple filter call when selecting Data
-        Data = list(chain.from_iterable([x.Results for x in self.Samples]))
-        Data = [x for x in Data if x.Value] #Remove results without value.
-        
-        if FilterAnalytes:
-            Analytes = Counter(FilterAnalytes)
-        else:
-            Analytes = Counter([x.Analyte for x in Data]) #TODO: Don't bother plotting anything with less than nMinPoints?
-
-
-        fig = plt.figure()
-        plt.subplots_adjust(top=0.5, wspace=0.25, left=0.25)
-
-        FigCounter = 0
-        nAnalytes = len(Analytes.keys())
-        gridSize = utils.calc_grid(nAnalytes)
-
-        #TODO: One loop to calculate number of plots, then use pages (which seem to be thing?) or separate figures altogether
-
-        for _Analyte in Analytes.keys():
-            _SubplotData = [Result for Result in Data if Result.Analyte == _Analyte and isinstance(Result.Value, float)] #HACK to get plotting working, ignores all non-float/integer values. sorry.
-            if not _SubplotData:
-                continue                        
-            FigCounter = FigCounter + 1
-            ax = fig.add_subplot(*gridSize, FigCounter)
-
-            ax.plot([x.SampleTaken for x in _SubplotData], [y.Value for y in _SubplotData], c="#7d7d7d", zorder=1)
-
-            RefInterval = [z for z in REF_RANGES if z.Analyte == _Analyte]
-            if RefInterval:
-                #TODO: Extract values within RR, set values below RR to -INF, display is <LOQ? Force compatibility with most non-numeric values...
-                RefInterval = RefInterval[0]
-                ax.axhspan(ymin=RefInterval.LowerLimit, ymax=RefInterval.UpperLimit, facecolor='#2ca02c', alpha=0.3)
-                CmpLower = RefInterval.LowerLimit if RefInterval.LowerLimit is not None else float('-inf')
-                CmpUpper = RefInterval.UpperLimit if RefInterval.UpperLimit is not None else float('inf')
-                xInRef  = [x for x in _SubplotData if x.Value >= CmpLower and x.Value <= CmpUpper]
-                ax.scatter(x=[x.SampleTaken for x in xInRef], y=[x.Value for x in xInRef], label=_Analyte, s=10, c="#1f9c47", zorder=10) #Green, inside RR
-                xOutRef = [x for x in _SubplotData if x.Value < CmpLower or x.Value > CmpUpper]
-                ax.scatter(x=[x.SampleTaken for x in xOutRef], y=[x.Value for x in xOutRef], label=_Analyte, s=15, c="#ba1a14", zorder=10) #Red, for out of RR
-            else:
-                ax.scatter(x=[x.SampleTaken for x in _SubplotData], y=[x.Value for x in _SubplotData], label=_Analyte, s=10, c="#000000", zorder=10) #Black, no RR
-            
-            ax.set_title(_Analyte)
-            ax.xaxis.set_major_formatter(mpl.dates.DateFormatter("%b-%d"))
-            ax.xaxis.set_minor_formatter(mpl.dates.DateFormatter("%b-%d"))
-            ax.set_ylabel(f"{_SubplotData[0].Analyte} ({_SubplotData[0].Units})") #TODO ensure all analytes have same Units
-            #ax.set_xticklabels(ax.get_xticklabels(), rotation = 90)
-        
-        plt.show()
+    """ Writes this patient's numeric results as a trend plot (one subplot per analyte, reference range shaded) to outFile.
+        Returns the file written, or None if there was nothing to plot. See plotting.plot_patients() for many patients at once."""
+    def create_plot(self, FilterAnalytes:list=None, firstDate:datetime.datetime=None, lastDate:datetime.datetime=None, nMinPoints:int=1,
+                    outFile:str=None, Format:str="png"):
+        import plotting # Deferred: plotting imports datastructs, and needs matplotlib
+        return plotting.plot_patient(self, outFile=outFile, Format=Format, FilterAnalytes=FilterAnalytes, firstDate=firstDate, 
+                                     lastDate=lastDate, nMinPoints=nMinPoints)
 
     def list_loaded_results(self):
-        return list(chain.from_iterable([x.Results for x in self.Samples]))
+        return list(chain.from_iterable([_set.Results for x in self.Samples for _set in x.Sets]))
       
 """Contains data about a Sendaway Assay - receiving location, contact, expected TAT"""
 class ReferralLab():
@@ -483,55 +678,98 @@ def load_reference_ranges(filePath="./Limits.txt"):
             RefRanges.append( ReferenceRange(Analyte=tmp[0], Upper=tmp[3], Lower=tmp[2], Unit=tmp[1]) )
     return RefRanges
 
+""" Holds reference tables (sendaways, reference ranges) in memory, keyed by file path. Each table is parsed once and re-read only
+    when its file's modification time changes, and comes with a dict index for direct lookups (first entry per key wins)."""
+class ReferenceDataRegistry():
+    SENDAWAYS_PATH  = "./Sendaways_Database.txt"
+    REF_RANGES_PATH = "./Limits.txt"
+
+    def __init__(self):
+        self._Tables    = {}        # filePath: (mtime, items, index)
+        self._Lock      = threading.Lock()
+
+    def __repr__(self): return f"ReferenceDataRegistry({len(self._Tables)} table(s) loaded)"
+
+    def _get_table(self, filePath:str, loader, keyFun) -> tuple:
+        mtime = os.path.getmtime(filePath) if os.path.isfile(filePath) else None
+        with self._Lock:
+            cached = self._Tables.get(filePath)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+            datastructLogger.debug(f"ReferenceDataRegistry._get_table(): (Re)loading {filePath}.")
+            items = loader(filePath)
+            index = {}
+            for item in items:
+                index.setdefault(keyFun(item), item)
+            self._Tables[filePath] = (mtime, items, index)
+            return items, index
+
+    def sendaways(self, filePath:str=SENDAWAYS_PATH) -> list:
+        return self._get_table(filePath, load_sendaways_table, lambda x: x.SetCode)[0]
+
+    def reference_ranges(self, filePath:str=REF_RANGES_PATH) -> list:
+        return self._get_table(filePath, load_reference_ranges, lambda x: x.Analyte)[0]
+
+    def get_referral_lab(self, SetCode:str, filePath:str=SENDAWAYS_PATH):
+        return self._get_table(filePath, load_sendaways_table, lambda x: x.SetCode)[1].get(SetCode)
+
+    def get_reference_range(self, Analyte:str, filePath:str=REF_RANGES_PATH):
+        return self._get_table(filePath, load_reference_ranges, lambda x: x.Analyte)[1].get(Analyte)
+
+    def clear(self) -> None:
+        with self._Lock:
+            self._Tables.clear()
+
+""" Patient-level demographics shared by all of a patient's specimens (currently the NHS number), keyed by patient ID. Held in memory for
+    the whole session, and, if a LocalStore is passed, kept on disk for its UnreleasedTTL as well, so later runs start with them.
+    A known NHS number saves the 'Further' screen's '1' page only: 'F', '4' (clinical details, per specimen) and 'Q' are still sent."""
+class PatientDemographicsCache():
+    def __init__(self):
+        self._NHSNumbers    = {}
+        self._Lock          = threading.Lock()
+        self.Hits           = 0
+        self.Misses         = 0
+
+    def __repr__(self): return f"PatientDemographicsCache({len(self._NHSNumbers)} patients, {self.Hits} hits, {self.Misses} misses)"
+
+    def get_NHS_number(self, PatientID:str, Store=None):
+        if not PatientID: return None
+        with self._Lock:
+            NHSNumber = self._NHSNumbers.get(PatientID)
+        if NHSNumber is None and Store is not None:
+            NHSNumber = Store.get_NHS_number(PatientID)
+            if NHSNumber is not None:
+                with self._Lock:
+                    self._NHSNumbers[PatientID] = NHSNumber
+        with self._Lock:
+            if NHSNumber is None: self.Misses += 1
+            else:                 self.Hits += 1
+        return NHSNumber
+
+    """ Remembers a patient's NHS number. Blank values are not kept, as the number may yet be added to the record."""
+    def put_NHS_number(self, PatientID:str, NHSNumber:str, Store=None) -> None:
+        if not PatientID or not NHSNumber: return
+        with self._Lock:
+            if self._NHSNumbers.get(PatientID) == NHSNumber: return
+            self._NHSNumbers[PatientID] = NHSNumber
+        if Store is not None:
+            Store.put_NHS_number(PatientID, NHSNumber)
+
+    def clear(self) -> None:
+        with self._Lock:
+            self._NHSNumbers.clear()
+
 def sample_to_outputString(sample, FilterSets=None):
     pass
 
-def samples_to_file(Samples:list, FilterSets = None, fileName:str=None):
+def samples_to_file(Samples:list, FilterSets = None, fileName:str=None, Format:str="tsv", compress:bool=False):
     logging.info("samples_to_file(): Writing data to file.")
-    outFile = f"./{utils.timestamp(fileFormat=True)}_TPDownload.txt"
-    if fileName:
-        outFile = f"./{utils.timestamp(fileFormat=True)}_{fileName}.txt"
-    with open(outFile, 'w') as DATA_OUT:
-        DATA_OUT.write("Patient\tDOB\tSampleID\tCollected\tReceived\tSet\tStatus\tAnalyte\tValue\tUnits\tFlags\tComments\n")
-        for sample in Samples:
-            _PatientID = sample.PatientID
-            if _PatientID:
-                if len(_PatientID) > 8:
-                    _PatientID = format(_PatientID, "0>9")
-                else:
-                    _PatientID = format(_PatientID, "0>8")
-            else:
-                _PatientID = "[Unknown]"
-            OutStr = f"{_PatientID}\t{sample.DOB}\t{sample.ID}\t"
-            if sample.Sets:
-                if sample.Collected:
-                    OutStr = OutStr + sample.Collected.strftime("%d/%m/%Y %H:%M\t")
-                else:
-                    OutStr = OutStr + "NA\t"
-
-                if sample.Received:
-                    OutStr = OutStr + sample.Received.strftime("%d/%m/%Y %H:%M")
-                else:
-                    OutStr = OutStr + "NA"
-
-                for _set in sample.Sets:
-                    if FilterSets:
-                        if _set.Code not in FilterSets: 
-                            continue
-                    
-                    if _set.Results:
-                        ComStr = ' '.join(_set.Comments)
-                        for _result in _set.Results:
-                            if _result.Flags:
-                                DATA_OUT.write(f"{OutStr}\t{_set.Code}\t{_set.Status}\t{_result}\t{ComStr}\n") #_result calls str(), which returns Analyte\tValue\tUnit\tFlags
-                            else:
-                                DATA_OUT.write(f"{OutStr}\t{_set.Code}\t{_set.Status}\t{_result}\t\t{ComStr}\n") #_result calls str(), needs an extra \t if there are no flags
-                    else:
-                        DATA_OUT.write(f"{OutStr}\t{_set.Code}\t{_set.Status}\t\t\t\t\t\n") #_result calls str(), which returns Analyte\tValue\tUnit\tFlags
-            if sample.hasNotepadEntries == True:
-                NPadStr = "|".join([str(x) for x in sample.NotepadEntries])
-                DATA_OUT.write(f"{OutStr}\tSpecimen Notepad\t\t\t\t\t\t{NPadStr}\n")
-
-#REF_RANGES = load_reference_ranges()
-
-Patient.Storage = SingleTypeStorageContainer(Patient)
\ No newline at end of file
+    with exporters.get_exporter(Format, fileName=fileName, FilterSets=FilterSets, compress=compress) as Exporter:
+        Exporter.write_specimens(Samples)
+    return Exporter.FilePath
+
+REFERENCE_DATA = ReferenceDataRegistry()
+PATIENT_DEMOGRAPHICS = PatientDemographicsCache()
+
+Patient.Storage = IdentityMap(Patient)
+Specimen.Storage = IdentityMap(Specimen, MaxItems=20000)
\ No newline at end of file
@@ -52,7 +52,8 @@ LOCALISATION = TelePath_Commands(
     EMPTYSTR="",                                # Empty string, used to return to previous menu
     CANCEL_ACTION="^",                          # 'escape' command, cancels current action/returns to prev. screen. IMPORTANT.
     identify_screen=your_screen_check,          # This function receives the Screen and assigns its Type, OptionStr, Options, and DefaultOption
-    check_sample_id=your_sample_check           # This function receives a sample ID and returns True if it's valid. Can just always return true if there is no check.
+    check_sample_id=your_sample_check,          # This function receives a sample ID and returns True if it's valid. Can just always return true if there is no check.
+    MAX_SESSIONS=1                              # Simultaneous logins ProfX may open, eg. to search and download at the same time. Check your site's licence limits first.
 )
 
 #You could also define different Localisations and then assign one to LOCALISATION, eg. TelePath = TelePath_Commands(...); APEX = APEX_Commands(...), LOCALISATION=APEX
\ No newline at end of file
@@ -0,0 +1,343 @@
+#GPL-3.0-or-later
+
+import csv
+import datetime
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import utils
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+exportLogger = logging.getLogger(__name__)
+
+WRITE_BUFFER_SIZE = 1024 * 1024         # Bytes of output held in memory before the OS sees it
+FLUSH_EVERY = 50                        # Specimens between explicit flushes, so a crash loses at most this many
+
+""" Base class for writers that take downloaded Specimens one at a time and stream them to disk.
+    Subclasses implement _open(), _write_specimen() and _close(); use as a context manager, or call open()/close() yourself."""
+class SpecimenExporter():
+    Extension = ".txt"
+    Resumable = True                    # flush() puts every specimen written so far on disk, so a DownloadJournal can be kept alongside
+    HEADERS = ["Patient", "DOB", "SampleID", "Collected", "Received", "Set", "Status", "Analyte", "Value", "Units", "Flags", "Comments"]
+
+    def __init__(self, filePath:str=None, fileName:str=None, FilterSets:list=None, compress:bool=False, flushEvery:int=FLUSH_EVERY,
+                 append:bool=False):
+        if not filePath:
+            filePath = f"./{utils.timestamp(fileFormat=True)}_{fileName if fileName else 'TPDownload'}{self.Extension}"
+        if compress and not filePath.endswith(".gz"):
+            filePath = filePath + ".gz"
+        self.FilePath   = filePath
+        self.FilterSets = set(FilterSets) if FilterSets else None
+        self.Compress   = compress
+        if compress:
+            self.Resumable = False      # A gzip stream cut off mid-write has no trailer, and appending to it leaves the whole file unreadable
+        self.Append     = append        # Continue an existing file (eg. a resumed download) instead of replacing it
+        self.FlushEvery = max(flushEvery, 1)
+        self.nWritten   = 0
+        self.IO         = None
+
+    def __repr__(self): return f"{type(self).__name__}({self.FilePath}, {self.nWritten} specimens written)"
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    @property
+    def isOpen(self) -> bool: return self.IO is not None
+
+    @property
+    def isContinued(self) -> bool: return self.Append and os.path.exists(self.FilePath) and os.path.getsize(self.FilePath) > 0
+
+    def _open_text(self):
+        mode = 'a' if self.Append else 'w'
+        if self.Compress:
+            return gzip.open(self.FilePath, mode + 't', newline='', encoding="utf-8")
+        return open(self.FilePath, mode, newline='', buffering=WRITE_BUFFER_SIZE, encoding="utf-8")
+
+    def open(self):
+        if self.isOpen: return self
+        exportLogger.debug(f"{type(self).__name__}.open(): Writing to {self.FilePath}.")
+        self._open()
+        return self
+
+    def write_specimen(self, Specimen) -> None:
+        if not self.isOpen:
+            self.open()
+        self._write_specimen(Specimen)
+        self.nWritten += 1
+        if self.nWritten % self.FlushEvery == 0:
+            self.flush()
+
+    def write_specimens(self, Specimens) -> None:
+        for Specimen in Specimens:
+            self.write_specimen(Specimen)
+
+    def flush(self) -> None:
+        if self.isOpen:
+            self.IO.flush()
+
+    def close(self) -> None:
+        if not self.isOpen: return
+        self._close()
+        self.IO = None
+        exportLogger.debug(f"{type(self).__name__}.close(): {self.nWritten} specimens written to {self.FilePath}.")
+
+    def _open(self): raise NotImplementedError
+
+    def _write_specimen(self, Specimen): raise NotImplementedError
+
+    def _close(self):
+        self.IO.flush()
+        self.IO.close()
+
+    @staticmethod
+    def format_patient_ID(PatientID) -> str:
+        if not PatientID:
+            return "[Unknown]"
+        if len(PatientID) > 8:
+            return format(PatientID, "0>9")
+        return format(PatientID, "0>8")
+
+    @staticmethod
+    def format_datetime(value) -> str:
+        if isinstance(value, datetime.datetime):
+            return value.strftime("%d/%m/%Y %H:%M")
+        if value:
+            return str(value)
+        return "NA"
+
+    """ Yields one row (list of str, in HEADERS order) per result, one per set without results, and one for the specimen notepad."""
+    def specimen_rows(self, Specimen):
+        Prefix = [SpecimenExporter.format_patient_ID(Specimen.PatientID), str(Specimen.DOB), Specimen.ID,
+                  SpecimenExporter.format_datetime(Specimen.Collected), SpecimenExporter.format_datetime(Specimen.Received)]
+        for _set in Specimen.Sets:
+            if self.FilterSets and _set.Code not in self.FilterSets:
+                continue
+            if _set.Results:
+                ComStr = ' '.join(_set.Comments)
+                for _result in _set.Results:
+                    Flags = f"[{_result.Flags}]" if _result.Flags else ""
+                    yield Prefix + [_set.Code, str(_set.Status), str(_result.Analyte), str(_result.Value), str(_result.Units), Flags, ComStr]
+            else:
+                yield Prefix + [_set.Code, str(_set.Status), "", "", "", "", ""]
+        if Specimen.hasNotepadEntries == True:
+            yield Prefix + ["Specimen Notepad", "", "", "", "", "", "|".join([str(x) for x in Specimen.NotepadEntries])]
+
+
+""" Tab-separated text, the format samples_to_file() has always produced"""
+class TSVExporter(SpecimenExporter):
+    Extension = ".txt"
+
+    def _open(self):
+        writeHeader = not self.isContinued
+        self.IO = self._open_text()
+        if writeHeader:
+            self.IO.write("\t".join(SpecimenExporter.HEADERS) + "\n")
+
+    def _write_specimen(self, Specimen):
+        self.IO.writelines(["\t".join(row) + "\n" for row in self.specimen_rows(Specimen)])
+
+
+class CSVExporter(SpecimenExporter):
+    Extension = ".csv"
+
+    def _open(self):
+        writeHeader = not self.isContinued
+        self.IO = self._open_text()
+        self.Writer = csv.writer(self.IO)
+        if writeHeader:
+            self.Writer.writerow(SpecimenExporter.HEADERS)
+
+    def _write_specimen(self, Specimen):
+        self.Writer.writerows(self.specimen_rows(Specimen))
+
+
+""" One JSON object per line and specimen, as produced by Specimen.to_dict() (sets limited to FilterSets, if given)"""
+class JSONLinesExporter(SpecimenExporter):
+    Extension = ".jsonl"
+
+    def _open(self):
+        self.IO = self._open_text()
+
+    def _write_specimen(self, Specimen):
+        data = Specimen.to_dict()
+        if self.FilterSets:
+            data["Sets"] = [x for x in data["Sets"] if x["Code"] in self.FilterSets]
+        self.IO.write(json.dumps(data, default=utils.json_default) + "\n")
+
+
+""" Writes the same rows as TSVExporter into the table 'results' of an SQLite database, committing every flushEvery specimens"""
+class SQLiteExporter(SpecimenExporter):
+    Extension = ".sqlite"
+    COLUMNS = ["patient", "dob", "sample_id", "collected", "received", "set_code", "status", "analyte", "value", "units", "flags", "comments"]
+
+    def __init__(self, filePath:str=None, fileName:str=None, FilterSets:list=None, compress:bool=False, flushEvery:int=FLUSH_EVERY,
+                 append:bool=False):
+        if compress:
+            raise ValueError("SQLiteExporter cannot write compressed output.")
+        super().__init__(filePath, fileName, FilterSets, compress, flushEvery, append)
+
+    def _open(self):
+        self.IO = sqlite3.connect(self.FilePath)
+        self.IO.execute(f"CREATE TABLE IF NOT EXISTS results ({', '.join(x + ' TEXT' for x in SQLiteExporter.COLUMNS)})")
+        self.IO.execute("CREATE INDEX IF NOT EXISTS results_sample ON results (sample_id)")
+
+    def _write_specimen(self, Specimen):
+        self.IO.executemany(f"INSERT INTO results VALUES ({', '.join('?' * len(SQLiteExporter.COLUMNS))})", self.specimen_rows(Specimen))
+
+    def flush(self):
+        if self.isOpen:
+            self.IO.commit()
+
+    def _close(self):
+        self.IO.commit()
+        self.IO.close()
+
+
+""" Writes typed, columnar Parquet tables (specimens, sets, results, comments, notepad) into a directory, one file per table.
+    Rows are buffered and written out as a row group every RowGroupSize rows, so large downloads never sit in memory as a whole.
+    Dates are stored as timestamps, numeric results as float64 (free text such as '<5' goes into value_text), and repetitive
+    strings like set codes, analytes and units are dictionary-encoded. Requires pyarrow."""
+class ParquetExporter(SpecimenExporter):
+    Extension = "_parquet"
+    Resumable = False                   # A Parquet file is unreadable until close() writes its footer, so there is nothing to resume from
+    ROW_GROUP_SIZE = 100000
+
+    def __init__(self, filePath:str=None, fileName:str=None, FilterSets:list=None, compress:bool=False, flushEvery:int=FLUSH_EVERY, 
+                 append:bool=False, RowGroupSize:int=ROW_GROUP_SIZE):
+        if pa is None:
+            raise ImportError("ParquetExporter requires pyarrow. Install it with 'pip install pyarrow'.")
+        super().__init__(filePath, fileName, FilterSets, False, flushEvery, append)
+        self.Compression    = "zstd" if compress else "snappy"
+        self.RowGroupSize   = RowGroupSize
+        self.Schemas        = ParquetExporter.get_schemas()
+        self.Writers        = {}
+        self.Buffers        = {}
+
+    @staticmethod
+    def get_schemas() -> dict:
+        Code    = pa.dictionary(pa.int32(), pa.string())
+        Time    = pa.timestamp("s")
+        return {
+            "specimens":    pa.schema([("sample_id", pa.string()), ("patient_id", pa.string()), ("lname", pa.string()), ("fname", pa.string()),
+                                       ("dob", pa.date32()), ("nhs_number", pa.string()), ("collected", Time), ("received", Time),
+                                       ("clin_details", pa.string()), ("location", Code), ("requestor", Code), ("category", Code), ("type", Code)]),
+            "sets":         pa.schema([("sample_id", pa.string()), ("set_index", pa.int32()), ("set_code", Code), ("status", Code),
+                                       ("requested_on", Time), ("authed_on", Time), ("authed_by", Code)]),
+            "results":      pa.schema([("sample_id", pa.string()), ("set_code", Code), ("analyte", Code), ("value", pa.float64()),
+                                       ("value_text", pa.string()), ("units", Code), ("flags", Code), ("sample_taken", Time),
+                                       ("reported_on", Time), ("authed_on", Time)]),
+            "comments":     pa.schema([("sample_id", pa.string()), ("set_code", Code), ("line", pa.int32()), ("text", pa.string())]),
+            "notepad":      pa.schema([("sample_id", pa.string()), ("entry_index", pa.string()), ("author", Code), ("authored", pa.string()), 
+                                       ("text", pa.string())]),
+        }
+
+    @property
+    def isOpen(self) -> bool: return bool(self.Writers)
+
+    @staticmethod
+    def _datetime(value):
+        return value if isinstance(value, datetime.datetime) else None
+
+    @staticmethod
+    def _date(value):
+        if isinstance(value, datetime.datetime): return value.date()
+        if isinstance(value, datetime.date): return value
+        return None
+
+    @staticmethod
+    def _str(value):
+        return None if value is None else str(value)
+
+    def _open(self):
+        if self.isContinued:
+            raise ValueError(f"ParquetExporter cannot append to the existing export in {self.FilePath}.")
+        os.makedirs(self.FilePath, exist_ok=True)
+        for table, schema in self.Schemas.items():
+            self.Writers[table] = pq.ParquetWriter(os.path.join(self.FilePath, f"{table}.parquet"), schema, compression=self.Compression)
+            self.Buffers[table] = {x: [] for x in schema.names}
+
+    def _append(self, table:str, *row):
+        for column, value in zip(self.Buffers[table].values(), row):
+            column.append(value)
+        if len(self.Buffers[table]["sample_id"]) >= self.RowGroupSize:
+            self._write_row_group(table)
+
+    def _write_row_group(self, table:str):
+        Buffer = self.Buffers[table]
+        if not Buffer["sample_id"]: return
+        Arrays = []
+        for field in self.Schemas[table]:
+            if pa.types.is_dictionary(field.type):
+                Arrays.append(pa.array(Buffer[field.name], type=pa.string()).dictionary_encode())
+            else:
+                Arrays.append(pa.array(Buffer[field.name], type=field.type))
+        self.Writers[table].write_table(pa.Table.from_arrays(Arrays, schema=self.Schemas[table]))
+        for column in Buffer.values():
+            column.clear()
+
+    def _write_specimen(self, Specimen):
+        ID = str(Specimen.ID)
+        self._append("specimens", ID, self._str(Specimen.PatientID), Specimen.LName, Specimen.FName, self._date(Specimen.DOB),
+                     self._str(Specimen.NHSNumber), self._datetime(Specimen.Collected), self._datetime(Specimen.Received),
+                     Specimen.ClinDetails, self._str(Specimen.Location), self._str(Specimen.Requestor), self._str(Specimen.Category), 
+                     self._str(Specimen.Type))
+        for _set in Specimen.Sets:
+            if self.FilterSets and _set.Code not in self.FilterSets:
+                continue
+            self._append("sets", ID, _set.Index, _set.Code, self._str(_set.Status), self._datetime(_set.RequestedOn), 
+                         self._datetime(_set.AuthedOn), self._str(_set.AuthedBy))
+            for _result in _set.Results:
+                isNumeric = isinstance(_result.Value, float)
+                self._append("results", ID, _set.Code, self._str(_result.Analyte), _result.Value if isNumeric else None, 
+                             None if isNumeric else self._str(_result.Value), self._str(_result.Units), _result.Flags or None, 
+                             self._datetime(_result.SampleTaken), self._datetime(_result.ReportedOn), self._datetime(_result.AuthDateTime))
+            for lineNo, comment in enumerate(_set.Comments):
+                self._append("comments", ID, _set.Code, lineNo, comment)
+        for entry in Specimen.NotepadEntries:
+            self._append("notepad", ID, self._str(entry.Index), self._str(entry.Author), self._str(entry.Authored), entry.Text)
+
+    """ Periodic flushes only write tables that have filled a row group; everything else is written on close(). Hence not Resumable."""
+    def flush(self):
+        pass
+
+    def _close(self):
+        for table, writer in self.Writers.items():
+            self._write_row_group(table)
+            writer.close()
+        self.Writers = {}
+        self.Buffers = {}
+
+    def close(self) -> None:
+        if not self.isOpen: return
+        self._close()
+        exportLogger.debug(f"ParquetExporter.close(): {self.nWritten} specimens written to {self.FilePath}.")
+
+
+EXPORTERS = {"tsv": TSVExporter, "csv": CSVExporter, "jsonl": JSONLinesExporter, "sqlite": SQLiteExporter, "parquet": ParquetExporter}
+
+def get_exporter_type(Format:str="tsv") -> type:
+    Format = Format.lower()
+    if Format not in EXPORTERS:
+        raise ValueError(f"get_exporter(): Unknown export format '{Format}'. Use one of: {', '.join(EXPORTERS.keys())}.")
+    return EXPORTERS[Format]
+
+""" Whether a download to Format can be journaled and resumed; compressed output never can (see SpecimenExporter.__init__())."""
+def is_resumable(Format:str="tsv", compress:bool=False) -> bool:
+    return get_exporter_type(Format).Resumable and not compress
+
+""" Creates an exporter by format name (tsv, csv, jsonl, sqlite, parquet). compress=True gzips text formats, and uses zstd for parquet."""
+def get_exporter(Format:str="tsv", filePath:str=None, fileName:str=None, FilterSets:list=None, compress:bool=False, append:bool=False) -> SpecimenExporter:
+    return get_exporter_type(Format)(filePath=filePath, fileName=fileName, FilterSets=FilterSets, compress=compress, append=append)
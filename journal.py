@@ -0,0 +1,133 @@
+#GPL-3.0-or-later
+
+import json
+import logging
+import os
+import threading
+import utils
+
+journalLogger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_DIR = "."
+
+""" Write-ahead journal for long downloads, one JSON object per line. The first line describes the job (its inputs and output file);
+    every following line records a finished specimen (with its data) or a finished work item. Each line is flushed and synced before
+    the next item starts, so after a crash a job started again with resume=True can skip everything the journal already holds.
+    The journal is deleted by finish() once the job has completed."""
+class DownloadJournal():
+    def __init__(self, JobName:str, resume:bool=False, journalDir:str=DEFAULT_JOURNAL_DIR):
+        self.JobName    = JobName
+        self.FilePath   = os.path.join(journalDir, f"ProfX_{JobName}.journal")
+        self.Header     = None
+        self.Specimens  = {}        # ID: Specimen.to_dict()
+        self.Items      = set()
+        self.Outcomes   = {}        # Item: last outcome recorded for it, finished or not
+        self._Lock      = threading.Lock()
+        if resume and os.path.isfile(self.FilePath):
+            self._load()
+            mode = 'a'
+        else:
+            if os.path.isfile(self.FilePath):
+                self._rotate()
+            mode = 'w'
+        self.IO = open(self.FilePath, mode, encoding="utf-8")
+
+    def __repr__(self): return f"DownloadJournal({self.FilePath}, {len(self.Specimens)} specimens, {len(self.Items)} items)"
+
+    def __len__(self): return len(self.Specimens)
+
+    @property
+    def isResumed(self) -> bool: return self.Header is not None
+
+    @property
+    def Inputs(self) -> list: return self.Header.get("Inputs") if self.Header else None
+
+    @property
+    def Output(self) -> str: return self.Header.get("Output") if self.Header else None
+
+    """ Reads an existing journal. A line cut off by the crash is dropped, and the file truncated to the last complete line."""
+    def _load(self) -> None:
+        goodBytes = 0
+        with open(self.FilePath, 'rb') as IO:
+            for line in IO:
+                try:
+                    entry = json.loads(line.decode("utf-8"), object_hook=utils.json_object_hook)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    journalLogger.warning(f"DownloadJournal._load(): Incomplete entry at end of {self.FilePath}, discarding it.")
+                    break
+                goodBytes += len(line)
+                if "Header" in entry:
+                    self.Header = entry["Header"]
+                elif "Specimen" in entry:
+                    self.Specimens[entry["Specimen"]] = entry["Data"]
+                elif "Item" in entry:
+                    self.Items.add(entry["Item"])
+                    self.Outcomes[entry["Item"]] = entry.get("Outcome")
+                elif "Failed" in entry:
+                    self.Outcomes[entry["Failed"]] = entry.get("Outcome")
+        with open(self.FilePath, 'r+b') as IO:
+            IO.truncate(goodBytes)
+        logging.info(f"DownloadJournal(): Resuming job '{self.JobName}': {len(self.Specimens)} specimens and {len(self.Items)} items already done.")
+
+    """ A journal is deleted once its job completes, so one that is still there belongs to an interrupted job. Rather than overwrite it,
+        it is renamed (with the current time), so that job can still be resumed by hand."""
+    def _rotate(self) -> None:
+        stem, ext = os.path.splitext(self.FilePath)
+        stem = f"{stem}_{utils.timestamp(fileFormat=True)}"
+        rotated = stem + ext
+        n = 1
+        while os.path.exists(rotated):
+            rotated = f"{stem}_{n}{ext}"
+            n += 1
+        os.rename(self.FilePath, rotated)
+        journalLogger.warning(f"DownloadJournal(): Job '{self.JobName}' was interrupted before, and is being started afresh; its journal was kept as {rotated}.")
+
+    def _append(self, entry:dict) -> None:
+        with self._Lock:
+            self.IO.write(json.dumps(entry, default=utils.json_default) + "\n")
+            self.IO.flush()
+            os.fsync(self.IO.fileno())
+
+    """ Records the job's inputs and output file, unless this is a resumed job, whose header is kept. Returns the header in effect."""
+    def start(self, Inputs:list=None, Output:str=None) -> dict:
+        if self.Header is None:
+            self.Header = {"Job": self.JobName, "Started": utils.timestamp(), "Inputs": Inputs, "Output": Output}
+            self._append({"Header": self.Header})
+        return self.Header
+
+    def has_specimen(self, SpecimenID) -> bool: return str(SpecimenID) in self.Specimens
+
+    def record_specimen(self, Specimen) -> None:
+        data = Specimen.to_dict()
+        self._append({"Specimen": str(Specimen.ID), "Data": data})
+        self.Specimens[str(Specimen.ID)] = data
+
+    """ Fills Specimen with the data journaled for it. Returns False if the journal has none."""
+    def restore_specimen(self, Specimen, SetType=None) -> bool:
+        data = self.Specimens.get(str(Specimen.ID))
+        if data is None: return False
+        Specimen.restore_from_dict(data, SetType=SetType)
+        return True
+
+    def is_done(self, Item) -> bool: return str(Item) in self.Items
+
+    def mark_done(self, Item, Outcome:str=None) -> None:
+        self._append({"Item": str(Item), "Outcome": Outcome})
+        self.Items.add(str(Item))
+        self.Outcomes[str(Item)] = Outcome
+
+    """ Records an item that was attempted but did not succeed; unlike mark_done(), it will be tried again on resume."""
+    def record_failure(self, Item, Outcome:str) -> None:
+        self._append({"Failed": str(Item), "Outcome": Outcome})
+        self.Outcomes[str(Item)] = Outcome
+
+    def close(self) -> None:
+        with self._Lock:
+            if not self.IO.closed:
+                self.IO.close()
+
+    """ Closes and deletes the journal; call once the job has completed."""
+    def finish(self) -> None:
+        self.close()
+        os.remove(self.FilePath)
+        journalLogger.debug(f"DownloadJournal.finish(): Job '{self.JobName}' complete, journal removed.")
@@ -0,0 +1,360 @@
+#GPL-3.0-or-later
+
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+import utils
+
+localStoreLogger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH  = "./ProfX_Cache.sqlite"
+UNRELEASED_TTL      = datetime.timedelta(hours=1)     # How long data for sets that can still change is trusted
+
+""" On-disk store for data downloaded from the LIMS, so repeat runs don't have to navigate to it again.
+    Sets whose Status starts with R (released) cannot change any more and are kept indefinitely; anything else, including the specimen
+    records themselves, expires after UnreleasedTTL."""
+class LocalStore():
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS specimens (
+            specimen_id TEXT PRIMARY KEY,
+            fetched     REAL NOT NULL,
+            immutable   INTEGER NOT NULL,
+            has_notepad INTEGER NOT NULL,
+            has_further INTEGER NOT NULL,
+            data        TEXT NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS sets (
+            specimen_id TEXT NOT NULL,
+            set_code    TEXT NOT NULL,
+            set_index   INTEGER,
+            status      TEXT,
+            fetched     REAL NOT NULL,
+            immutable   INTEGER NOT NULL,
+            has_comments INTEGER NOT NULL,
+            data        TEXT NOT NULL,
+            PRIMARY KEY (specimen_id, set_code))""",
+        """CREATE TABLE IF NOT EXISTS worksheet_runs (
+            assay       TEXT NOT NULL,
+            run_date    TEXT NOT NULL,
+            n_runs      INTEGER NOT NULL,
+            fetched     REAL NOT NULL,
+            immutable   INTEGER NOT NULL,
+            PRIMARY KEY (assay, run_date))""",
+        """CREATE TABLE IF NOT EXISTS worksheets (
+            assay       TEXT NOT NULL,
+            run_date    TEXT NOT NULL,
+            run_no      INTEGER NOT NULL,
+            fetched     REAL NOT NULL,
+            immutable   INTEGER NOT NULL,
+            aux         TEXT NOT NULL,
+            PRIMARY KEY (assay, run_date, run_no))""",
+        """CREATE TABLE IF NOT EXISTS rack_locations (
+            specimen_id TEXT PRIMARY KEY,
+            fetched     REAL NOT NULL,
+            data        TEXT NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS overdue_snapshot (
+            section     TEXT NOT NULL,
+            specimen_id TEXT NOT NULL,
+            set_codes   TEXT NOT NULL,
+            first_seen  REAL NOT NULL,
+            last_seen   REAL NOT NULL,
+            details     TEXT,
+            PRIMARY KEY (section, specimen_id))""",
+        """CREATE TABLE IF NOT EXISTS patients (
+            patient_id  TEXT PRIMARY KEY,
+            nhs_number  TEXT NOT NULL,
+            fetched     REAL NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS specimen_patients (
+            specimen_id TEXT PRIMARY KEY,
+            patient_id  TEXT NOT NULL,
+            fetched     REAL NOT NULL,
+            data        TEXT NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS set_history (
+            specimen_id TEXT NOT NULL,
+            set_code    TEXT NOT NULL,
+            fetched     REAL NOT NULL,
+            data        TEXT NOT NULL,
+            PRIMARY KEY (specimen_id, set_code))""",
+        """CREATE TABLE IF NOT EXISTS notepad_entries (
+            specimen_id TEXT NOT NULL,
+            entry_index TEXT NOT NULL,
+            authored    TEXT NOT NULL,
+            fetched     REAL NOT NULL,
+            data        TEXT NOT NULL,
+            PRIMARY KEY (specimen_id, entry_index, authored))""",
+    ]
+
+    def __init__(self, filePath:str=DEFAULT_STORE_PATH, UnreleasedTTL:datetime.timedelta=UNRELEASED_TTL):
+        self.FilePath       = filePath
+        self.UnreleasedTTL  = UnreleasedTTL.total_seconds()
+        self._Lock          = threading.RLock()
+        self.DB             = sqlite3.connect(filePath, check_same_thread=False)
+        with self._Lock:
+            for statement in LocalStore.SCHEMA:
+                self.DB.execute(statement)
+            self.DB.commit()
+        localStoreLogger.debug(f"LocalStore(): Opened {filePath}.")
+
+    def __repr__(self): return f"LocalStore({self.FilePath})"
+
+    @staticmethod
+    def set_is_released(Status) -> bool:
+        return bool(Status) and Status[0] == "R"
+
+    @staticmethod
+    def dumps(data) -> str:
+        return json.dumps(data, default=utils.json_default)
+
+    @staticmethod
+    def loads(text:str):
+        return json.loads(text, object_hook=utils.json_object_hook)
+
+    def _is_fresh(self, fetched:float, immutable:bool) -> bool:
+        return bool(immutable) or (time.time() - fetched) < self.UnreleasedTTL
+
+    def commit(self) -> None:
+        with self._Lock:
+            self.DB.commit()
+
+    def close(self) -> None:
+        with self._Lock:
+            self.DB.commit()
+            self.DB.close()
+
+    """ Returns the cached to_dict() record of a set, or None if there is none or it has expired.
+        If Status is given, the cached set must also have that status (ie. nothing happened to it since)."""
+    def get_set(self, SpecimenID:str, SetCode:str, Status:str=None, needComments:bool=False):
+        with self._Lock:
+            row = self.DB.execute("SELECT status, fetched, immutable, has_comments, data FROM sets WHERE specimen_id=? AND set_code=?",
+                                  (str(SpecimenID), SetCode)).fetchone()
+        if not row: return None
+        _status, fetched, immutable, has_comments, data = row
+        if Status is not None and Status != _status: return None
+        if needComments and not has_comments: return None
+        if not self._is_fresh(fetched, immutable): return None
+        return LocalStore.loads(data)
+
+    """ Returns the cached to_dict() record of a set if its fingerprint (specimen, set code, index, status; see TestSet.Fingerprint) is the
+        one stored with it, otherwise None. A released set whose overview entry has not changed has not changed, however old the record;
+        results can reach an unreleased set without its status changing, so those records still expire after UnreleasedTTL."""
+    def get_set_by_fingerprint(self, Fingerprint:tuple, needComments:bool=False):
+        SpecimenID, SetCode, SetIndex, Status = Fingerprint
+        if SetIndex is None or Status is None: return None
+        with self._Lock:
+            row = self.DB.execute("SELECT fetched, has_comments, data FROM sets WHERE specimen_id=? AND set_code=? AND set_index=? AND status=?",
+                                  (str(SpecimenID), SetCode, SetIndex, Status)).fetchone()
+        if not row: return None
+        fetched, has_comments, data = row
+        if needComments and not has_comments: return None
+        if not self._is_fresh(fetched, LocalStore.set_is_released(Status)): return None
+        return LocalStore.loads(data)
+
+    def put_set(self, SpecimenID:str, Set, hasComments:bool=False, commit:bool=True) -> None:
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO sets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (str(SpecimenID), Set.Code, Set.Index, Set.Status, time.time(), LocalStore.set_is_released(Set.Status),
+                             hasComments, LocalStore.dumps(Set.to_dict())))
+            if commit: self.DB.commit()
+
+    """ Returns the cached to_dict() record of a specimen (without Sets), or None if there is none, it has expired,
+        or it lacks notepad/'Further' data that the caller needs."""
+    def get_specimen(self, SpecimenID:str, needNotepad:bool=False, needFurther:bool=False):
+        with self._Lock:
+            row = self.DB.execute("SELECT fetched, immutable, has_notepad, has_further, data FROM specimens WHERE specimen_id=?",
+                                  (str(SpecimenID), )).fetchone()
+        if not row: return None
+        fetched, immutable, has_notepad, has_further, data = row
+        if needNotepad and not has_notepad: return None
+        if needFurther and not has_further: return None
+        if not self._is_fresh(fetched, immutable): return None
+        return LocalStore.loads(data)
+
+    """ Stores the specimen and its sets (or only those in Sets, eg. the ones actually downloaded). Released sets are kept indefinitely, but
+        the specimen record itself (notepad, clinical details, NHS number, list of sets) can still gain entries and add-on sets, so it always expires after UnreleasedTTL."""
+    def put_specimen(self, Specimen, hasNotepad:bool=False, hasFurther:bool=False, hasComments:bool=False, Sets:list=None) -> None:
+        if Sets is None:
+            Sets = Specimen.Sets
+        immutable = False
+        data = Specimen.to_dict(includeSets=False)
+        data["SetCodes"] = Specimen.Sets.Codes      # Every set on the specimen, even those not downloaded this time
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO specimens VALUES (?, ?, ?, ?, ?, ?)",
+                            (Specimen.ID, time.time(), immutable, hasNotepad, hasFurther, LocalStore.dumps(data)))
+            for Set in Sets:
+                if Set.Index is None or Set.Index == -1: continue
+                self.put_set(Specimen.ID, Set, hasComments=hasComments, commit=False)
+            self.DB.commit()
+
+    """ Fills Specimen entirely from the store, if its record and all of its cached sets are fresh. With onlyKnownSets, only the sets
+        Specimen already has are required, otherwise every set the specimen had when stored; FilterSets narrows this further.
+        Returns True on success; on failure, Specimen is left untouched."""
+    def restore_specimen(self, Specimen, SetType=None, FilterSets=None, onlyKnownSets:bool=False, needNotepad:bool=False, 
+                         needFurther:bool=False, needComments:bool=False) -> bool:
+        data = self.get_specimen(Specimen.ID, needNotepad=needNotepad, needFurther=needFurther)
+        if data is None: return False
+        if onlyKnownSets:
+            setCodes = Specimen.Sets.Codes
+        else:
+            setCodes = data["SetCodes"]
+        if FilterSets:
+            setCodes = [x for x in setCodes if x in FilterSets]
+        Sets = []
+        for setCode in setCodes:
+            setData = self.get_set(Specimen.ID, setCode, needComments=needComments)
+            if setData is None: return False
+            Sets.append(setData)
+        if not Sets: return False
+        data["Sets"] = Sets
+        Specimen.restore_from_dict(data, SetType=SetType)
+        return True
+
+    """ No run can be started on a day that is over, so what is known about past days' worksheets never changes."""
+    @staticmethod
+    def run_date_is_past(RunDate:datetime.date) -> bool:
+        return RunDate < datetime.date.today()
+
+    """ Returns how many runs of Assay were started on RunDate (0 if none), or None if that isn't known or has expired."""
+    def get_run_count(self, Assay:str, RunDate:datetime.date):
+        with self._Lock:
+            row = self.DB.execute("SELECT n_runs, fetched, immutable FROM worksheet_runs WHERE assay=? AND run_date=?",
+                                  (Assay, RunDate.isoformat())).fetchone()
+        if not row: return None
+        n_runs, fetched, immutable = row
+        if not self._is_fresh(fetched, immutable): return None
+        return n_runs
+
+    def put_run_count(self, Assay:str, RunDate:datetime.date, nRuns:int) -> None:
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO worksheet_runs VALUES (?, ?, ?, ?, ?)",
+                            (Assay, RunDate.isoformat(), nRuns, time.time(), LocalStore.run_date_is_past(RunDate)))
+            self.DB.commit()
+
+    """ Returns the printed (AUX) text of a worksheet, or None if there is none or it has expired."""
+    def get_worksheet(self, Assay:str, RunDate:datetime.date, RunNo:int):
+        with self._Lock:
+            row = self.DB.execute("SELECT fetched, immutable, aux FROM worksheets WHERE assay=? AND run_date=? AND run_no=?",
+                                  (Assay, RunDate.isoformat(), RunNo)).fetchone()
+        if not row: return None
+        fetched, immutable, aux = row
+        if not self._is_fresh(fetched, immutable): return None
+        return aux
+
+    def put_worksheet(self, Assay:str, RunDate:datetime.date, RunNo:int, AUXText:str) -> None:
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO worksheets VALUES (?, ?, ?, ?, ?, ?)",
+                            (Assay, RunDate.isoformat(), RunNo, time.time(), LocalStore.run_date_is_past(RunDate), AUXText))
+            self.DB.commit()
+
+    """ Returns the SFS locations last seen for a specimen, as a list of [Rack, Row, Column, Stored] (empty if it was in no rack),
+        or None if it was never looked up or the lookup is older than maxAge. Samples get moved and discarded, so nothing here is immutable."""
+    def get_rack_locations(self, SpecimenID:str, maxAge:datetime.timedelta):
+        with self._Lock:
+            row = self.DB.execute("SELECT fetched, data FROM rack_locations WHERE specimen_id=?", (str(SpecimenID), )).fetchone()
+        if not row: return None
+        fetched, data = row
+        if time.time() - fetched > maxAge.total_seconds(): return None
+        return LocalStore.loads(data)
+
+    def put_rack_locations(self, SpecimenID:str, Locations:list) -> None:
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO rack_locations VALUES (?, ?, ?)", (str(SpecimenID), time.time(), LocalStore.dumps(Locations)))
+            self.DB.commit()
+
+    """ Returns the last saved overdue list of Section, as a dict of Specimen ID: {"SetCodes", "FirstSeen", "LastSeen", "Details"}.
+        Details is the to_dict() record saved with put_overdue_details(), or None."""
+    def get_overdue_snapshot(self, Section:str) -> dict:
+        with self._Lock:
+            rows = self.DB.execute("SELECT specimen_id, set_codes, first_seen, last_seen, details FROM overdue_snapshot WHERE section=?", 
+                                   (Section, )).fetchall()
+        return {x[0]: {"SetCodes": LocalStore.loads(x[1]), "FirstSeen": datetime.datetime.fromtimestamp(x[2]), 
+                       "LastSeen": datetime.datetime.fromtimestamp(x[3]), "Details": LocalStore.loads(x[4]) if x[4] else None} for x in rows}
+
+    """ Replaces the overdue list of Section with Entries (Specimen ID: set codes). Specimens no longer listed are dropped; those still
+        listed keep the time they were first seen, and their details."""
+    def save_overdue_snapshot(self, Section:str, Entries:dict) -> None:
+        now = time.time()
+        with self._Lock:
+            Known = {x[0] for x in self.DB.execute("SELECT specimen_id FROM overdue_snapshot WHERE section=?", (Section, ))}
+            self.DB.executemany("DELETE FROM overdue_snapshot WHERE section=? AND specimen_id=?", ((Section, x) for x in Known - Entries.keys()))
+            self.DB.executemany("UPDATE overdue_snapshot SET set_codes=?, last_seen=? WHERE section=? AND specimen_id=?",
+                                ((LocalStore.dumps(v), now, Section, k) for k, v in Entries.items() if k in Known))
+            self.DB.executemany("INSERT INTO overdue_snapshot VALUES (?, ?, ?, ?, ?, NULL)",
+                                ((Section, k, LocalStore.dumps(v), now, now) for k, v in Entries.items() if k not in Known))
+            self.DB.commit()
+
+    def put_overdue_details(self, Section:str, Specimen) -> None:
+        with self._Lock:
+            self.DB.execute("UPDATE overdue_snapshot SET details=? WHERE section=? AND specimen_id=?", 
+                            (LocalStore.dumps(Specimen.to_dict()), Section, str(Specimen.ID)))
+            self.DB.commit()
+
+    """ Returns a patient's NHS number, or None if it is not known or was looked up longer than UnreleasedTTL ago: temporary and overseas
+        numbers get replaced, and records get merged."""
+    def get_NHS_number(self, PatientID:str):
+        with self._Lock:
+            row = self.DB.execute("SELECT nhs_number, fetched FROM patients WHERE patient_id=?", (str(PatientID), )).fetchone()
+        if not row: return None
+        nhs_number, fetched = row
+        if not self._is_fresh(fetched, False): return None
+        return nhs_number
+
+    def put_NHS_number(self, PatientID:str, NHSNumber:str) -> None:
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO patients VALUES (?, ?, ?)", (str(PatientID), NHSNumber, time.time()))
+            self.DB.commit()
+
+    """ Returns the patient a specimen belongs to, as {"PatientID", "LName", "FName", "DOB"}, or None if it was never seen or was seen
+        longer than UnreleasedTTL ago: mislabelled specimens do get moved to the right patient."""
+    def get_specimen_patient(self, SpecimenID:str):
+        with self._Lock:
+            row = self.DB.execute("SELECT fetched, data FROM specimen_patients WHERE specimen_id=?", (str(SpecimenID), )).fetchone()
+        if not row: return None
+        fetched, data = row
+        if not self._is_fresh(fetched, False): return None
+        return LocalStore.loads(data)
+
+    def put_specimen_patient(self, Specimen, commit:bool=True) -> None:
+        if not Specimen.PatientID: return
+        data = {"PatientID": Specimen.PatientID, "LName": Specimen.LName, "FName": Specimen.FName, "DOB": Specimen.DOB}
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO specimen_patients VALUES (?, ?, ?, ?)", 
+                            (str(Specimen.ID), Specimen.PatientID, time.time(), LocalStore.dumps(data)))
+            if commit: self.DB.commit()
+
+    """ Returns the stored history of a set as a list of tp_HistoryEntry.to_dict() records (empty if none). History is append-only,
+        so what is stored stays true; callers only need to fetch what was added since."""
+    def get_set_history(self, SpecimenID:str, SetCode:str) -> list:
+        with self._Lock:
+            row = self.DB.execute("SELECT data FROM set_history WHERE specimen_id=? AND set_code=?", (str(SpecimenID), SetCode)).fetchone()
+        return LocalStore.loads(row[0]) if row else []
+
+    def put_set_history(self, SpecimenID:str, SetCode:str, History:list) -> None:
+        with self._Lock:
+            self.DB.execute("INSERT OR REPLACE INTO set_history VALUES (?, ?, ?, ?)", (str(SpecimenID), SetCode, time.time(), LocalStore.dumps(History)))
+            self.DB.commit()
+
+    """ Returns the stored text of a specimen notepad entry, or None. Entries are keyed by their authored time as well as their index,
+        so an entry that was replaced is not mistaken for the old one; a stored entry is never out of date."""
+    def get_notepad_text(self, SpecimenID:str, Index:str, Authored:str):
+        with self._Lock:
+            row = self.DB.execute("SELECT data FROM notepad_entries WHERE specimen_id=? AND entry_index=? AND authored=?",
+                                  (str(SpecimenID), str(Index), str(Authored))).fetchone()
+        return LocalStore.loads(row[0])["Text"] if row else None
+
+    def put_notepad_entries(self, SpecimenID:str, Entries:list) -> None:
+        with self._Lock:
+            self.DB.executemany("INSERT OR REPLACE INTO notepad_entries VALUES (?, ?, ?, ?, ?)",
+                                ((str(SpecimenID), str(x.Index), str(x.Authored), time.time(), LocalStore.dumps(x.to_dict())) for x in Entries))
+            self.DB.commit()
+
+
+_DefaultStore = None
+
+""" Returns the process-wide LocalStore, opening it on first use."""
+def get_store(filePath:str=DEFAULT_STORE_PATH) -> LocalStore:
+    global _DefaultStore
+    if _DefaultStore is None or _DefaultStore.FilePath != filePath:
+        _DefaultStore = LocalStore(filePath)
+    return _DefaultStore
@@ -0,0 +1,135 @@
+#GPL-3.0-or-later
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datastructs
+import datetime
+import logging
+import os
+import utils
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")                   # Non-interactive: plots go straight to file, and worker processes never need a display
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+
+plotLogger = logging.getLogger(__name__)
+
+COLOUR_LINE     = "#7d7d7d"
+COLOUR_IN_REF   = "#1f9c47"             # Green, inside reference range
+COLOUR_OUT_REF  = "#ba1a14"             # Red, outside reference range
+COLOUR_NO_REF   = "#000000"             # Black, no reference range known
+COLOUR_REF_SPAN = "#2ca02c"
+
+""" Plain, picklable data for one analyte's subplot: time-sorted points plus a precomputed in-range mask, so worker processes
+    need neither the Patient objects nor the reference tables."""
+class AnalyteSeries():
+    def __init__(self, Analyte:str, Units:str, Times:list, Values, Lower:float=None, Upper:float=None):
+        self.Analyte    = Analyte
+        self.Units      = Units
+        self.Times      = Times
+        self.Values     = np.asarray(Values, dtype=np.float64)
+        self.Lower      = Lower
+        self.Upper      = Upper
+        self.hasRange   = Lower is not None or Upper is not None
+        if self.hasRange:
+            CmpLower = Lower if Lower is not None else -np.inf
+            CmpUpper = Upper if Upper is not None else np.inf
+            self.InRange = (self.Values >= CmpLower) & (self.Values <= CmpUpper)
+        else:
+            self.InRange = np.ones(len(self.Values), dtype=bool)
+
+    def __repr__(self): return f"AnalyteSeries({self.Analyte}, {len(self.Values)} points, {int((~self.InRange).sum())} out of range)"
+
+
+""" Collects all numeric results of a patient, grouped by analyte in a single pass, and turns them into AnalyteSeries.
+    Results without a sample time fall back to the specimen's collection time; free-text values (eg '<5') are skipped."""
+def extract_patient_series(Patient, FilterAnalytes:list=None, firstDate:datetime.datetime=None, lastDate:datetime.datetime=None,
+                           nMinPoints:int=1) -> list:
+    FilterAnalytes = set(FilterAnalytes) if FilterAnalytes else None
+    Points = {}
+    Units = {}
+    for Specimen in Patient.Samples:
+        for Set in Specimen.Sets:
+            for Result in Set.Results:
+                if not isinstance(Result.Value, float): continue
+                if FilterAnalytes and Result.Analyte not in FilterAnalytes: continue
+                Taken = Result.SampleTaken if isinstance(Result.SampleTaken, datetime.datetime) else Specimen.Collected
+                if not isinstance(Taken, datetime.datetime): continue
+                if firstDate and Taken < firstDate: continue
+                if lastDate and Taken > lastDate: continue
+                Points.setdefault(Result.Analyte, []).append((Taken, Result.Value))
+                Units.setdefault(Result.Analyte, Result.Units)
+    Series = []
+    for Analyte in sorted(Points.keys()):
+        AnalytePoints = sorted(Points[Analyte], key=lambda x: x[0])
+        if len(AnalytePoints) < nMinPoints: continue
+        RefRange = datastructs.REFERENCE_DATA.get_reference_range(Analyte)
+        Series.append(AnalyteSeries(Analyte, Units[Analyte], [x[0] for x in AnalytePoints], [x[1] for x in AnalytePoints],
+                                    RefRange.LowerLimit if RefRange else None, RefRange.UpperLimit if RefRange else None))
+    return Series
+
+""" Draws one page (a grid of one subplot per analyte) and saves it to outPath; format follows the file extension.
+    Top-level so it can run in a worker process."""
+def render_series(Title:str, Series:list, outPath:str) -> str:
+    fig = Figure(figsize=(11.69, 8.27))     # A4, landscape
+    fig.suptitle(Title)
+    gridSize = utils.calc_grid(len(Series))
+    for FigCounter, S in enumerate(Series, start=1):
+        ax = fig.add_subplot(*gridSize, FigCounter)
+        ax.plot(S.Times, S.Values, c=COLOUR_LINE, zorder=1)
+        if S.hasRange:
+            ax.axhspan(ymin=S.Lower if S.Lower is not None else np.nanmin(S.Values), ymax=S.Upper if S.Upper is not None else np.nanmax(S.Values),
+                       facecolor=COLOUR_REF_SPAN, alpha=0.3)
+            Times = np.asarray(S.Times, dtype=object)
+            ax.scatter(x=Times[S.InRange], y=S.Values[S.InRange], s=10, c=COLOUR_IN_REF, zorder=10)
+            ax.scatter(x=Times[~S.InRange], y=S.Values[~S.InRange], s=15, c=COLOUR_OUT_REF, zorder=10)
+        else:
+            ax.scatter(x=S.Times, y=S.Values, s=10, c=COLOUR_NO_REF, zorder=10)
+        ax.set_title(S.Analyte, fontsize=8)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%b-%d"))
+        ax.set_ylabel(f"{S.Analyte} ({S.Units})", fontsize=8)
+        ax.tick_params(labelsize=6)
+    fig.tight_layout()
+    fig.savefig(outPath)
+    return outPath
+
+def _plot_filename(Patient, outDir:str, Format:str) -> str:
+    return os.path.join(outDir, f"{utils.timestamp(fileFormat=True)}_{Patient.ID}_Results.{Format}")
+
+""" Plots a single patient in this process. Returns the file written, or None if the patient had nothing to plot."""
+def plot_patient(Patient, outFile:str=None, Format:str="png", FilterAnalytes:list=None, firstDate:datetime.datetime=None,
+                 lastDate:datetime.datetime=None, nMinPoints:int=1) -> str:
+    Series = extract_patient_series(Patient, FilterAnalytes, firstDate, lastDate, nMinPoints)
+    if not Series:
+        plotLogger.info(f"plot_patient(): No numeric results to plot for patient {Patient.ID}.")
+        return None
+    return render_series(f"Patient {Patient.ID}", Series, outFile if outFile else _plot_filename(Patient, ".", Format))
+
+""" Renders one page per patient into outDir, using a pool of nWorkers processes (default: one per CPU).
+    Series are extracted in this process, so only plain data is sent to the workers. Returns a dict of Patient ID: file written."""
+def plot_patients(Patients:list, outDir:str="./Plots", Format:str="png", FilterAnalytes:list=None, firstDate:datetime.datetime=None,
+                  lastDate:datetime.datetime=None, nMinPoints:int=1, nWorkers:int=None) -> dict:
+    if Format not in ("png", "pdf"):
+        raise ValueError(f"plot_patients(): Format must be 'png' or 'pdf', not '{Format}'.")
+    os.makedirs(outDir, exist_ok=True)
+    Jobs = []
+    for Patient in Patients:
+        Series = extract_patient_series(Patient, FilterAnalytes, firstDate, lastDate, nMinPoints)
+        if Series:
+            Jobs.append((Patient.ID, f"Patient {Patient.ID}", Series, _plot_filename(Patient, outDir, Format)))
+    plotLogger.info(f"plot_patients(): Rendering {len(Jobs)} of {len(Patients)} patients with results to {outDir}...")
+    Written = {}
+    if nWorkers == 1 or len(Jobs) <= 1:
+        for PatientID, Title, Series, outPath in Jobs:
+            Written[PatientID] = render_series(Title, Series, outPath)
+        return Written
+    with ProcessPoolExecutor(max_workers=nWorkers) as Pool:
+        Futures = {Pool.submit(render_series, Title, Series, outPath): PatientID for PatientID, Title, Series, outPath in Jobs}
+        for Future in as_completed(Futures):
+            try:
+                Written[Futures[Future]] = Future.result()
+            except Exception as e:
+                plotLogger.error(f"plot_patients(): Could not render plot for patient {Futures[Future]}: {e}")
+    plotLogger.info(f"plot_patients(): Complete, {len(Written)} plots written.")
+    return Written
@@ -6,6 +6,7 @@ import logging
 import re
 import struct
 import telnetlib
+import threading
 import time
 
 telnetLogger = logging.getLogger(__name__)
@@ -533,3 +534,31 @@ class Connection():
                 return None
             return _chunk[0].text
         return None
+
+
+class ThreadBoundConnection():
+    """ Stands in for a Connection, forwarding everything to the Connection bound to the calling thread, or to Default if none is.
+        Worker threads bind() their own logged-in Connection, and all code using the shared module-level name then drives that session. """
+    def __init__(self, Default:Connection):
+        object.__setattr__(self, "_Default", Default)
+        object.__setattr__(self, "_Local", threading.local())
+
+    @property
+    def current(self) -> Connection:
+        return getattr(self._Local, "Connection", None) or self._Default
+
+    def bind(self, Conn:Connection) -> None:
+        self._Local.Connection = Conn
+
+    def unbind(self) -> None:
+        self._Local.Connection = None
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.current, name, value)
+
+    def __str__(self):  return str(self.current)
+
+    def __repr__(self): return f"ThreadBoundConnection({self.current!r})"
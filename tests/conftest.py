@@ -0,0 +1,34 @@
+#GPL-3.0-or-later
+
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py is written per site (see example_config.py) and is not part of the repository; the modules under test only need it to import.
+try:
+    import config
+except ImportError:
+    from tp_localisation import TelePath_Commands
+    config = types.ModuleType("config")
+    config.LOCALISATION = TelePath_Commands(LIMS_IP="127.0.0.1", LIMS_PORT=23, LIMS_USER="TEST", LIMS_PW="TEST", IBM_USER="test", 
+                                            ANSWERBACK=b"", NPEX_USER="TEST", NPEX_PW="TEST", AUTHORISATION="AUTH", PATIENTENQUIRY="ENQ_P", 
+                                            SPECIMENENQUIRY="ENQ_S", UPDATE_SET_RESULT="U", PRIVILEGES="PWRS", SETMAINTENANCE="MAINT", 
+                                            NPCLSETS="NPC", SNPCL="SNPC", AUTOCOMMENTS="AUTOC", OUTSTANDING_WORK="W_OUT", 
+                                            OVERDUE_SAMPLES="W_OVR", OVERDUE_AUTOMATION="AUTOM", OVERDUE_SENDAWAYS="AWAY", 
+                                            CANCEL_REQUESTS="CANCEL", TRAININGSYSTEM="TRAIN", SETHISTORY="H", CANCEL_ACTION="^", NA="NA", 
+                                            RELEASE="R", EMPTYSTR="", QUIT="Q", identify_screen=lambda self: None, 
+                                            check_sample_id=lambda SampleID: True)
+    sys.modules["config"] = config
+
+import localstore
+
+
+@pytest.fixture
+def Store(tmp_path):
+    _Store = localstore.LocalStore(str(tmp_path / "cache.sqlite"))
+    yield _Store
+    _Store.close()
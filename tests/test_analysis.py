@@ -0,0 +1,34 @@
+#GPL-3.0-or-later
+
+import datetime
+
+import numpy as np
+
+import analysis
+import datastructs
+
+
+def make_table(*Rows) -> analysis.ResultTable:
+    return analysis.ResultTable(*[list(x) for x in zip(*Rows)])
+
+Day = datetime.datetime(2023, 2, 1, 9, 0)
+RANGES = [datastructs.ReferenceRange("Potassium", "5.3", "3.5", "mmol/L")]
+
+
+def test_reference_range_flags():
+    Table = make_table(("P1", "S1", "Potassium", "mmol/L", 3.0, Day), ("P2", "S2", "Potassium", "mmol/L", 6.0, Day),
+                       ("P3", "S3", "Potassium", "mmol/L", 4.0, Day), ("P4", "S4", "Sodium", "mmol/L", 200.0, Day))
+    Report = analysis.flag_results(Table, RefRanges=RANGES)
+    Flagged = dict(zip(Report.Table.SampleIDs, zip(Report.Low, Report.High)))
+    assert Flagged == {"S1": (True, False), "S2": (False, True), "S3": (False, False), "S4": (False, False)}
+
+def test_delta_compares_previous_result_of_same_patient_and_analyte():
+    Rules = [analysis.DeltaRule("Potassium", MaxAbsChange=1.0, Window=datetime.timedelta(days=2))]
+    Table = make_table(("P1", "S3", "Potassium", "mmol/L", 5.2, Day + datetime.timedelta(days=1)),
+                       ("P1", "S1", "Potassium", "mmol/L", 4.0, Day),
+                       ("P2", "S2", "Potassium", "mmol/L", 5.2, Day + datetime.timedelta(hours=1)),
+                       ("P1", "S4", "Potassium", "mmol/L", 3.9, Day + datetime.timedelta(days=5)))
+    Report = analysis.flag_results(Table, RefRanges=[], DeltaRules=Rules)
+    Flags = dict(zip(Report.Table.SampleIDs, Report.DeltaFlag))
+    assert Flags == {"S1": False, "S2": False, "S3": True, "S4": False}     # S4 is outside the window, S2 is another patient
+    assert np.isnan(Report.PrevValues[list(Report.Table.SampleIDs).index("S2")])
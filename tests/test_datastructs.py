@@ -0,0 +1,53 @@
+#GPL-3.0-or-later
+
+import gc
+import threading
+
+import datastructs
+
+
+def make_specimen(SpecimenID:str, **Fields) -> datastructs.Specimen:
+    Sample = datastructs.Specimen(SpecimenID, Override=True)
+    for field, value in Fields.items():
+        setattr(Sample, field, value)
+    return Sample
+
+
+def test_intern_keeps_first_object_canonical():
+    Storage = datastructs.IdentityMap(datastructs.Specimen)
+    First = make_specimen("A,23.0000001.B", PatientID="A123456")
+    Second = make_specimen("A,23.0000001.B", LName="SMITH")
+    assert Storage.intern(First) is First
+    assert Storage.intern(Second) is First
+    assert (First.PatientID, First.LName) == ("A123456", "SMITH")
+
+def test_least_recently_used_are_held_weakly():
+    Storage = datastructs.IdentityMap(datastructs.Specimen, MaxItems=2)
+    Kept = Storage.intern(make_specimen("A,23.0000001.B"))
+    for n in range(2, 5):
+        Storage.intern(make_specimen(f"A,23.000000{n}.B"))
+    gc.collect()
+    assert Storage.Evictions == 2
+    assert Storage.get("A,23.0000001.B") is Kept     # Still referenced here
+    assert Storage.get("A,23.0000002.B") is None     # Evicted and freed
+
+def test_patient_constructor_keeps_existing_patient():
+    Storage = datastructs.Patient.Storage
+    Existing = datastructs.Patient("P0000001")
+    Existing.LName = "SMITH"
+    datastructs.Patient("P0000001")
+    assert Storage.get("P0000001") is Existing
+    Storage.remove("P0000001")
+
+def test_concurrent_intern_yields_one_canonical_object():
+    Storage = datastructs.IdentityMap(datastructs.Specimen, MaxItems=50)
+    Results = []
+    def worker():
+        for n in range(200):
+            Results.append(Storage.intern(make_specimen(f"A,23.{n:07}.B")))
+    Workers = [threading.Thread(target=worker) for _ in range(4)]
+    for Worker in Workers: Worker.start()
+    for Worker in Workers: Worker.join()
+    Canonical = {}
+    for Sample in Results:
+        assert Canonical.setdefault(Sample.ID, Sample) is Sample
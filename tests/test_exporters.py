@@ -0,0 +1,67 @@
+#GPL-3.0-or-later
+
+import csv
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+import datastructs
+import exporters
+
+
+def make_specimen(SpecimenID:str) -> datastructs.Specimen:
+    Sample = datastructs.Specimen(SpecimenID, Override=True)
+    Sample.PatientID = "123456"
+    Sample.Sets.append(datastructs.TestSet(SpecimenID, "1", "NA", Status="R", Override=True,
+                                           Results=[datastructs.SetResult("Sodium", "140", "mmol/L"), datastructs.SetResult("Potassium", "6.1", "mmol/L", Flags="H")]))
+    Sample.Sets.append(datastructs.TestSet(SpecimenID, "2", "VITD", Status="U", Override=True))
+    return Sample
+
+
+def test_tsv_rows_and_set_filter(tmp_path):
+    with exporters.get_exporter("tsv", filePath=str(tmp_path / "out.txt"), FilterSets=["NA"]) as Exporter:
+        Exporter.write_specimen(make_specimen("A,23.0000001.B"))
+    with open(Exporter.FilePath) as IO:
+        Rows = [x.rstrip("\n").split("\t") for x in IO]
+    assert Rows[0] == exporters.SpecimenExporter.HEADERS
+    assert len(Rows) == 3 and {x[5] for x in Rows[1:]} == {"NA"}
+    assert Rows[1][0] == "00123456" and Rows[2][7:11] == ["Potassium", "6.1", "mmol/L", "[H]"]
+
+def test_append_does_not_repeat_header(tmp_path):
+    Path = str(tmp_path / "out.csv")
+    with exporters.get_exporter("csv", filePath=Path) as Exporter:
+        Exporter.write_specimen(make_specimen("A,23.0000001.B"))
+    with exporters.get_exporter("csv", filePath=Path, append=True) as Exporter:
+        Exporter.write_specimen(make_specimen("A,23.0000002.B"))
+    with open(Path, newline='') as IO:
+        Rows = list(csv.reader(IO))
+    assert [x for x in Rows if x == exporters.SpecimenExporter.HEADERS] == [Rows[0]]
+    assert len(Rows) == 1 + 3 + 3
+
+def test_compressed_jsonl(tmp_path):
+    with exporters.get_exporter("jsonl", filePath=str(tmp_path / "out.jsonl"), compress=True) as Exporter:
+        Exporter.write_specimens([make_specimen("A,23.0000001.B"), make_specimen("A,23.0000002.B")])
+    assert Exporter.FilePath.endswith(".jsonl.gz") and Exporter.nWritten == 2
+    assert not Exporter.Resumable and not exporters.is_resumable("jsonl", compress=True)
+    with gzip.open(Exporter.FilePath, 'rt') as IO:
+        Data = [json.loads(x) for x in IO]
+    assert [x["ID"] for x in Data] == ["A,23.0000001.B", "A,23.0000002.B"]
+    assert [x["Code"] for x in Data[0]["Sets"]] == ["NA", "VITD"]
+
+def test_sqlite_commits_on_flush(tmp_path):
+    Path = str(tmp_path / "out.sqlite")
+    Exporter = exporters.SQLiteExporter(filePath=Path, flushEvery=1)
+    Exporter.write_specimen(make_specimen("A,23.0000001.B"))
+    with sqlite3.connect(Path) as DB:
+        assert DB.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 3
+    Exporter.close()
+    assert not Exporter.isOpen
+
+def test_unknown_format_and_resumability():
+    with pytest.raises(ValueError):
+        exporters.get_exporter_type("xlsx")
+    assert exporters.get_exporter_type("tsv").Resumable and not exporters.get_exporter_type("parquet").Resumable
+    with pytest.raises(ValueError):
+        exporters.SQLiteExporter(fileName="x", compress=True)
@@ -0,0 +1,42 @@
+#GPL-3.0-or-later
+
+import datetime
+
+import ProfX
+
+
+def entry(Minute:int, Event:str="Printed by:", User:str="AB") -> ProfX.tp_HistoryEntry:
+    return ProfX.tp_HistoryEntry("A,23.0000001.B", "AOT", datetime.datetime(2023, 5, 1, 9, Minute), Event, User)
+
+def page(*Lines) -> str:
+    return "\r\n".join(["History"] + list(Lines))
+
+
+def test_parse_history_page_joins_multiline_events():
+    Screen = page("01-May-23 09:00 Set requested by: AB",
+                  "01-May-23 09:05 Results entered/edited by: CD",
+                  "NA",
+                  "01-May-23 09:06 Printed by: EF")
+    Entries = ProfX.parse_history_page(Screen, "A,23.0000001.B", "AOT")
+    assert [(x.Event, x.User) for x in Entries] == [("Set requested by:", "AB"), ("Results entered/edited by:NA", "CD"), ("Printed by:", "EF")]
+    assert Entries[0].DateTime == datetime.datetime(2023, 5, 1, 9, 0)
+
+def test_merge_keeps_repeats_within_one_fetch():
+    Fetched = [entry(1), entry(1)]
+    assert ProfX.merge_history([], Fetched) == Fetched
+
+def test_merge_drops_only_entries_already_known():
+    Known = [entry(1), entry(0, ProfX.AOT_CREATOR_EVENT)]                   # Newest first, as the screen listed them
+    Fetched = [entry(3), entry(2), entry(1)]
+    Merged = ProfX.merge_history(Known, Fetched)
+    assert [x.DateTime.minute for x in Merged] == [3, 2, 1, 0]
+
+def test_merge_keeps_oldest_first_screen_order():
+    Known = [entry(0), entry(1)]
+    Fetched = [entry(1), entry(2), entry(2)]
+    Merged = ProfX.merge_history(Known, Fetched)
+    assert [x.DateTime.minute for x in Merged] == [0, 1, 2, 2]
+
+def test_history_round_trips_through_dict():
+    Entry = entry(5)
+    assert ProfX.tp_HistoryEntry.from_dict(Entry.to_dict()).Key == Entry.Key
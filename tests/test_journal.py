@@ -0,0 +1,62 @@
+#GPL-3.0-or-later
+
+import os
+
+import datastructs
+import journal
+
+
+def make_specimen(SpecimenID:str) -> datastructs.Specimen:
+    Sample = datastructs.Specimen(SpecimenID, Override=True)
+    Sample.PatientID = "A123456"
+    return Sample
+
+
+def test_resume_restores_specimens_and_items(tmp_path):
+    Journal = journal.DownloadJournal("job", journalDir=str(tmp_path))
+    Journal.start(Inputs=["A,23.0000001.B", "A,23.0000002.B"], Output="out.txt")
+    Journal.record_specimen(make_specimen("A,23.0000001.B"))
+    Journal.mark_done("item1", "Done")
+    Journal.record_failure("item2", "Locked")
+    Journal.close()
+
+    Resumed = journal.DownloadJournal("job", resume=True, journalDir=str(tmp_path))
+    assert Resumed.isResumed
+    assert Resumed.Inputs == ["A,23.0000001.B", "A,23.0000002.B"] and Resumed.Output == "out.txt"
+    assert Resumed.has_specimen("A,23.0000001.B") and not Resumed.has_specimen("A,23.0000002.B")
+    assert Resumed.is_done("item1") and not Resumed.is_done("item2")
+    assert Resumed.Outcomes == {"item1": "Done", "item2": "Locked"}
+    Sample = datastructs.Specimen("A,23.0000001.B", Override=True)
+    assert Resumed.restore_specimen(Sample) and Sample.PatientID == "A123456"
+    Resumed.close()
+
+def test_resume_drops_incomplete_last_line(tmp_path):
+    Journal = journal.DownloadJournal("job", journalDir=str(tmp_path))
+    Journal.start(Inputs=[])
+    Journal.mark_done("item1")
+    Journal.close()
+    with open(Journal.FilePath, 'a') as IO:
+        IO.write('{"Item": "ite')
+    Resumed = journal.DownloadJournal("job", resume=True, journalDir=str(tmp_path))
+    Resumed.mark_done("item2")
+    Resumed.close()
+    assert journal.DownloadJournal("job", resume=True, journalDir=str(tmp_path)).Items == {"item1", "item2"}
+
+def test_fresh_start_keeps_interrupted_journal(tmp_path):
+    Journal = journal.DownloadJournal("job", journalDir=str(tmp_path))
+    Journal.start(Inputs=["A,23.0000001.B"])
+    Journal.mark_done("item1")
+    Journal.close()
+    Fresh = journal.DownloadJournal("job", journalDir=str(tmp_path))
+    assert not Fresh.isResumed and not Fresh.Items
+    Fresh.close()
+    Kept = [x for x in os.listdir(tmp_path) if x != os.path.basename(Fresh.FilePath)]
+    assert len(Kept) == 1
+    with open(tmp_path / Kept[0]) as IO:
+        assert '"item1"' in IO.read()
+
+def test_finish_removes_journal(tmp_path):
+    Journal = journal.DownloadJournal("job", journalDir=str(tmp_path))
+    Journal.start()
+    Journal.finish()
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,88 @@
+#GPL-3.0-or-later
+
+import datetime
+import time
+
+import datastructs
+
+
+def make_specimen(SpecimenID:str, *Statuses) -> datastructs.Specimen:
+    Sample = datastructs.Specimen(SpecimenID, Override=True)
+    Sample.PatientID = "A123456"
+    for n, Status in enumerate(Statuses):
+        Sample.Sets.append(datastructs.TestSet(SpecimenID, str(n + 1), f"SET{n}", Status=Status, Override=True))
+    return Sample
+
+def age(Store, table:str, seconds:float) -> None:
+    Store.DB.execute(f"UPDATE {table} SET fetched = fetched - ?", (seconds, ))
+    Store.DB.commit()
+
+
+def test_specimen_round_trip(Store):
+    Store.put_specimen(make_specimen("A,23.0000001.B", "R", "U"))
+    Sample = datastructs.Specimen("A,23.0000001.B", Override=True)
+    assert Store.restore_specimen(Sample)
+    assert Sample.PatientID == "A123456"
+    assert [(x.Code, x.Status) for x in Sample.Sets] == [("SET0", "R"), ("SET1", "U")]
+
+def test_unreleased_set_expires(Store):
+    Store.put_specimen(make_specimen("A,23.0000001.B", "U"))
+    assert Store.get_set("A,23.0000001.B", "SET0") is not None
+    age(Store, "sets", Store.UnreleasedTTL + 1)
+    assert Store.get_set("A,23.0000001.B", "SET0") is None
+
+def test_released_set_never_expires(Store):
+    Store.put_specimen(make_specimen("A,23.0000001.B", "R"))
+    age(Store, "sets", 365 * 86400)
+    assert Store.get_set("A,23.0000001.B", "SET0") is not None
+
+def test_specimen_record_expires_even_if_all_sets_released(Store):
+    Store.put_specimen(make_specimen("A,23.0000001.B", "R", "R"))
+    age(Store, "specimens", Store.UnreleasedTTL + 1)
+    assert Store.get_specimen("A,23.0000001.B") is None
+    assert not Store.restore_specimen(datastructs.Specimen("A,23.0000001.B", Override=True))
+
+def test_get_set_status_and_comments(Store):
+    Store.put_specimen(make_specimen("A,23.0000001.B", "U"))
+    assert Store.get_set("A,23.0000001.B", "SET0", Status="R") is None
+    assert Store.get_set("A,23.0000001.B", "SET0", needComments=True) is None
+
+def test_notepad_and_further_requirements(Store):
+    Store.put_specimen(make_specimen("A,23.0000001.B", "R"), hasNotepad=True)
+    assert Store.get_specimen("A,23.0000001.B", needNotepad=True) is not None
+    assert Store.get_specimen("A,23.0000001.B", needFurther=True) is None
+
+def test_past_run_counts_are_immutable(Store):
+    Yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    Store.put_run_count("ALB", Yesterday, 2)
+    Store.put_run_count("ALB", datetime.date.today(), 1)
+    age(Store, "worksheet_runs", Store.UnreleasedTTL + 1)
+    assert Store.get_run_count("ALB", Yesterday) == 2
+    assert Store.get_run_count("ALB", datetime.date.today()) is None
+
+def test_specimen_patient_expires(Store):
+    Store.put_specimen_patient(make_specimen("A,23.0000001.B"))
+    assert Store.get_specimen_patient("A,23.0000001.B")["PatientID"] == "A123456"
+    age(Store, "specimen_patients", Store.UnreleasedTTL + 1)
+    assert Store.get_specimen_patient("A,23.0000001.B") is None
+
+def test_fingerprint_match_expires_unless_released(Store):
+    Sample = make_specimen("A,23.0000001.B", "R", "U")
+    Store.put_specimen(Sample)
+    age(Store, "sets", Store.UnreleasedTTL + 1)
+    Released, Unreleased = Sample.Sets
+    assert Store.get_set_by_fingerprint(Released.Fingerprint) is not None
+    assert Store.get_set_by_fingerprint(Unreleased.Fingerprint) is None
+
+def test_fingerprint_must_match(Store):
+    Sample = make_specimen("A,23.0000001.B", "U")
+    Store.put_specimen(Sample)
+    SpecimenID, SetCode, SetIndex, _ = Sample.Sets[0].Fingerprint
+    assert Store.get_set_by_fingerprint((SpecimenID, SetCode, SetIndex, "R")) is None
+    assert Store.get_set_by_fingerprint((SpecimenID, SetCode, SetIndex, "U")) is not None
+
+def test_NHS_number_expires(Store):
+    Store.put_NHS_number("A123456", "9434765919")
+    assert Store.get_NHS_number("A123456") == "9434765919"
+    age(Store, "patients", Store.UnreleasedTTL + 1)
+    assert Store.get_NHS_number("A123456") is None
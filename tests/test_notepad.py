@@ -0,0 +1,22 @@
+#GPL-3.0-or-later
+
+import ProfX
+from telnet_ANSI import ParsedANSICommand
+
+
+def test_two_entries_per_line_sorted_by_index():
+    Chunks = [ParsedANSICommand(8, 1, "1) JSMITH   A,23.0000001.B 09:15 01.02.23   2) AJONES   A,23.0000001.B 10:20 01.02.23"),
+              ParsedANSICommand(9, 1, "3) JSMITH   A,23.0000001.B 11:00 02.02.23")]
+    Entries = ProfX.parse_notepad_index(list(reversed(Chunks)))
+    assert [x.Index for x in Entries] == ["1", "2", "3"]
+    assert [x.Author for x in Entries] == ["JSMITH", "AJONES", "JSMITH"]
+    assert Entries[1].Authored == "10:20 01.02.23" and Entries[1].SampleID == "A,23.0000001.B"
+
+def test_ignores_header_footer_and_deletes():
+    Chunks = [ParsedANSICommand(3, 1, "1) HEADER   A,23.0000001.B 09:15 01.02.23"),
+              ParsedANSICommand(22, 1, "2) FOOTER   A,23.0000001.B 09:15 01.02.23"),
+              ParsedANSICommand(10, 1, "", deleteMode=1),
+              ParsedANSICommand(10, 1, "4) JSMITH   A,23.0000001.B 09:15 01.02.23")]
+    Entries = ProfX.parse_notepad_index(Chunks)
+    assert [x.Index for x in Entries] == ["4"]
+    assert ProfX.parse_notepad_index([]) == []
@@ -0,0 +1,43 @@
+#GPL-3.0-or-later
+
+import ProfX
+
+
+def overdue(SpecimenID:str, *SetCodes) -> ProfX.tp_Specimen:
+    Sample = ProfX.tp_Specimen(SpecimenID)
+    for n, SetCode in enumerate(SetCodes):
+        Sample.Sets.append(ProfX.tp_TestSet(Sample=Sample.ID, SetIndex=str(n + 1), SetCode=SetCode, Status="U"))
+    return Sample
+
+
+def test_first_run_finds_everything_new(Store):
+    Diff = ProfX.diff_overdue_sets("AWAY", [overdue("23.0000001", "VITD")], Store=Store)
+    assert [x.ID for x in Diff.New] == [ProfX.tp_Specimen("23.0000001").ID]
+    assert not Diff.Still and not Diff.Resolved
+
+def test_second_run_finds_still_new_and_resolved(Store):
+    A, B, C = (ProfX.tp_Specimen(f"23.000000{n}").ID for n in (1, 2, 3))
+    ProfX.diff_overdue_sets("AWAY", [overdue(A, "VITD"), overdue(B, "ACTH")], Store=Store)
+    FirstSeen = Store.get_overdue_snapshot("AWAY")[B]["FirstSeen"]
+    Second = ProfX.diff_overdue_sets("AWAY", [overdue(B, "ACTH"), overdue(C, "VITD")], Store=Store)
+    assert [x.ID for x in Second.New] == [C]
+    assert [x.ID for x in Second.Still] == [B]
+    assert Second.Resolved == [A]
+    assert Second.Since[B] == FirstSeen
+
+def test_rows_of_one_specimen_are_merged(Store):
+    Diff = ProfX.diff_overdue_sets("AWAY", [overdue("23.0000001", "VITD"), overdue("23.0000001", "ACTH")], Store=Store)
+    assert len(Diff.New) == 1 and Diff.New[0].Sets.Codes == ["VITD", "ACTH"]
+    assert list(Store.get_overdue_snapshot("AWAY").values())[0]["SetCodes"] == ["VITD", "ACTH"]
+
+def test_without_save_the_snapshot_is_unchanged(Store):
+    ProfX.diff_overdue_sets("AWAY", [overdue("23.0000001", "VITD")], save=False, Store=Store)
+    assert Store.get_overdue_snapshot("AWAY") == {}
+
+def test_details_survive_while_listed(Store):
+    Sample = overdue("23.0000001", "VITD")
+    ProfX.diff_overdue_sets("AWAY", [Sample], Store=Store)
+    Sample.PatientID = "A123456"
+    Store.put_overdue_details("AWAY", Sample)
+    Diff = ProfX.diff_overdue_sets("AWAY", [overdue("23.0000001", "VITD")], Store=Store)
+    assert Diff.cached_details(Sample.ID)["PatientID"] == "A123456"
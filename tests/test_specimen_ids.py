@@ -0,0 +1,27 @@
+#GPL-3.0-or-later
+
+import ProfX
+
+
+def test_parse_many_collects_rejected_lines():
+    Rejected = []
+    IDs = ProfX.tp_SpecimenID.parse_many(["A,23.0000001.B", "", "not an id", " 23.0000002 "], Rejected=Rejected)
+    assert [x._raw for x in IDs] == ["A,23.0000001.B", "23.0000002"]
+    assert Rejected == ["NOT AN ID"]
+
+def test_validate_specimen_IDs_sorts_valid_invalid_and_duplicates():
+    Good = str(ProfX.tp_SpecimenID("23.0000001"))           # Check character computed
+    Wrong = Good[:-1] + ("A" if Good[-1] != "A" else "B")
+    Valid, Invalid, Duplicates = ProfX.validate_specimen_IDs([Good + "\n", "junk\n", Wrong + "\n", "23.0000001\n"])
+    assert [str(x) for x in Valid] == [Good]
+    assert Invalid[0] == ("JUNK", "Unrecognised format")
+    assert Invalid[1] == (Wrong, f"Check character should be {Good[-1]}")
+    assert Duplicates == ["23.0000001"]
+
+def test_validate_specimen_IDs_without_autocorrect():
+    Valid, Invalid, _ = ProfX.validate_specimen_IDs(["23.0000001"], autoCorrect=False)
+    assert not Valid and Invalid == [("23.0000001", "Missing check character")]
+
+def test_validate_many_matches_validate():
+    IDs = [ProfX.tp_SpecimenID(f"23.{n:07}") for n in range(1, 50)]
+    assert ProfX.tp_SpecimenID.validate_many(IDs) == [x.validate() for x in IDs] == [True] * 49
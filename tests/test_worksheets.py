@@ -0,0 +1,59 @@
+#GPL-3.0-or-later
+
+import datetime
+
+import worksheets
+
+RUN_DATE = datetime.date(2023, 5, 1)
+HEADER = "Cup Specimen       Type Name"
+
+def aux(*Pages) -> str:
+    return worksheets.PAGE_BREAK.join("\r\n".join(["ANALYSER 1", "ALB run 1 01.05.23", HEADER] + list(x)) for x in Pages)
+
+
+def test_parse_skips_repeated_page_headers():
+    Sheet = worksheets.parse_worksheet(aux(["1   A,23.0000001.B SER  SMITH"], ["2   A,23.0000002.D PLA  JONES", worksheets.END_OF_LIST]),
+                                       "ALB", RUN_DATE, 1)
+    assert (Sheet.System, Sheet.RunHeader, Sheet.Headers) == ("ANALYSER 1", "ALB run 1 01.05.23", [HEADER])
+    assert [(x.Cup, x.SpecimenID, x.SampleType) for x in Sheet.Rows] == [("1", "A,23.0000001.B", "SER"), ("2", "A,23.0000002.D", "PLA")]
+    assert Sheet.SpecimenIDs == ["A,23.0000001.B", "A,23.0000002.D"]
+
+def test_parse_stops_at_end_of_list():
+    Sheet = worksheets.parse_worksheet(aux(["1   A,23.0000001.B SER  SMITH", worksheets.END_OF_LIST, "2   A,23.0000002.D PLA  JONES"]),
+                                       "ALB", RUN_DATE, 1)
+    assert len(Sheet) == 1
+
+def test_parse_joins_two_line_entries():
+    Text = "\r\n".join(["ANALYSER 1", "ALB run 1 01.05.23", "Specimen       Type", "Cup Name", 
+                        "A,23.0000001.B SER", "1   SMITH", worksheets.END_OF_LIST])
+    Sheet = worksheets.parse_worksheet(Text, "ALB", RUN_DATE, 1)
+    assert Sheet.Headers == ["Specimen       Type", "Cup Name"]
+    assert [(x.Cup, x.SpecimenID, x.SampleType) for x in Sheet.Rows] == [("1", "A,23.0000001.B", "SER")]
+
+def test_ID_wider_than_its_column_does_not_spill_into_type():
+    Header = "Cup Specimen    Type Name"
+    Row = worksheets.WorksheetRow.from_parts(["1   A,23.1234567.B SER  SMITH"], [Header], [worksheets.utils.extract_column_widths(Header)])
+    assert (Row.SpecimenID, Row.SampleType) == ("A,23.1234567.B", "SER")
+
+def test_spilled_ID_leaves_type_unknown_if_not_next_column():
+    Header = "Cup Specimen    Name  Type"
+    Row = worksheets.WorksheetRow.from_parts(["1   A,23.1234567.B SMITH SER"], [Header], [worksheets.utils.extract_column_widths(Header)])
+    assert (Row.SpecimenID, Row.SampleType) == ("A,23.1234567.B", None)
+
+def test_to_lines_prefixes_run_date_and_number():
+    Sheet = worksheets.parse_worksheet(aux(["1   A,23.0000001.B SER  SMITH", worksheets.END_OF_LIST]), "ALB", RUN_DATE, 1)
+    assert Sheet.to_lines() == [f"Run date Run {HEADER}\n", "01.05.23 01  1   A,23.0000001.B SER  SMITH\n"]
+
+def test_archive_round_trip_and_lookups(tmp_path):
+    Archive = worksheets.WorksheetArchive(str(tmp_path / "archive.sqlite"))
+    Sheet = worksheets.parse_worksheet(aux(["1   A,23.0000001.B SER  SMITH", worksheets.END_OF_LIST]), "ALB", RUN_DATE, 1)
+    assert Archive.add(Sheet)
+    assert not Archive.add(Sheet)                   # Stored once, never rewritten
+    Today = worksheets.parse_worksheet(aux([worksheets.END_OF_LIST]), "ALB", datetime.date.today(), 1)
+    assert not Archive.add(Today)                   # Could still change
+    Loaded = Archive.get("ALB", RUN_DATE, 1)
+    assert Loaded.to_lines() == Sheet.to_lines()
+    assert [x.RunDate for x in Archive.find_specimen("A,23.0000001.B")] == [RUN_DATE]
+    assert len(Archive.find_runs("ALB", firstDate=RUN_DATE, lastDate=RUN_DATE)) == 1
+    assert Archive.find_runs("ALB", firstDate=RUN_DATE + datetime.timedelta(days=1)) == []
+    Archive.close()
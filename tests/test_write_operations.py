@@ -0,0 +1,115 @@
+#GPL-3.0-or-later
+
+import pytest
+
+import config
+import ProfX
+
+
+""" Stands in for a TelePath session on the request cancellation screen. Typing a specimen ID at the specimen prompt opens it and
+    lists its sets; typing a set's number cancels it, and the next empty line returns to the specimen prompt. Anything else typed
+    into an open record is an error, and recorded in Misfed."""
+class FakeCancelScreen():
+    def __init__(self, Specimens:dict, Locked:set=None):
+        self.Specimens  = {x: list(Sets) for x, Sets in Specimens.items()}
+        self.Locked     = Locked or set()
+        self.State      = "Prompt"
+        self.Current    = None
+        self.Lines      = []
+        self.Errors     = []
+        self.Misfed     = []
+        self.ScreenType = "MainMenu"
+
+    @property
+    def hasErrors(self) -> bool: return bool(self.Errors)
+
+    def read_data(self): pass
+
+    def _show_sets(self):
+        Rows = [f"{n + 1}) {Code}" for n, Code in enumerate(self.Specimens[self.Current])]
+        self.Lines = ["Cancel requests", "", "Specimen " + self.Current, ""] + Rows + ["Select set"]
+
+    def send(self, text:str, quiet:bool=False, maxwait_ms:int=None, readEcho:bool=True):
+        self.Errors = []
+        if text == config.LOCALISATION.CANCEL_REQUESTS:
+            self.State = "Prompt"
+        elif self.State == "Prompt":
+            if text in self.Locked:
+                self.Errors = [f'"{ProfX.WRITE_LOCKED_MSG}" title "Cancel requests" error']
+            elif text in self.Specimens:
+                self.State, self.Current = "Open", text
+                self._show_sets()
+            elif text != config.LOCALISATION.EMPTYSTR:
+                self.Errors = ['"Specimen not found" title "Cancel requests" error']
+        elif self.State == "Open":
+            if text == config.LOCALISATION.EMPTYSTR:
+                self.State = "Prompt"
+            elif text.isdigit() and 0 < int(text) <= len(self.Specimens[self.Current]):
+                del self.Specimens[self.Current][int(text) - 1]
+                self.State = "Cancelled"
+            else:
+                self.Misfed.append(text)
+                self.Errors = ['"Invalid selection" title "Cancel requests" error']
+        elif self.State == "Cancelled" and text == config.LOCALISATION.EMPTYSTR:
+            self.State = "Prompt"
+
+
+@pytest.fixture
+def SpecimenID():
+    return ProfX.tp_Specimen("23.0000001").ID
+
+def run(monkeypatch, Screen:FakeCancelScreen, SpecimenID:str, SetCodes:list, dryRun:bool=False) -> list:
+    monkeypatch.setattr(ProfX, "TelePath", Screen)
+    Ops = [ProfX.WriteOperation(SpecimenID, x, "CANCEL") for x in SetCodes]
+    ProfX._write_specimen(SpecimenID, Ops, dryRun)
+    return Ops
+
+
+def test_sets_on_screen_lists_every_request(monkeypatch, SpecimenID):
+    Screen = FakeCancelScreen({SpecimenID: ["VITD", "ACTH", "VITD"]})
+    monkeypatch.setattr(ProfX, "TelePath", Screen)
+    Screen.send(SpecimenID)
+    assert ProfX._sets_on_screen(SpecimenID, "CANCEL") == {"VITD": [("1", None), ("3", None)], "ACTH": [("2", None)]}
+
+def test_cancels_each_set_and_closes_record(monkeypatch, SpecimenID):
+    Screen = FakeCancelScreen({SpecimenID: ["VITD", "ACTH", "B12"]})
+    Ops = run(monkeypatch, Screen, SpecimenID, ["VITD", "B12"])
+    assert [x.Outcome for x in Ops] == ["Done", "Done"]
+    assert Screen.Specimens[SpecimenID] == ["ACTH"]
+    assert Screen.State == "Prompt" and not Screen.Misfed
+
+def test_missing_set_after_reopen_leaves_nothing_open(monkeypatch, SpecimenID):
+    Screen = FakeCancelScreen({SpecimenID: ["VITD", "ACTH"]})
+    Ops = run(monkeypatch, Screen, SpecimenID, ["VITD", "B12", "ACTH"])
+    assert [x.Outcome for x in Ops] == ["Done", "NotFound", "Done"]
+    assert Screen.Specimens[SpecimenID] == []
+    assert Screen.State == "Prompt" and not Screen.Misfed
+
+def test_missing_last_set_still_closes_record(monkeypatch, SpecimenID):
+    Screen = FakeCancelScreen({SpecimenID: ["VITD", "ACTH"]})
+    Ops = run(monkeypatch, Screen, SpecimenID, ["VITD", "B12"])
+    assert [x.Outcome for x in Ops] == ["Done", "NotFound"]
+    assert Screen.State == "Prompt" and not Screen.Misfed
+
+def test_locked_specimen(monkeypatch, SpecimenID):
+    Screen = FakeCancelScreen({SpecimenID: ["VITD"]}, Locked={SpecimenID})
+    Ops = run(monkeypatch, Screen, SpecimenID, ["VITD"])
+    assert Ops[0].Outcome == "Locked" and ProfX.WRITE_LOCKED_MSG in Ops[0].Message
+
+def test_dry_run_changes_nothing(monkeypatch, SpecimenID):
+    Screen = FakeCancelScreen({SpecimenID: ["VITD", "ACTH"]})
+    Ops = run(monkeypatch, Screen, SpecimenID, ["ACTH", "VITD"], dryRun=True)
+    assert [(x.Outcome, x.SetIndex) for x in Ops] == [("DryRun", "2"), ("DryRun", "1")]
+    assert Screen.Specimens[SpecimenID] == ["VITD", "ACTH"] and Screen.State == "Prompt"
+
+def test_cancel_requests_drops_repeated_rows(monkeypatch, SpecimenID):
+    Captured = []
+    monkeypatch.setattr(ProfX, "run_write_operations", lambda Ops, **kwargs: Captured.extend(Ops) or Ops)
+    Rows = []
+    for SetCode in ("VITD", "ACTH"):    # One overdue row per set, each carrying every set of the specimen
+        Sample = ProfX.tp_Specimen(SpecimenID)
+        Sample.Sets.append(ProfX.tp_TestSet(Sample=SpecimenID, SetIndex="1", SetCode=SetCode, Status="U"))
+        Rows.append(Sample)
+    ProfX.cancel_requests(Rows + Rows, FilterSets=["VITD", "ACTH"])
+    assert sorted(x.Key for x in Captured) == sorted({x.Key for x in Captured})
+    assert len(Captured) == 2
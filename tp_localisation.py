@@ -36,3 +36,4 @@ class TelePath_Commands:
     QUIT: str
     identify_screen: Callable
     check_sample_id: Callable
+    MAX_SESSIONS: int = 1           # How many simultaneous logins ProfX may use for pipelined work
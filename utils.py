@@ -1,9 +1,14 @@
 #GPL-3.0-or-later
 
 #import logging
+import atexit
 import datetime
+import gzip
 import math
+import queue
 import re
+import threading
+import time
 
 """Extracts the column widths from a variable-whitespace separated table, from a line of headers.
 Headers are assumed *not* to have single spaces in their column names!"""
@@ -54,6 +59,27 @@ def timestamp(fileFormat=False) -> str:
         return datetime.datetime.now().strftime("%y%m%d_%H%M")
     return datetime.datetime.now().strftime("%y-%m-%d %H:%M")
 
+""" json.dump(default=...) hook: encodes datetimes, dates and timedeltas as tagged dicts so json_object_hook() can restore them"""
+def json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return {"__datetime__": obj.isoformat()}
+    if isinstance(obj, datetime.date):
+        return {"__date__": obj.isoformat()}
+    if isinstance(obj, datetime.timedelta):
+        return {"__timedelta__": obj.total_seconds()}
+    return str(obj)
+
+""" json.load(object_hook=...) hook, reverses json_default()"""
+def json_object_hook(obj:dict):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return datetime.date.fromisoformat(obj["__date__"])
+        if "__timedelta__" in obj:
+            return datetime.timedelta(seconds=obj["__timedelta__"])
+    return obj
+
 """ Utility function, testing for truth, otherwise returning None"""
 def value_or_none(item):
     if item:
@@ -101,3 +127,94 @@ def generatePrettyTable(Body, Separator=" | ", Headers=None, printTable=False) -
             print(tableLine)
 
     return prettyTable
+
+
+_OpenWriters = set()
+
+""" A text file written by a background thread, so slow disks (eg. network shares) never hold up the LIMS session.
+    write()/writelines() only queue the text; the thread batches it and writes when flushBytes are pending or flushInterval seconds
+    have passed. flush() asks for an early write without waiting for it. close() writes everything still queued, closes the file,
+    and re-raises any error the thread ran into. Writers that are still open at interpreter exit are closed automatically."""
+class BackgroundWriter():
+    def __init__(self, filePath:str, mode:str='w', encoding:str="utf-8", compress:bool=False, maxQueue:int=10000, 
+                 flushInterval:float=5.0, flushBytes:int=64*1024):
+        if compress and not filePath.endswith(".gz"):
+            filePath = filePath + ".gz"
+        self.FilePath       = filePath
+        self.FlushInterval  = flushInterval
+        self.FlushBytes     = flushBytes
+        self.Error          = None
+        self._Queue         = queue.Queue(maxsize=maxQueue)   # Bounded: if the disk can't keep up at all, writers wait rather than eat memory
+        self._FLUSH         = object()
+        self._CLOSE         = object()
+        if compress:
+            self._IO = gzip.open(filePath, mode.replace('t', '') + 't', encoding=encoding)
+        else:
+            self._IO = open(filePath, mode, encoding=encoding)
+        self._Thread = threading.Thread(target=self._run, name=f"BackgroundWriter({filePath})", daemon=True)
+        self._Thread.start()
+        _OpenWriters.add(self)
+
+    def __repr__(self): return f"BackgroundWriter({self.FilePath})"
+
+    def __enter__(self): return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    @property
+    def closed(self) -> bool: return self not in _OpenWriters
+
+    def _run(self):
+        pending = []
+        nPending = 0
+        lastFlush = time.monotonic()
+        while True:
+            try:
+                item = self._Queue.get(timeout=self.FlushInterval)
+            except queue.Empty:
+                item = None
+            isClose = item is self._CLOSE
+            if isinstance(item, str):
+                pending.append(item)
+                nPending += len(item)
+            if pending and (isClose or item is self._FLUSH or nPending >= self.FlushBytes or time.monotonic() - lastFlush >= self.FlushInterval):
+                try:
+                    self._IO.write("".join(pending))
+                    self._IO.flush()
+                except Exception as e:
+                    self.Error = e
+                pending = []
+                nPending = 0
+                lastFlush = time.monotonic()
+            if isClose:
+                break
+        self._IO.close()
+
+    def write(self, text:str) -> None:
+        if self.Error:
+            raise self.Error
+        self._Queue.put(text)
+
+    def writelines(self, lines) -> None:
+        self.write("".join(lines))
+
+    def flush(self) -> None:
+        self._Queue.put(self._FLUSH)
+
+    def close(self) -> None:
+        if self.closed: return
+        _OpenWriters.discard(self)
+        self._Queue.put(self._CLOSE)
+        self._Thread.join()
+        if self.Error:
+            raise self.Error
+
+@atexit.register
+def _close_open_writers():
+    for writer in list(_OpenWriters):
+        try:
+            writer.close()
+        except Exception:
+            pass
@@ -0,0 +1,247 @@
+#GPL-3.0-or-later
+
+import datetime
+import json
+import logging
+import re
+import sqlite3
+import threading
+import utils
+
+worksheetLogger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_PATH = "./ProfX_Worksheets.sqlite"
+PAGE_BREAK      = "\x12\r\r\x0c"
+END_OF_LIST     = "End of list"
+SPECIMEN_HEADERS    = ("Specimen", "Sample", "Sample No", "Lab No", "Spec No")
+TYPE_HEADERS        = ("Type", "Sample type", "Spec type", "Spec")
+SPECIMEN_REGEX  = re.compile(r"\b(?:[A-Z],)?\d{2}\.\d{7}\.?[A-Z]?\b")     # Full IDs only; a bare lab number is too easily a cup or a count
+
+""" One entry of a worksheet. Parts holds the entry's printed line, or both lines for two-line layouts; Fields maps column header to value."""
+class WorksheetRow():
+    def __init__(self, Parts:list, Fields:dict):
+        self.Parts      = Parts
+        self.Fields     = Fields
+        self.Cup        = Fields.get("Cup")
+        self.SpecimenID = WorksheetRow._first_field(Fields, SPECIMEN_HEADERS)
+        self.SampleType = WorksheetRow._first_field(Fields, TYPE_HEADERS)
+        # Column widths are guessed from the headers, so check the ID is whole: it may not fit its column, or not be in it at all
+        if self.SpecimenID and SPECIMEN_REGEX.fullmatch(self.SpecimenID):
+            IDMatch = SPECIMEN_REGEX.match(self.Line, self.Line.find(self.SpecimenID))
+        else:
+            IDMatch = SPECIMEN_REGEX.search(self.Line)
+        if IDMatch and IDMatch.group(0) != self.SpecimenID:
+            self.SpecimenID = IDMatch.group(0)
+            self.SampleType = WorksheetRow._type_after_ID(Fields, self.Line[IDMatch.end():])
+
+    def __repr__(self): return f"WorksheetRow(Cup={self.Cup}, SpecimenID={self.SpecimenID}, SampleType={self.SampleType})"
+
+    @property
+    def Line(self) -> str: return " ".join(self.Parts)
+
+    @classmethod
+    def from_parts(cls, Parts:list, Headers:list, Widths:list):
+        Fields = {}
+        for Header, HeaderWidths, Part in zip(Headers, Widths, Parts):
+            Fields.update(_split_fields(Header, HeaderWidths, Part))
+        return cls(Parts, Fields)
+
+    """ An ID wider than its column spills into the next one, so when the ID had to be found in the line, the type column cannot be trusted.
+        The type is then the first word after the ID, provided the type column directly follows the specimen column; otherwise unknown."""
+    @staticmethod
+    def _type_after_ID(Fields:dict, Rest:str):
+        Names = list(Fields.keys())
+        IDColumn = next((Names.index(x) for x in SPECIMEN_HEADERS if x in Fields), None)
+        TypeColumn = next((Names.index(x) for x in TYPE_HEADERS if x in Fields), None)
+        Words = Rest.split()
+        if IDColumn is None or TypeColumn != IDColumn + 1 or not Words: return None
+        return Words[0]
+
+    @staticmethod
+    def _first_field(Fields:dict, Headers:tuple):
+        for Header in Headers:
+            if Fields.get(Header): return Fields[Header]
+        return None
+
+
+""" A printed TelePath worksheet (WRPRT), parsed. Headers holds one column header line, or two for layouts that spread each entry over two lines."""
+class Worksheet():
+    def __init__(self, Assay:str, RunDate:datetime.date, RunNo:int, System:str=None, RunHeader:str=None, Headers:list=None, Rows:list=None):
+        self.Assay      = Assay
+        self.RunDate    = RunDate
+        self.RunNo      = int(RunNo)
+        self.System     = System
+        self.RunHeader  = RunHeader
+        self.Headers    = Headers if Headers else []
+        self.Rows       = Rows if Rows else []
+
+    def __repr__(self): return f"Worksheet({self.Assay}, {self.RunDate}, Run {self.RunNo}, {len(self.Rows)} rows)"
+
+    def __len__(self): return len(self.Rows)
+
+    @property
+    def SpecimenIDs(self) -> list: return [x.SpecimenID for x in self.Rows if x.SpecimenID]
+
+    """ The worksheet as text lines, each entry prefixed with run date and number, as get_recent_worksheets() has always written it."""
+    def to_lines(self) -> list:
+        RunDate = self.RunDate.strftime("%d.%m.%y")
+        if len(self.Headers) < 2:
+            Lines = ["Run date Run " + x for x in self.Headers]
+        else:
+            Lines = ["             " + self.Headers[0], "Run date Run " + self.Headers[1]]
+        Lines.extend(f"{RunDate} {self.RunNo:02}  {x.Line}" for x in self.Rows)     # Run number padded to three, under "Run "
+        return [f"{x}\n" for x in Lines]
+
+
+""" Splits the AUX text of a worksheet into its printed lines, lazily."""
+def iter_worksheet_lines(AUXText:str):
+    for line in AUXText.split("\r\n"):
+        for part in line.split(PAGE_BREAK):
+            part = part.strip("\x12")
+            if part: yield part
+
+""" Parses the AUX text of a worksheet in a single pass: the first lines give the system name, the run and the column headers; the page
+    headers repeated on every page are skipped, and entries of two-line layouts (whose second header line starts with 'Cup') are joined.
+    Parsing stops at 'End of list'."""
+def parse_worksheet(AUXText:str, Assay:str, RunDate:datetime.date, RunNo:int) -> Worksheet:
+    #TODO: doesn't work for immunosuppressant sheets, and QC entries of two-line layouts have no second line.
+    Sheet = Worksheet(Assay, RunDate, RunNo)
+    Repeats = set()             # Page headers: system name, run and column headers
+    Widths = []
+    Pending = []                # Lines read so far of the current entry
+    mayBeSecondHeader = False
+    for line in iter_worksheet_lines(AUXText):
+        if line in Repeats: continue
+        if line == END_OF_LIST: break
+        if Sheet.System is None:
+            Sheet.System = line.strip("\r")
+            Repeats.add(Sheet.System)
+        elif Sheet.RunHeader is None:
+            Sheet.RunHeader = line
+        elif not Sheet.Headers or (mayBeSecondHeader and line.split(" ")[0] == "Cup"):
+            Sheet.Headers.append(line)
+            Widths.append(utils.extract_column_widths(line))
+            mayBeSecondHeader = len(Sheet.Headers) == 1
+        else:
+            mayBeSecondHeader = False
+            Pending.append(line)
+            if len(Pending) == len(Sheet.Headers):
+                Sheet.Rows.append(WorksheetRow.from_parts(Pending, Sheet.Headers, Widths))
+                Pending = []
+            continue
+        Repeats.add(line)
+    else:
+        worksheetLogger.warning(f"parse_worksheet(): No '{END_OF_LIST}' in {Assay} worksheet run {RunNo} of {RunDate}; it may be incomplete.")
+    return Sheet
+
+def _split_fields(Header:str, HeaderWidths:list, Line:str) -> dict:
+    if not HeaderWidths:
+        return {Header.strip(): Line.strip()}
+    Names = utils.process_whitespaced_table([Header], HeaderWidths)[0]
+    Values = utils.process_whitespaced_table([Line], HeaderWidths)[0]
+    return {Name: Value for Name, Value in zip(Names, Values) if Name}
+
+
+""" Local, indexed archive of parsed worksheets. Each (assay, run date, run number) is stored once and never rewritten, so only worksheets
+    of days that are over should be added (add() ignores the others unless told otherwise). Entries are stored as printed, with cup,
+    specimen ID and sample type pulled out and indexed, so lookups by specimen or by assay and date never need TelePath."""
+class WorksheetArchive():
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS runs (
+            assay       TEXT NOT NULL,
+            run_date    TEXT NOT NULL,
+            run_no      INTEGER NOT NULL,
+            system      TEXT,
+            run_header  TEXT,
+            headers     TEXT NOT NULL,
+            PRIMARY KEY (assay, run_date, run_no))""",
+        """CREATE TABLE IF NOT EXISTS entries (
+            assay       TEXT NOT NULL,
+            run_date    TEXT NOT NULL,
+            run_no      INTEGER NOT NULL,
+            row_no      INTEGER NOT NULL,
+            cup         TEXT,
+            specimen_id TEXT,
+            sample_type TEXT,
+            line        TEXT NOT NULL,      -- Both lines of two-line entries, separated by a newline
+            PRIMARY KEY (assay, run_date, run_no, row_no))""",
+        "CREATE INDEX IF NOT EXISTS entries_by_specimen ON entries (specimen_id)",
+    ]
+
+    def __init__(self, filePath:str=DEFAULT_ARCHIVE_PATH):
+        self.FilePath   = filePath
+        self._Lock      = threading.RLock()
+        self.DB         = sqlite3.connect(filePath, check_same_thread=False)
+        with self._Lock:
+            for statement in WorksheetArchive.SCHEMA:
+                self.DB.execute(statement)
+            self.DB.commit()
+        worksheetLogger.debug(f"WorksheetArchive(): Opened {filePath}.")
+
+    def __repr__(self): return f"WorksheetArchive({self.FilePath})"
+
+    def close(self) -> None:
+        with self._Lock:
+            self.DB.commit()
+            self.DB.close()
+
+    def has(self, Assay:str, RunDate:datetime.date, RunNo:int) -> bool:
+        with self._Lock:
+            return self.DB.execute("SELECT 1 FROM runs WHERE assay=? AND run_date=? AND run_no=?",
+                                   (Assay, RunDate.isoformat(), int(RunNo))).fetchone() is not None
+
+    """ Archives Sheet, unless it is already archived or (without allowCurrent) its run date is today or later, when it could still change.
+        Returns True if it was added."""
+    def add(self, Sheet:Worksheet, allowCurrent:bool=False) -> bool:
+        if not allowCurrent and Sheet.RunDate >= datetime.date.today(): return False
+        key = (Sheet.Assay, Sheet.RunDate.isoformat(), Sheet.RunNo)
+        with self._Lock:
+            added = self.DB.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                                    key + (Sheet.System, Sheet.RunHeader, json.dumps(Sheet.Headers))).rowcount == 1
+            if added:
+                self.DB.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key + (n, x.Cup, x.SpecimenID, x.SampleType, "\n".join(x.Parts)) for n, x in enumerate(Sheet.Rows)))
+            self.DB.commit()
+        return added
+
+    def _load(self, Assay:str, RunDate:str, RunNo:int, System:str, RunHeader:str, Headers:str) -> Worksheet:
+        Sheet = Worksheet(Assay, datetime.date.fromisoformat(RunDate), RunNo, System, RunHeader, json.loads(Headers))
+        Widths = [utils.extract_column_widths(x) for x in Sheet.Headers]
+        with self._Lock:
+            Lines = self.DB.execute("SELECT line FROM entries WHERE assay=? AND run_date=? AND run_no=? ORDER BY row_no",
+                                    (Assay, RunDate, RunNo)).fetchall()
+        for (Line, ) in Lines:
+            Sheet.Rows.append(WorksheetRow.from_parts(Line.split("\n"), Sheet.Headers, Widths))
+        return Sheet
+
+    def get(self, Assay:str, RunDate:datetime.date, RunNo:int) -> Worksheet:
+        with self._Lock:
+            row = self.DB.execute("SELECT * FROM runs WHERE assay=? AND run_date=? AND run_no=?",
+                                  (Assay, RunDate.isoformat(), int(RunNo))).fetchone()
+        return self._load(*row) if row else None
+
+    """ Returns every archived worksheet with an entry for SpecimenID, oldest first."""
+    def find_specimen(self, SpecimenID) -> list:
+        with self._Lock:
+            rows = self.DB.execute("""SELECT DISTINCT r.* FROM entries e JOIN runs r USING (assay, run_date, run_no)
+                                      WHERE e.specimen_id=? ORDER BY r.run_date, r.assay, r.run_no""", (str(SpecimenID), )).fetchall()
+        return [self._load(*x) for x in rows]
+
+    """ Returns the archived runs of Assay from firstDate to lastDate (inclusive; either may be left open), oldest first."""
+    def find_runs(self, Assay:str, firstDate:datetime.date=None, lastDate:datetime.date=None) -> list:
+        firstDate = firstDate.isoformat() if firstDate else "0000-00-00"
+        lastDate = lastDate.isoformat() if lastDate else "9999-99-99"
+        with self._Lock:
+            rows = self.DB.execute("SELECT * FROM runs WHERE assay=? AND run_date BETWEEN ? AND ? ORDER BY run_date, run_no",
+                                   (Assay, firstDate, lastDate)).fetchall()
+        return [self._load(*x) for x in rows]
+
+
+_DefaultArchive = None
+
+""" Returns the process-wide WorksheetArchive, opening it on first use."""
+def get_archive(filePath:str=DEFAULT_ARCHIVE_PATH) -> WorksheetArchive:
+    global _DefaultArchive
+    if _DefaultArchive is None or _DefaultArchive.FilePath != filePath:
+        _DefaultArchive = WorksheetArchive(filePath)
+    return _DefaultArchive